@@ -0,0 +1,163 @@
+"""Sharded multi-process backfill.
+
+Every table is split into N shards by ranges of the row id of equal size, so each shard reads only its own range
+of the primary key index. The bounds are computed on the first run and kept with the checkpoints.
+Each shard is loaded by its own process with its own Postgres and Elasticsearch connections and keeps its own
+checkpoint, so a failed shard resumes where it stopped, both on a retry and on the next run of the command.
+
+Usage: python backfill.py --shards 8 [--processes 8] [--tables film_work genre person] [--reset]
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from core.config import settings
+from core.logger import logger
+from extractors import queries
+from extractors.base import NIL_UUID, BaseExtractor
+from extractors.film_work import FilmWorkExtractor
+from extractors.genre import GenreExtractor
+from extractors.person import PersonExtractor
+from managers import load, transform
+from utils.connectors import CountingConnection, postgres_connect, shared_elastic_client
+from utils.state import JsonFileStorage, State
+
+EXTRACTORS = {
+    "film_work": FilmWorkExtractor,
+    "genre": GenreExtractor,
+    "person": PersonExtractor,
+}
+MAX_UUID = "ffffffff-ffff-ffff-ffff-ffffffffffff"
+
+
+def create_checkpoint(table: str, shard: int, shards: int) -> State:
+    path = os.path.join(settings.BACKFILL_STATE_DIR, f"{table}_range_{shard}_of_{shards}.json")
+    return State(JsonFileStorage(path))
+
+
+def shard_bounds(pg_conn: CountingConnection, table: str, shards: int) -> list[str]:
+    """Id ranges of the shards as `shards + 1` bounds: shard N loads ids in `(bounds[N], bounds[N + 1]]`.
+
+    The bounds are kept in the state directory, so a resumed backfill keeps the ranges of its checkpoints.
+    """
+    plan = State(JsonFileStorage(os.path.join(settings.BACKFILL_STATE_DIR, f"{table}_{shards}_shards.json")))
+    if bounds := plan.get("bounds"):
+        return bounds
+    extractor: BaseExtractor = EXTRACTORS[table](pg_conn, settings.BACKFILL_CHUNK_SIZE, None)
+    fractions = [shard / shards for shard in range(1, shards)]
+    inner = extractor.fetch_all(extractor.compose(queries.SHARD_BOUNDS), (fractions,))[0]["bounds"]
+    # an empty table has no percentiles, its shards are empty ranges
+    bounds = [NIL_UUID, *(inner or [NIL_UUID] * len(fractions)), MAX_UUID]
+    plan.set("bounds", bounds)
+    return bounds
+
+
+def backfill_shard(table: str, shard: int, shards: int, lower: str, upper: str) -> int:
+    """Load one shard, the ids in `(lower, upper]` of the table, from its checkpoint on. Runs in a worker process"""
+    checkpoint = create_checkpoint(table, shard, shards)
+    if checkpoint.get("done"):
+        return 0
+    pg_conn = postgres_connect(settings.POSTGRES_DSN)
+    try:
+        extractor: BaseExtractor = EXTRACTORS[table](
+            pg_conn,
+            settings.BACKFILL_CHUNK_SIZE,
+            None,
+            itersize=settings.EXTRACT_STREAMING and settings.EXTRACT_ITERSIZE or None,
+            passthrough=settings.EXTRACT_PASSTHROUGH,
+            copy=settings.EXTRACT_COPY,
+        )
+        query = extractor.compose(queries.SHARD_IDS)
+        last_id = checkpoint.get("last_id") or lower
+        total = 0
+        while True:
+            rows = extractor.fetch_all(query, (last_id, upper, settings.BACKFILL_CHUNK_SIZE))
+            if rows:
+                data = extractor.enrich(table, tuple(row["id"] for row in rows))
+                if not settings.EXTRACT_PASSTHROUGH:
+                    data = transform(table, data)
+                total += load(table, data, settings.LOAD_CHUNK_SIZE, settings.EXTRACT_PASSTHROUGH)
+                last_id = rows[-1]["id"]
+                checkpoint.set("last_id", last_id)
+            if len(rows) < settings.BACKFILL_CHUNK_SIZE:
+                break
+        checkpoint.set("done", True)
+        logger.info("Shard %d/%d of %s finished. Total: %d", shard, shards, table, total)
+        return total
+    finally:
+        pg_conn.close()
+        shared_elastic_client.close()
+
+
+def submit_shard(
+    executor: ProcessPoolExecutor,
+    running: dict[Future, tuple[str, int]],
+    bounds: list[str],
+    table: str,
+    shard: int,
+    shards: int,
+):
+    future = executor.submit(backfill_shard, table, shard, shards, bounds[shard], bounds[shard + 1])
+    running[future] = (table, shard)
+
+
+def backfill(tables: list[str], shards: int, processes: int, retries: int) -> bool:
+    """Run every shard of the tables in a process pool. Returns True when all shards are done"""
+    pg_conn = postgres_connect(settings.POSTGRES_DSN)
+    try:
+        bounds = {table: shard_bounds(pg_conn, table, shards) for table in tables}
+    finally:
+        pg_conn.close()
+    # spawn, so workers do not inherit connections of the parent process
+    context = multiprocessing.get_context("spawn")
+    attempts: dict[tuple[str, int], int] = {}
+    failed = []
+    pending = [(table, shard) for table in tables for shard in range(shards)]
+    while pending:
+        # a crashed worker breaks the whole pool: the interrupted shards resume from their checkpoints in a new one
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+            running: dict[Future, tuple[str, int]] = {}
+            for table, shard in pending:
+                submit_shard(executor, running, bounds[table], table, shard, shards)
+            pending = []
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    table, shard = running.pop(future)
+                    if future.exception() is None:
+                        continue
+                    logger.error("Shard %d/%d of %s failed: %s", shard, shards, table, future.exception())
+                    # the worker which crashed the pool is unknown, every interrupted shard spends an attempt
+                    attempts[table, shard] = attempts.get((table, shard), 0) + 1
+                    if attempts[table, shard] > retries:
+                        failed.append((table, shard))
+                    elif isinstance(future.exception(), BrokenProcessPool):
+                        pending.append((table, shard))
+                    else:
+                        submit_shard(executor, running, bounds[table], table, shard, shards)
+    for table, shard in failed:
+        logger.error("Shard %d/%d of %s was not finished, run the command again to resume it", shard, shards, table)
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, default=os.cpu_count())
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--tables", nargs="+", choices=list(EXTRACTORS), default=list(EXTRACTORS))
+    parser.add_argument("--retries", type=int, default=3, help="retries of a failed shard within the run")
+    parser.add_argument("--reset", action="store_true", help="drop the checkpoints and start from scratch")
+    args = parser.parse_args()
+
+    if args.reset:
+        shutil.rmtree(settings.BACKFILL_STATE_DIR, ignore_errors=True)
+    os.makedirs(settings.BACKFILL_STATE_DIR, exist_ok=True)
+    if not backfill(args.tables, args.shards, args.processes, args.retries):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
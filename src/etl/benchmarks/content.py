@@ -0,0 +1,179 @@
+"""Deterministic synthetic `content.*` dataset, generated lazily so that 1M films fit in memory.
+
+Row `number` of every table is derived from the seed and the number alone, so any chunk can be produced
+without generating the rows before it. Dump the tables for COPY into a live Postgres:
+
+    python -m benchmarks.content --films 100000 --out /tmp/content
+    \\copy content.film_work FROM '/tmp/content/film_work.tsv'
+"""
+import argparse
+import csv
+import datetime
+import os
+import random
+import uuid
+from typing import Iterator
+
+ROLES = ("actor", "director", "writer")
+GENRES = 40
+STARTED = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+COLUMNS = {
+    "genre": ("id", "name", "description", "created_at", "updated_at"),
+    "person": ("id", "full_name", "created_at", "updated_at"),
+    "film_work": ("id", "title", "description", "rating", "type", "created_at", "updated_at"),
+    "genre_film_work": ("id", "genre_id", "film_work_id", "created_at"),
+    "person_film_work": ("id", "person_id", "film_work_id", "role", "created_at"),
+}
+KINDS = {table: kind for kind, table in enumerate(COLUMNS, start=1)}
+
+
+class SyntheticContent:
+    def __init__(self, films: int, seed: int = 0):
+        self.films = films
+        self.persons = max(films // 2, 100)
+        self.seed = seed
+
+    def make_id(self, table: str, number: int) -> str:
+        return str(uuid.UUID(int=(KINDS[table] << 120) | (self.seed << 64) | number))
+
+    @staticmethod
+    def number(_id: str) -> int:
+        return uuid.UUID(_id).int & (2**64 - 1)
+
+    @staticmethod
+    def updated_at(number: int) -> datetime.datetime:
+        return STARTED + datetime.timedelta(milliseconds=number)
+
+    def _rng(self, table: str, number: int) -> random.Random:
+        return random.Random((self.seed << 72) | (KINDS[table] << 64) | number)
+
+    def links(self, number: int) -> tuple[list[int], list[tuple[int, str]]]:
+        """Genre numbers and (person number, role) pairs of the film"""
+        rng = self._rng("film_work", number)
+        genres = rng.sample(range(GENRES), rng.randint(1, 3))
+        persons = [(rng.randrange(self.persons), "director") for _ in range(rng.randint(0, 2))]
+        persons += [(rng.randrange(self.persons), "actor") for _ in range(rng.randint(0, 30))]
+        persons += [(rng.randrange(self.persons), "writer") for _ in range(rng.randint(0, 3))]
+        return genres, persons
+
+    def genre(self, number: int) -> dict:
+        return {"id": self.make_id("genre", number), "name": f"Genre {number}"}
+
+    def person(self, number: int) -> dict:
+        return {"id": self.make_id("person", number), "name": f"Person {number}"}
+
+    def film_work(self, number: int) -> dict:
+        rng = self._rng("film_work", number)
+        return {
+            "id": self.make_id("film_work", number),
+            "title": f"Film {number}",
+            "description": "Lorem ipsum dolor sit amet " * rng.randint(1, 20),
+            "rating": round(rng.uniform(0, 10), 1),
+            "type": "movie",
+            "created_at": self.updated_at(number),
+            "updated_at": self.updated_at(number),
+        }
+
+    def tables(self) -> Iterator[tuple[str, dict]]:
+        """Every row of the dataset as (table, row) with the columns of `content.*`"""
+        for number in range(GENRES):
+            genre = self.genre(number)
+            yield "genre", {**genre, "description": None, "created_at": STARTED, "updated_at": STARTED}
+        for number in range(self.persons):
+            person = self.person(number)
+            yield "person", {
+                "id": person["id"],
+                "full_name": person["name"],
+                "created_at": STARTED,
+                "updated_at": STARTED,
+            }
+        link = 0
+        for number in range(self.films):
+            film_work = self.film_work(number)
+            yield "film_work", film_work
+            genres, persons = self.links(number)
+            for genre in genres:
+                link += 1
+                yield "genre_film_work", {
+                    "id": self.make_id("genre_film_work", link),
+                    "genre_id": self.make_id("genre", genre),
+                    "film_work_id": film_work["id"],
+                    "created_at": film_work["created_at"],
+                }
+            for person, role in sorted(set(persons)):
+                link += 1
+                yield "person_film_work", {
+                    "id": self.make_id("person_film_work", link),
+                    "person_id": self.make_id("person", person),
+                    "film_work_id": film_work["id"],
+                    "role": role,
+                    "created_at": film_work["created_at"],
+                }
+
+    def changes(self, start: int, limit: int) -> dict:
+        """Result of `CHANGES_MAIN` for films from `start` on"""
+        numbers = range(start, min(start + limit, self.films))
+        genres, persons = set(), set()
+        for number in numbers:
+            film_genres, film_persons = self.links(number)
+            genres.update(film_genres)
+            persons.update(person for person, _ in film_persons)
+        return {
+            "ids": [self.make_id("film_work", number) for number in numbers],
+            "last_updated_at": numbers and self.updated_at(numbers[-1]) or None,
+            "last_id": numbers and self.make_id("film_work", numbers[-1]) or None,
+            "genre": [self.make_id("genre", number) for number in sorted(genres)],
+            "person": [self.make_id("person", number) for number in sorted(persons)],
+        }
+
+    def enrich_film_work(self, ids: list[str]) -> list[dict]:
+        """Result of `ENRICH_FILM_WORK`"""
+        rows = []
+        for _id in ids:
+            number = self.number(_id)
+            genres, persons = self.links(number)
+            row = self.film_work(number)
+            row["genres"] = [self.genre(genre) for genre in genres]
+            for role in ROLES:
+                numbers = dict.fromkeys(person for person, person_role in persons if person_role == role)
+                row[f"{role}s"] = [self.person(person) for person in numbers]
+            rows.append(row)
+        return rows
+
+    def enrich_genre(self, ids: list[str]) -> list[dict]:
+        return [self.genre(self.number(_id)) for _id in ids]
+
+    def enrich_person(self, ids: list[str]) -> list[dict]:
+        """Result of `ENRICH_PERSON`. Films of a person are sampled, not reverse-indexed from the film links"""
+        rows = []
+        for _id in ids:
+            number = self.number(_id)
+            rng = self._rng("person", number)
+            films = [
+                {"id": self.make_id("film_work", rng.randrange(self.films)), "roles": rng.sample(ROLES, 1)}
+                for _ in range(rng.randint(1, 20))
+            ]
+            rows.append({**self.person(number), "films": films})
+        return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True, help="directory for the <table>.tsv files")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    files = {table: open(os.path.join(args.out, f"{table}.tsv"), "w", encoding="utf-8") for table in COLUMNS}
+    writers = {table: csv.writer(files[table], delimiter="\t", lineterminator="\n") for table in COLUMNS}
+    try:
+        for table, row in SyntheticContent(args.films, args.seed).tables():
+            writers[table].writerow(r"\N" if row[column] is None else row[column] for column in COLUMNS[table])
+    finally:
+        for file in files.values():
+            file.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Offline benchmark of the ETL hot path: extract, transform, serialize and load into a fake bulk sink.
+
+Result sets come from the synthetic dataset or from a recording, so neither Postgres nor Elasticsearch is needed.
+Every size runs in a fresh process, so the reported peak RSS belongs to that size only.
+Run from src/etl with the ETL environment:
+
+    python -m benchmarks.etl --films 10000 100000 1000000
+    python -m benchmarks.etl --record films.pickle --live       # record the result sets of a live Postgres
+    python -m benchmarks.etl --replay films.pickle
+    python -m benchmarks.etl --live --extract-modes cursor streaming copy   # compare the fetch paths on Postgres
+"""
+import argparse
+import dataclasses
+import json
+import multiprocessing
+import resource
+import time
+from typing import Iterable, Iterator
+
+from benchmarks import sink
+from benchmarks.content import SyntheticContent
+from benchmarks.replay import Recorder, read_entries, recording, replaying, synthetic_entries
+from core.config import settings
+from extractors.film_work import FilmWorkExtractor
+from managers import HANDLERS, TABLES, transform
+from utils.connectors import postgres_connect
+
+STAGES = ("extract", "transform", "serialize", "load")
+LOAD_MODES = ("bulk", "streaming", "parallel", "adaptive")
+EXTRACT_MODES = ("cursor", "streaming", "copy")
+
+
+@dataclasses.dataclass
+class StageResult:
+    rows: int = 0
+    seconds: float = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.seconds and self.rows / self.seconds
+
+
+class Timed:
+    """Iterator which measures the time spent producing its items, e.g. generating synthetic result sets"""
+
+    def __init__(self, items: Iterable):
+        self.items = iter(items)
+        self.seconds = 0.0
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self.items)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+def run(films: int, chunk_size: int, load_mode: str, replay: str | None) -> dict:
+    """Drain `FilmWorkExtractor` over the replayed result sets and measure every stage"""
+    sink.stats = sink.SinkStats()
+    client = sink.fake_elastic_client(settings.ELASTIC_HTTP_COMPRESS)
+    results = {stage: StageResult() for stage in STAGES}
+    replay_file = replay and open(replay, "rb")
+    entries = Timed(replay_file and read_entries(replay_file) or synthetic_entries(SyntheticContent(films), chunk_size))
+    extractor = replaying(FilmWorkExtractor, entries)(None, chunk_size, None)
+    loaders = {
+        table: HANDLERS[f"{table}_loader"](HANDLERS[f"{table}_idx"], settings.LOAD_CHUNK_SIZE, client, load_mode)
+        for table in TABLES
+    }
+    has_more = True
+    try:
+        while has_more:
+            started, source = time.perf_counter(), entries.seconds
+            data, _ = extractor.extract()
+            data = {table: list(rows) for table, rows in data.items() if rows}
+            has_more = extractor.has_more
+            # synthetic rows are generated while the extractor waits for them, it is not the extractor's work
+            measure(results["extract"], started, source - entries.seconds, data)
+
+            started = time.perf_counter()
+            data = {table: list(transform(table, rows)) for table, rows in data.items()}
+            measure(results["transform"], started, 0, data)
+
+            started = time.perf_counter()
+            for table, items in data.items():
+                for item in items:
+                    loaders[table]._encode(loaders[table]._build_action(item))
+            measure(results["serialize"], started, 0, data)
+
+            started = time.perf_counter()
+            for table, items in data.items():
+                loaders[table].load(items)
+            measure(results["load"], started, 0, data)
+    finally:
+        if replay_file:
+            replay_file.close()
+
+    report = {
+        stage: dataclasses.asdict(result) | {"rows_per_second": result.rows_per_second}
+        for stage, result in results.items()
+    }
+    report["sink"] = dataclasses.asdict(sink.stats)
+    report["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return report
+
+
+def run_live_extract(mode: str, chunk_size: int) -> dict:
+    """Drain the extraction of film_work from POSTGRES_DSN through one fetch path: a client-side cursor,
+    a server-side cursor (`EXTRACT_ITERSIZE` rows per round trip) or `COPY ... TO STDOUT`. Rows are only counted,
+    so the report is the cost of fetching and decoding the result sets
+    """
+    pg_conn = postgres_connect(settings.POSTGRES_DSN)
+    result = StageResult()
+    try:
+        extractor = FilmWorkExtractor(
+            pg_conn,
+            chunk_size,
+            None,
+            itersize=mode == "streaming" and settings.EXTRACT_ITERSIZE or None,
+            copy=mode == "copy",
+            enrich_batch_size=settings.ENRICH_BATCH_SIZE,
+        )
+        has_more = True
+        started = time.perf_counter()
+        while has_more:
+            data, _ = extractor.extract()
+            result.rows += sum(1 for rows in data.values() for _ in rows)
+            has_more = extractor.has_more
+        result.seconds = time.perf_counter() - started
+    finally:
+        pg_conn.close()
+    return {
+        "extract": dataclasses.asdict(result) | {"rows_per_second": result.rows_per_second},
+        "round_trips": pg_conn.round_trips,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def measure(result: StageResult, started: float, correction: float, data: dict):
+    result.seconds += time.perf_counter() - started + correction
+    result.rows += sum(len(rows) for rows in data.values())
+
+
+def record(path: str, films: int, chunk_size: int, live: bool):
+    """Write the result sets of a drain of film_work: from a live Postgres or from the synthetic dataset"""
+    with open(path, "wb") as file:
+        recorder = Recorder(file)
+        if not live:
+            for name, rows in synthetic_entries(SyntheticContent(films), chunk_size):
+                recorder.write_entry(name, rows)
+            return
+        pg_conn = postgres_connect(settings.POSTGRES_DSN)
+        try:
+            extractor = recording(FilmWorkExtractor, recorder)(pg_conn, chunk_size, None)
+            extractor.extract()
+            while extractor.has_more:
+                extractor.extract()
+        finally:
+            pg_conn.close()
+
+
+def print_report(films: int | str, report: dict):
+    print(f"{films} films, peak RSS {report['peak_rss_mb']:.0f} MB")
+    for stage in STAGES:
+        result = report[stage]
+        print(
+            f"  {stage:<10} {result['rows']:>10} rows {result['seconds']:>9.2f} s "
+            f"{result['rows_per_second']:>10.0f} rows/s"
+        )
+    print("  sink       {documents:>10} docs {bytes:>12} bytes {requests:>6} requests".format(**report["sink"]))
+
+
+def print_extract_report(mode: str, report: dict):
+    result = report["extract"]
+    print(
+        f"{mode:<10} {result['rows']:>10} rows {result['seconds']:>9.2f} s {result['rows_per_second']:>10.0f} rows/s "
+        f"{report['round_trips']:>6} round trips, peak RSS {report['peak_rss_mb']:.0f} MB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--films", type=int, nargs="+", default=[10000])
+    parser.add_argument("--chunk-size", type=int, default=settings.FILM_WORK_CHUNK_SIZE)
+    parser.add_argument("--load-mode", default=settings.LOAD_MODE, choices=LOAD_MODES)
+    parser.add_argument("--replay", help="replay a recording instead of the synthetic dataset")
+    parser.add_argument("--record", help="write a recording to the file and exit")
+    parser.add_argument("--live", action="store_true", help="record from POSTGRES_DSN instead of the synthetic dataset")
+    parser.add_argument("--extract-modes", nargs="+", choices=EXTRACT_MODES, help="compare fetch paths, needs --live")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON, e.g. to compare them in CI")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.films[0], args.chunk_size, args.live)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    if args.extract_modes:
+        if not args.live:
+            parser.error("--extract-modes reads from POSTGRES_DSN, add --live")
+        reports = {}
+        for mode in args.extract_modes:
+            with context.Pool(1) as pool:
+                reports[mode] = pool.apply(run_live_extract, (mode, args.chunk_size))
+        if args.json:
+            print(json.dumps(reports, indent=2))
+            return
+        for mode, report in reports.items():
+            print_extract_report(mode, report)
+        return
+
+    sizes = args.replay and [args.replay] or args.films
+    reports = {}
+    for size in sizes:
+        with context.Pool(1) as pool:
+            films = isinstance(size, int) and size or 0
+            reports[str(size)] = pool.apply(run, (films, args.chunk_size, args.load_mode, args.replay))
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+    for size, report in reports.items():
+        print_report(size, report)
+
+
+if __name__ == "__main__":
+    main()
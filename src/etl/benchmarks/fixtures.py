@@ -0,0 +1,54 @@
+"""Synthetic rows shaped like the results of the enrichment queries"""
+import datetime
+import random
+import uuid
+
+ROLES = ("actor", "director", "writer")
+
+
+def _people(rng: random.Random, count: int) -> list[dict]:
+    return [
+        {"id": str(uuid.UUID(int=rng.getrandbits(128))), "name": f"Person {rng.randint(1, 10**6)}"}
+        for _ in range(count)
+    ]
+
+
+def film_work_rows(count: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [
+        {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "title": f"Film {number}",
+            "description": "Lorem ipsum dolor sit amet " * rng.randint(1, 20),
+            "rating": round(rng.uniform(0, 10), 1),
+            "type": "movie",
+            "created_at": now,
+            "updated_at": now,
+            "genres": _people(rng, rng.randint(1, 3)),
+            "directors": _people(rng, rng.randint(0, 2)),
+            "actors": _people(rng, rng.randint(0, 30)),
+            "writers": _people(rng, rng.randint(0, 3)),
+        }
+        for number in range(count)
+    ]
+
+
+def genre_rows(count: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    return [{"id": str(uuid.UUID(int=rng.getrandbits(128))), "name": f"Genre {number}"} for number in range(count)]
+
+
+def person_rows(count: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    return [
+        {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "name": f"Person {number}",
+            "films": [
+                {"id": str(uuid.UUID(int=rng.getrandbits(128))), "roles": rng.sample(ROLES, rng.randint(1, 2))}
+                for _ in range(rng.randint(1, 20))
+            ],
+        }
+        for number in range(count)
+    ]
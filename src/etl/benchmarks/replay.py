@@ -0,0 +1,101 @@
+"""Recording and replay of extractor result sets.
+
+A recording is a file of consecutive pickled `(statement name, rows)` entries in the order the extractor
+ran its queries. Replaying feeds them back into the extractor instead of Postgres.
+"""
+import pickle
+from typing import BinaryIO, Iterable, Iterator, Type
+
+from benchmarks.content import SyntheticContent
+from extractors import queries
+from extractors.base import BaseExtractor
+from extractors.film_work import FilmWorkExtractor
+from utils.statements import statement_name
+
+
+def quote(identifier: str) -> str:
+    return '"{0}"'.format(identifier.replace('"', '""'))
+
+
+def compose(query: str, schema: str, table: str) -> str:
+    """`BaseExtractor.compose` without a connection"""
+    return query.format(
+        schema=quote(schema),
+        table=quote(table),
+        table_film_work=quote(f"{table}_film_work"),
+        table_id=quote(f"{table}_id"),
+    )
+
+
+def read_entries(file: BinaryIO) -> Iterator[tuple[str, list]]:
+    while True:
+        try:
+            yield pickle.load(file)
+        except EOFError:
+            return
+
+
+class Recorder:
+    def __init__(self, file: BinaryIO):
+        self.file = file
+
+    def write(self, query: str, rows: list):
+        self.write_entry(statement_name(query), rows)
+
+    def write_entry(self, name: str, rows: list):
+        pickle.dump((name, rows), self.file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def recording(extractor_class: Type[BaseExtractor], recorder: Recorder) -> Type[BaseExtractor]:
+    """Extractor which writes every result set it fetches from a live Postgres"""
+
+    class RecordingExtractor(extractor_class):
+        def fetch_all(self, query: str, params: tuple = ()) -> list:
+            rows = super().fetch_all(query, params)
+            recorder.write(query, rows)
+            return rows
+
+        def fetch(self, query: str, params: tuple = ()) -> list:
+            return self.fetch_all(query, params)
+
+    return RecordingExtractor
+
+
+def replaying(extractor_class: Type[BaseExtractor], entries: Iterable[tuple[str, list]]) -> Type[BaseExtractor]:
+    """Extractor which takes result sets from the recorded entries instead of Postgres"""
+    entries = iter(entries)
+
+    class ReplayExtractor(extractor_class):
+        def compose(self, query: str, table: str | None = None) -> str:
+            return compose(query, self.schema, table or self.TABLE_NAME)
+
+        def fetch_all(self, query: str, params: tuple = ()) -> list:
+            name, rows = next(entries, (None, None))
+            if name != statement_name(query):
+                raise LookupError(f"Recording does not match the query: expected {statement_name(query)}, got {name}")
+            return rows
+
+        def fetch(self, query: str, params: tuple = ()) -> list:
+            return self.fetch_all(query, params)
+
+    return ReplayExtractor
+
+
+def synthetic_entries(content: SyntheticContent, chunk_size: int, schema: str = "content") -> Iterator[tuple]:
+    """Entries of `FilmWorkExtractor` draining the synthetic dataset chunk by chunk"""
+    table = FilmWorkExtractor.TABLE_NAME
+    changes_query = statement_name(compose(queries.CHANGES_MAIN, schema, table))
+    enrich_queries = {
+        "film_work": (statement_name(compose(queries.ENRICH_FILM_WORK, schema, table)), content.enrich_film_work),
+        "genre": (statement_name(compose(queries.ENRICH_GENRE, schema, table)), content.enrich_genre),
+        "person": (statement_name(compose(queries.ENRICH_PERSON, schema, table)), content.enrich_person),
+    }
+    for start in range(0, content.films + 1, chunk_size):
+        changes = content.changes(start, chunk_size)
+        yield changes_query, [dict(changes)]
+        if not changes["ids"]:
+            continue
+        for enriched, ids in zip(enrich_queries, (changes["ids"], changes["genre"], changes["person"])):
+            if ids:
+                name, enrich = enrich_queries[enriched]
+                yield name, enrich(ids)
@@ -0,0 +1,57 @@
+"""In-process Elasticsearch which accepts bulk requests and counts what it receives"""
+import dataclasses
+import gzip
+import json
+
+from elastic_transport import ApiResponseMeta, BaseNode, HttpHeaders
+from elastic_transport._node import NodeApiResponse
+from elasticsearch import Elasticsearch
+
+HEADERS = {"x-elastic-product": "Elasticsearch", "content-type": "application/json"}
+
+
+@dataclasses.dataclass
+class SinkStats:
+    requests: int = 0
+    documents: int = 0
+    bytes: int = 0
+
+
+stats = SinkStats()
+
+
+class FakeBulkNode(BaseNode):
+    """Transport node answering every bulk item as succeeded without a network round trip"""
+
+    def perform_request(self, method, target, body=None, headers=None, request_timeout=None) -> NodeApiResponse:
+        response: dict = {}
+        if target.split("?")[0].endswith("/_bulk"):
+            body = body or b""
+            # a real node compresses the body in this method, so compression costs the same here
+            stats.bytes += len(self.config.http_compress and gzip.compress(body) or body)
+            response = {"took": 1, "errors": False, "items": self._bulk(body)}
+        meta = ApiResponseMeta(
+            status=200,
+            http_version="1.1",
+            headers=HttpHeaders(HEADERS),
+            duration=0.0,
+            node=self.config,
+        )
+        return NodeApiResponse(meta, json.dumps(response).encode())
+
+    @staticmethod
+    def _bulk(body: bytes) -> list[dict]:
+        stats.requests += 1
+        items = []
+        lines = iter(body.splitlines())
+        for line in lines:
+            action, info = json.loads(line).popitem()
+            if action != "delete":
+                next(lines)
+            items.append({action: {"_index": info.get("_index"), "_id": info.get("_id"), "status": 200}})
+        stats.documents += len(items)
+        return items
+
+
+def fake_elastic_client(http_compress: bool = False) -> Elasticsearch:
+    return Elasticsearch("http://sink:9200", node_class=FakeBulkNode, http_compress=http_compress)
@@ -11,6 +11,52 @@ class Settings(BaseSettings):
     LOAD_CHUNK_SIZE: int
     STATE_PATH: str
     SLEEP_TIME: int
+    EXTRACT_STREAMING: bool = False
+    EXTRACT_ITERSIZE: int = 500
+    DRAIN_MODE: bool = False
+    PG_PLAN_STATS: bool = False
+    PG_PLAN_STATS_SAMPLE: int = 100
+    CONCURRENT_WORKERS: bool = False
+    CHANGE_CAPTURE: bool = False
+    NOTIFY_CHANNEL: str = "etl_changes"
+    NOTIFY_DEBOUNCE: float = 0.5
+    PIPELINE_MODE: bool = False
+    PIPELINE_QUEUE_SIZE: int = 2
+    ELASTIC_CONNECTIONS_PER_NODE: int = 10
+    ELASTIC_HTTP_COMPRESS: bool = True
+    ELASTIC_HEALTHCHECK_INTERVAL: float = 30
+    LOAD_MODE: str = "bulk"
+    LOAD_THREAD_COUNT: int = 4
+    LOAD_QUEUE_SIZE: int = 4
+    LOAD_MAX_RETRIES: int = 3
+    LOAD_BATCH_BYTES: int = 5 * 1024 * 1024
+    LOAD_MIN_BATCH_BYTES: int = 256 * 1024
+    LOAD_MAX_BATCH_BYTES: int = 50 * 1024 * 1024
+    LOAD_TARGET_TOOK: int = 1000
+    METRICS_PORT: int = 0
+    METRICS_TEXTFILE: str = ""
+    BACKFILL_CHUNK_SIZE: int = 1000
+    BACKFILL_STATE_DIR: str = "backfill"
+    COALESCE_CHANGES: bool = False
+    FINGERPRINT_PATH: str = ""
+    TRANSFORM_VALIDATE: bool = False
+    EXTRACT_PASSTHROUGH: bool = False
+    ENRICH_BATCH_SIZE: int = 1000
+    DELETION_CAPTURE: bool = False
+    TOMBSTONE_CHUNK_SIZE: int = 1000
+    ASYNC_MODE: bool = False
+    ASYNC_POOL_SIZE: int = 10
+    EXTRACT_COPY: bool = False
+    PG_POOL_SIZE: int = 4
+    PG_HEALTHCHECK_INTERVAL: float = 30
+    POLL_MIN_INTERVAL: float = 0.5
+    DEAD_LETTER_PATH: str = "dead_letters.db"
+    FORCEMERGE_TIMEOUT: float = 3600
+    STATE_STORAGE: str = "json"
+    STATE_REDIS_KEY: str = "etl_state"
+    STATE_TABLE: str = "public.etl_state"
+    REDIS_HOST: str = "redis"
+    REDIS_PORT: int = 6379
 
     class Config:
         env_file = ".env"
@@ -6,7 +6,10 @@ LOGGER_CONFIG = {
     "disable_existing_loggers": False,
     "formatters": {
         "default_formatter": {
-            "format": "[%(levelname)s:%(asctime)s | %(module)s:%(funcName)s:%(lineno)s:%(name)s] %(message)s"
+            "format": (
+                "[%(levelname)s:%(asctime)s | %(threadName)s | %(module)s:%(funcName)s:%(lineno)s:%(name)s] "
+                "%(message)s"
+            )
         },
     },
     "handlers": {
@@ -0,0 +1,80 @@
+"""Dead-letter queue of rows which failed transform or indexing.
+
+`list` shows the dead-lettered rows with their errors. `replay` extracts the current version of the rows from
+Postgres, transforms and loads them again: rows which succeed (or no longer exist) leave the queue,
+rows which fail again stay in it with the new error.
+
+Usage: python dead_letters.py list [--tables film_work] [--limit 100]
+       python dead_letters.py replay [--tables film_work genre person]
+"""
+import argparse
+import datetime
+import time
+
+from core.config import settings
+from core.logger import logger
+from extractors.film_work import FilmWorkExtractor
+from extractors.genre import GenreExtractor
+from extractors.person import PersonExtractor
+from managers import load, transform
+from utils.connectors import CountingConnection, postgres_connect, shared_elastic_client
+from utils.dead_letters import DeadLetterStore, get_dead_letter_store
+
+EXTRACTORS = {
+    "film_work": FilmWorkExtractor,
+    "genre": GenreExtractor,
+    "person": PersonExtractor,
+}
+
+
+def replay(pg_conn: CountingConnection, store: DeadLetterStore, table: str, batch_size: int) -> tuple[int, int]:
+    """Reload the dead-lettered rows of `table`. Returns the numbers of resolved and still failing rows"""
+    ids = store.ids(table)
+    started = time.time()
+    extractor = EXTRACTORS[table](pg_conn, batch_size, None, passthrough=settings.EXTRACT_PASSTHROUGH)
+    for start in range(0, len(ids), batch_size):
+        rows = extractor.enrich(table, tuple(ids[start : start + batch_size]))
+        if not settings.EXTRACT_PASSTHROUGH:
+            rows = transform(table, rows)
+        load(table, rows, settings.LOAD_CHUNK_SIZE, settings.EXTRACT_PASSTHROUGH)
+    resolved = store.resolve(table, ids, started)
+    return resolved, len(ids) - resolved
+
+
+def print_entries(store: DeadLetterStore, table: str | None, limit: int):
+    for entry in store.entries(table, limit):
+        updated_at = datetime.datetime.fromtimestamp(entry["updated_at"]).isoformat(sep=" ", timespec="seconds")
+        print(
+            f"{entry['table_name']} {entry['id']} {entry['stage']} attempts={entry['attempts']} {updated_at}\n"
+            f"  {entry['error']}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("list", "replay"))
+    parser.add_argument("--tables", nargs="+", choices=list(EXTRACTORS), default=list(EXTRACTORS))
+    parser.add_argument("--limit", type=int, default=100, help="rows to list")
+    parser.add_argument("--batch-size", type=int, default=settings.ENRICH_BATCH_SIZE, help="rows per replay query")
+    args = parser.parse_args()
+
+    store = get_dead_letter_store()
+    if store is None:
+        raise SystemExit("DEAD_LETTER_PATH is not set")
+    if args.command == "list":
+        for table in args.tables:
+            print_entries(store, table, args.limit)
+        return
+
+    pg_conn = postgres_connect(settings.POSTGRES_DSN)
+    try:
+        for table in args.tables:
+            resolved, failing = replay(pg_conn, store, table, args.batch_size)
+            logger.info("Dead letters of %s: %d resolved, %d still failing", table, resolved, failing)
+    finally:
+        pg_conn.close()
+        shared_elastic_client.close()
+
+
+if __name__ == "__main__":
+    main()
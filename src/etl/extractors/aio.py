@@ -0,0 +1,117 @@
+"""Asyncio extractors on top of an asyncpg pool.
+
+The queries and the contract (`produce`, `enrich`, `extract`, keyset watermark) are the same as in `BaseExtractor`,
+the methods are coroutines. asyncpg prepares and caches the statements per connection itself.
+"""
+import asyncio
+import datetime
+import time
+from typing import Type
+
+import asyncpg
+from extractors import queries
+from extractors.base import MIN_WATERMARK, BaseExtractor
+from utils import metrics
+from utils.backoff import async_backoff
+from utils.statements import numbered
+
+MIN_TIMESTAMP = datetime.datetime(1, 1, 1, tzinfo=datetime.timezone.utc)  # asyncpg does not take "-infinity" strings
+
+ENRICH_QUERIES = {
+    "film_work": (queries.ENRICH_FILM_WORK, queries.PASSTHROUGH_FILM_WORK),
+    "genre": (queries.ENRICH_GENRE, queries.PASSTHROUGH_GENRE),
+    "person": (queries.ENRICH_PERSON, queries.PASSTHROUGH_PERSON),
+}
+
+
+def quote_ident(identifier: str) -> str:
+    return '"{0}"'.format(identifier.replace('"', '""'))
+
+
+class AsyncBaseExtractor:
+    """Base async extractor"""
+
+    TABLE_NAME: str
+    MAIN_TABLE: bool
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        chunk_size: int,
+        updated_at: list | str | None,
+        schema: str = "content",
+        passthrough: bool = False,
+        enrich_batch_size: int | None = None,
+    ):
+        self._pool = pool
+        self.chunk_size = chunk_size
+        self.schema = schema
+        self.updated_at = BaseExtractor._watermark(updated_at)
+        self.has_more = False
+        self.passthrough = passthrough
+        self.enrich_batch_size = enrich_batch_size  # ids per enrichment query, batches are queried concurrently
+
+    @classmethod
+    def for_extractor(cls, extractor_class: Type[BaseExtractor]) -> Type["AsyncBaseExtractor"]:
+        """Async extractor of the same table as the sync one"""
+        attributes = {"TABLE_NAME": extractor_class.TABLE_NAME, "MAIN_TABLE": extractor_class.MAIN_TABLE}
+        return type(f"Async{extractor_class.__name__}", (cls,), attributes)
+
+    def compose(self, query: str, table: str | None = None) -> str:
+        table = table or self.TABLE_NAME
+        query = query.format(
+            schema=quote_ident(self.schema),
+            table=quote_ident(table),
+            table_film_work=quote_ident(f"{table}_film_work"),
+            table_id=quote_ident(f"{table}_id"),
+        )
+        return numbered(query)
+
+    @async_backoff((OSError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError))
+    async def fetch_all(self, query: str, params: tuple = ()) -> list[dict]:
+        async with self._pool.acquire() as connection:
+            rows = await connection.fetch(query, *params)
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def _timestamp(value: str) -> datetime.datetime:
+        if value == MIN_WATERMARK[0]:
+            return MIN_TIMESTAMP
+        return datetime.datetime.fromisoformat(value)
+
+    async def produce(self) -> dict[str, tuple]:
+        """Ids of the changed rows of the table and of the linked rows which must be reindexed with them"""
+        started = time.perf_counter()
+        extracted_data = {}
+        query = self.compose(self.MAIN_TABLE and queries.CHANGES_MAIN or queries.CHANGES_RELATED)
+        updated_at, last_id = self.updated_at or MIN_WATERMARK
+        changes = (await self.fetch_all(query, (self._timestamp(updated_at), last_id, self.chunk_size)))[0]
+        ids = changes.pop("ids")
+        self.has_more = len(ids) == self.chunk_size
+        if ids:
+            self.updated_at = [str(changes.pop("last_updated_at")), str(changes.pop("last_id"))]
+            extracted_data[self.TABLE_NAME] = tuple(ids)
+            for table, related_ids in changes.items():
+                extracted_data[table] = tuple(related_ids)
+        metrics.STAGE_SECONDS.labels(self.TABLE_NAME, "produce").observe(time.perf_counter() - started)
+        metrics.ROWS.labels(self.TABLE_NAME, "produce").inc(len(ids))
+        return extracted_data
+
+    async def enrich(self, table: str, ids: tuple) -> list[dict]:
+        """Rows of the table. Batches of a large fan-out are queried concurrently on different pool connections"""
+        started = time.perf_counter()
+        enrich_query, passthrough_query = ENRICH_QUERIES[table]
+        query = self.compose(self.passthrough and passthrough_query or enrich_query)
+        batch_size = self.enrich_batch_size or len(ids)
+        batches = [list(ids[start : start + batch_size]) for start in range(0, len(ids), batch_size)]
+        results = await asyncio.gather(*(self.fetch_all(query, (batch,)) for batch in batches))
+        rows = [row for result in results for row in result]
+        metrics.STAGE_SECONDS.labels(table, "enrich").observe(time.perf_counter() - started)
+        metrics.ROWS.labels(table, "enrich").inc(len(rows))
+        return rows
+
+    async def extract(self) -> tuple[dict, list | None]:
+        extracted_data = await self.produce()
+        tables = [table for table, ids in extracted_data.items() if ids]
+        rows = await asyncio.gather(*(self.enrich(table, extracted_data[table]) for table in tables))
+        return dict(zip(tables, rows)), self.updated_at
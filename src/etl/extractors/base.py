@@ -1,6 +1,26 @@
+import itertools
+import re
+import time
+import uuid
+from collections import defaultdict
+from typing import Iterable, Iterator
+
 import psycopg2
-from psycopg2.extensions import connection as pg_connection
+from core.config import settings
+from core.logger import logger
+from extractors import queries
+from psycopg2 import sql
+from psycopg2.extensions import cursor as pg_cursor
+from utils import copy_stream, metrics, statements
 from utils.backoff import backoff
+from utils.connectors import CountingConnection
+
+NIL_UUID = "00000000-0000-0000-0000-000000000000"
+MIN_WATERMARK = ["-infinity", NIL_UUID]
+PLANNING_TIME = re.compile(r"Planning Time: ([\d.]+) ms")
+
+# executions of every prepared statement in the process, extractors are created anew for every chunk
+_executions: defaultdict[str, Iterator[int]] = defaultdict(itertools.count)
 
 
 class BaseExtractor:
@@ -11,165 +31,205 @@ class BaseExtractor:
 
     def __init__(
         self,
-        connection: pg_connection,
+        connection: CountingConnection,
         chunk_size: int,
-        updated_at: str | None,
+        updated_at: list | str | None,
         schema: str = "content",
+        itersize: int | None = None,
+        plan_stats: bool = False,
+        passthrough: bool = False,
+        enrich_batch_size: int | None = None,
+        copy: bool = False,
+        plan_stats_sample: int = settings.PG_PLAN_STATS_SAMPLE,
     ):
-        self._connection: pg_connection = connection
+        self._connection: CountingConnection = connection
         self.chunk_size = chunk_size
         self.schema = schema
-        self.updated_at = updated_at
-        self.tables = ["film_work", "genre", "person"]
+        self.updated_at = self._watermark(updated_at)
+        self.has_more = False
+        self.itersize = itersize  # rows per round trip of a server-side cursor, None disables streaming
+        self.plan_stats = plan_stats
+        self.plan_stats_sample = plan_stats_sample  # EXPLAIN one of `plan_stats_sample` executions of a statement
+        self.passthrough = passthrough  # enrichment returns final documents as `_id` and `doc` JSON text
+        self.enrich_batch_size = enrich_batch_size  # ids per enrichment query, None enriches all ids at once
+        self.copy = copy  # enrichment streams `COPY ... TO STDOUT` output instead of fetching cursor rows
+        self.planning_time: dict[str, float] = {}
+
+    def compose(self, query: str, table: str | None = None) -> str:
+        """Substitute schema and table identifiers into the query template"""
+        table = table or self.TABLE_NAME
+        return (
+            sql.SQL(query)
+            .format(
+                schema=sql.Identifier(self.schema),
+                table=sql.Identifier(table),
+                table_film_work=sql.Identifier(f"{table}_film_work"),
+                table_id=sql.Identifier(f"{table}_id"),
+            )
+            .as_string(self._connection)
+        )
 
     @backoff(psycopg2.DatabaseError)
-    def fetch_all(self, query):
-        cursor = self._connection.cursor()
-        cursor.execute(query)
-        result = cursor.fetchall()
-        cursor.close()
+    def fetch_all(self, query: str, params: tuple = ()) -> list:
+        """Run the query as a server-side prepared statement"""
+        try:
+            name, execute = statements.prepare(self._connection, query)
+            cursor = self._connection.cursor()
+            if self.plan_stats:
+                self._explain(cursor, name, execute, params)
+            cursor.execute(execute, params)
+            result = cursor.fetchall()
+            cursor.close()
+        except psycopg2.DatabaseError:
+            statements.reset(self._connection)
+            raise
         return result
 
-    def _produce(self) -> dict[str, list]:
+    def fetch_iter(self, query: str, params: tuple = ()) -> Iterator[dict]:
+        """Stream rows through a named (server-side) cursor, fetching `itersize` rows per round trip"""
+        cursor = self._declare_cursor(query, params)
+        try:
+            for number, row in enumerate(cursor):
+                if number % self.itersize == 0:
+                    self._connection.round_trips += 1
+                yield row
+        except psycopg2.DatabaseError:
+            # the rollback drops the cursor together with the aborted transaction
+            statements.reset(self._connection)
+            raise
+        except BaseException:
+            cursor.close()
+            raise
+        cursor.close()
+
+    @backoff(psycopg2.DatabaseError)
+    def _declare_cursor(self, query: str, params: tuple) -> pg_cursor:
+        # DECLARE CURSOR can not be bound to a prepared statement, so the query is only parameterized here
+        cursor = self._connection.cursor(name=f"etl_{self.TABLE_NAME}_{uuid.uuid4().hex}")
+        cursor.itersize = self.itersize
+        try:
+            cursor.execute(query, params)
+        except psycopg2.DatabaseError:
+            # a failed DECLARE aborts the transaction, every retry would fail with InFailedSqlTransaction
+            statements.reset(self._connection)
+            raise
+        return cursor
+
+    def fetch_copy(self, query: str, params: tuple = ()) -> Iterator[dict]:
+        """Stream rows of the query through `COPY ... TO STDOUT`, for full rebuilds"""
+        self._connection.round_trips += 1
+        try:
+            yield from copy_stream.copy_rows(self._connection, query, params)
+        except psycopg2.DatabaseError:
+            statements.reset(self._connection)
+            raise
+
+    def fetch(self, query: str, params: tuple = ()) -> Iterable[dict]:
+        """Fetch query results either as a list or as a lazy stream of rows"""
+        if self.copy:
+            return self.fetch_copy(query, params)
+        if self.itersize:
+            return self.fetch_iter(query, params)
+        return self.fetch_all(query, params)
+
+    def _explain(self, cursor: pg_cursor, name: str, execute: str, params: tuple):
+        """Sample the planning time. EXPLAIN EXECUTE plans the statement like EXECUTE does,
+        so explaining every execution would double the plan counters and the round trips"""
+        self.planning_time.setdefault(name, 0.0)
+        if next(_executions[name]) % self.plan_stats_sample:
+            return
+        cursor.execute(f"EXPLAIN (SUMMARY ON) {execute}", params)
+        for row in cursor.fetchall():
+            if match := PLANNING_TIME.search(row["QUERY PLAN"]):
+                self.planning_time[name] = self.planning_time.get(name, 0) + float(match.group(1))
+
+    def log_plan_stats(self):
+        """Log plan cache hit rate and sampled planning time of the prepared statements used for the chunk.
+
+        The plan counters of pg_prepared_statements (generic_plans, custom_plans) need PostgreSQL 14+.
+        """
+        if not self.plan_stats or not self.planning_time:
+            return
+        with self._connection.cursor() as cursor:
+            cursor.execute(queries.PLAN_CACHE_STATS, (list(self.planning_time),))
+            rows = cursor.fetchall()
+        for row in rows:
+            executions = row["generic_plans"] + row["custom_plans"]
+            logger.info(
+                "Statement %s: plan cache hit rate %.2f (%d/%d), sampled planning time %.3f ms",
+                row["name"],
+                executions and row["generic_plans"] / executions,
+                row["generic_plans"],
+                executions,
+                self.planning_time[row["name"]],
+            )
+        self.planning_time.clear()
+
+    @staticmethod
+    def _watermark(updated_at: list | str | None) -> list | None:
+        """Keyset watermark `[updated_at, id]`. A legacy `updated_at` string is resumed from the first id of its tie"""
+        if isinstance(updated_at, str):
+            return [updated_at, NIL_UUID]
+        return updated_at
+
+    def _produce(self) -> dict[str, tuple]:
+        """Collect changed ids of the table and ids of the linked tables in one round trip"""
         extracted_data = {}
-        where_str = self.updated_at and f"WHERE updated_at > '{self.updated_at}'" or ""
-        query = """
-                SELECT id, updated_at
-                FROM {schema}.{table}
-                {where_str}
-                ORDER BY updated_at
-                LIMIT {limit};
-            """.format(
-            schema=self.schema,
-            table=self.TABLE_NAME,
-            where_str=where_str,
-            limit=self.chunk_size,
-        )
-        data = self.fetch_all(query)
-        ids = tuple([i["id"] for i in data])
+        query = self.compose(self.MAIN_TABLE and queries.CHANGES_MAIN or queries.CHANGES_RELATED)
+        watermark = self.updated_at or MIN_WATERMARK
+        changes = self.fetch_all(query, (*watermark, self.chunk_size))[0]
+        ids = changes.pop("ids")
+        self.has_more = len(ids) == self.chunk_size
         if ids:
-            if self.MAIN_TABLE:
-                extracted_data[self.TABLE_NAME] = data
-                self.tables.remove(self.TABLE_NAME)
-                for table in self.tables:
-                    query = """
-                        SELECT DISTINCT i.id
-                        FROM {schema}.{table} as i
-                        LEFT JOIN {schema}.{table}_film_work as ifw ON i.id = ifw.{table}_id
-                        WHERE ifw.film_work_id IN {ids};         
-                    """.format(
-                        schema=self.schema, table=table, ids=ids
-                    )
-                    extracted_data[table] = tuple([i["id"] for i in self.fetch_all(query)])
-            else:
-                query = """
-                    SELECT fw.id, i.updated_at
-                    FROM {schema}.film_work fw
-                    LEFT JOIN {schema}.{table}_film_work ifw ON ifw.film_work_id = fw.id
-                    LEFT JOIN {schema}.{table} i ON i.id = ifw.{table}_id
-                    WHERE i.id IN {ids}
-                    ORDER BY i.updated_at;
-                """.format(
-                    schema=self.schema, table=self.TABLE_NAME, ids=ids
-                )
-                extracted_data["film_work"] = self.fetch_all(query)
-                extracted_data[self.TABLE_NAME] = ids
+            self.updated_at = [str(changes.pop("last_updated_at")), str(changes.pop("last_id"))]
+            extracted_data[self.TABLE_NAME] = tuple(ids)
+            for table, related_ids in changes.items():
+                extracted_data[table] = tuple(related_ids)
         return extracted_data
 
-    def _enrich_film_work(self, ids: tuple) -> list:
-        query = """
-            SELECT 
-                fw.id,
-                fw.title,
-                fw.description,
-                fw.rating,
-                fw.type,
-                fw.created_at,
-                fw.updated_at,
-                COALESCE (
-                   json_agg(
-                       DISTINCT jsonb_build_object(
-                           'id', g.id,
-                           'name', g.name
-                       )
-                   ) FILTER (WHERE g.id is not null),
-                   '[]'
-                ) as genres,
-                COALESCE(
-                   json_agg(
-                   DISTINCT jsonb_build_object(
-                           'id', p.id,
-                           'name', p.full_name
-                       )
-                   ) FILTER (WHERE p.id is not null AND pfw.role = 'director'),
-                   '[]'
-                ) as directors,
-                COALESCE(
-                   json_agg(
-                   DISTINCT jsonb_build_object(
-                           'id', p.id,
-                           'name', p.full_name
-                       )
-                   ) FILTER (WHERE p.id is not null AND pfw.role = 'actor'),
-                   '[]'
-                ) as actors,
-                COALESCE(
-                   json_agg(
-                   DISTINCT jsonb_build_object(
-                           'id', p.id,
-                           'name', p.full_name
-                       )
-                   ) FILTER (WHERE p.id is not null AND pfw.role = 'writer'),
-                   '[]'
-                ) as writers
-            FROM {schema}.film_work fw
-            LEFT JOIN {schema}.person_film_work pfw ON pfw.film_work_id = fw.id
-            LEFT JOIN {schema}.person p ON p.id = pfw.person_id
-            LEFT JOIN {schema}.genre_film_work gfw ON gfw.film_work_id = fw.id
-            LEFT JOIN {schema}.genre g ON g.id = gfw.genre_id
-            WHERE fw.id IN {ids}
-            GROUP BY fw.id
-            ORDER BY fw.updated_at;
-        """.format(
-            schema=self.schema, ids=ids
-        )
+    def _enrich_film_work(self, ids: tuple) -> Iterable[dict]:
+        query = self.passthrough and queries.PASSTHROUGH_FILM_WORK or queries.ENRICH_FILM_WORK
+        return self.fetch(self.compose(query), (list(ids),))
 
-        return self.fetch_all(query)
+    def _enrich_genre(self, ids: tuple) -> Iterable[dict]:
+        query = self.passthrough and queries.PASSTHROUGH_GENRE or queries.ENRICH_GENRE
+        return self.fetch(self.compose(query), (list(ids),))
 
-    def _enrich_genre(self, ids: tuple) -> list:
-        query = """
-            SELECT DISTINCT id, name
-            FROM {schema}.genre
-            WHERE genre.id IN {ids};
-        """.format(
-            schema=self.schema, ids=ids
-        )
-        return self.fetch_all(query)
-
-    def _enrich_person(self, ids: tuple) -> list:
-        query = """
-                SELECT id, full_name as name, 
-                COALESCE(json_agg(DISTINCT jsonb_build_object('id', film_work_id, 'roles', roles))) as films 
-                FROM (SELECT p.id, p.full_name, pfw.film_work_id, array_agg(DISTINCT pfw.role) as roles 
-                FROM {schema}.person as p
-                LEFT JOIN {schema}.person_film_work as pfw on p.id = pfw.person_id
-                WHERE p.id in {ids}
-                GROUP BY p.id, pfw.film_work_id) as temp_persons
-                GROUP BY id, full_name;
-            """.format(
-            schema=self.schema, ids=ids
-        )
+    def _enrich_person(self, ids: tuple) -> Iterable[dict]:
+        query = self.passthrough and queries.PASSTHROUGH_PERSON or queries.ENRICH_PERSON
+        return self.fetch(self.compose(query), (list(ids),))
+
+    def produce(self) -> dict[str, tuple]:
+        """Ids of the changed rows of the table and of the linked rows which must be reindexed with them"""
+        with metrics.stage(self.TABLE_NAME, "produce"):
+            extracted_data = self._produce()
+        metrics.ROWS.labels(self.TABLE_NAME, "produce").inc(len(extracted_data.get(self.TABLE_NAME, ())))
+        return extracted_data
+
+    def enrich(self, table: str, ids: tuple) -> Iterable[dict]:
+        """Rows of the table with everything needed to build Elasticsearch documents"""
+        started = time.perf_counter()
+        if self.enrich_batch_size and len(ids) > self.enrich_batch_size:
+            rows = self._enrich_batches(table, ids)
+        else:
+            rows = getattr(self, f"_enrich_{table}")(ids)
+        return metrics.track(rows, table, "enrich", time.perf_counter() - started)
+
+    def _enrich_batches(self, table: str, ids: tuple) -> Iterator[dict]:
+        """Enrich a large fan-out (films of changed persons or genres) batch by batch.
 
-        return self.fetch_all(query)
+        The next batch is queried only when the rows of the previous one are consumed,
+        so memory and query time stay bounded by `enrich_batch_size`.
+        """
+        enrich = getattr(self, f"_enrich_{table}")
+        for start in range(0, len(ids), self.enrich_batch_size):
+            yield from enrich(ids[start : start + self.enrich_batch_size])
 
-    def extract(self) -> tuple[dict, str]:
-        extracted_data = self._produce()
+    def extract(self) -> tuple[dict, list | None]:
+        extracted_data = self.produce()
 
-        if data := extracted_data.get("film_work"):
-            self.updated_at = str(data[-1]["updated_at"])
-            extracted_data["film_work"] = self._enrich_film_work(tuple([i["id"] for i in data]))
-        if data := extracted_data.get("genre"):
-            extracted_data["genre"] = self._enrich_genre(tuple(data))
-        if data := extracted_data.get("person"):
-            extracted_data["person"] = self._enrich_person(tuple(data))
+        for table, ids in extracted_data.items():
+            if ids:
+                extracted_data[table] = self.enrich(table, ids)
+        self.log_plan_stats()
         return extracted_data, self.updated_at
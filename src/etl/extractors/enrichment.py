@@ -0,0 +1,8 @@
+from extractors.base import BaseExtractor
+
+
+class EnrichmentExtractor(BaseExtractor):
+    """Extractor which only enriches ids collected by other extractors, it has no changes of its own"""
+
+    TABLE_NAME = "enrichment"
+    MAIN_TABLE = False
@@ -0,0 +1,261 @@
+"""SQL queries of the extractors.
+
+Identifiers (`{schema}`, `{table}`, ...) are composed with `psycopg2.sql`, values are always passed as `%s` parameters.
+"""
+
+# Changed rows of the table by keyset pagination on (updated_at, id), see sql/keyset_indexes.sql for the index
+CHANGES_MAIN = """
+    WITH changed AS (
+        SELECT id, updated_at
+        FROM {schema}.{table}
+        WHERE (updated_at, id) > (%s::timestamptz, %s::uuid)
+        ORDER BY updated_at, id
+        LIMIT %s
+    ), last AS (
+        SELECT id, updated_at
+        FROM changed
+        ORDER BY updated_at DESC, id DESC
+        LIMIT 1
+    )
+    SELECT
+        ARRAY(SELECT id::text FROM changed ORDER BY updated_at, id) as ids,
+        (SELECT updated_at FROM last) as last_updated_at,
+        (SELECT id FROM last) as last_id,
+        ARRAY(
+            SELECT DISTINCT gfw.genre_id::text
+            FROM {schema}.genre_film_work gfw
+            JOIN changed c ON c.id = gfw.film_work_id
+        ) as genre,
+        ARRAY(
+            SELECT DISTINCT pfw.person_id::text
+            FROM {schema}.person_film_work pfw
+            JOIN changed c ON c.id = pfw.film_work_id
+        ) as person;
+"""
+
+CHANGES_RELATED = """
+    WITH changed AS (
+        SELECT id, updated_at
+        FROM {schema}.{table}
+        WHERE (updated_at, id) > (%s::timestamptz, %s::uuid)
+        ORDER BY updated_at, id
+        LIMIT %s
+    ), last AS (
+        SELECT id, updated_at
+        FROM changed
+        ORDER BY updated_at DESC, id DESC
+        LIMIT 1
+    )
+    SELECT
+        ARRAY(SELECT id::text FROM changed ORDER BY updated_at, id) as ids,
+        (SELECT updated_at FROM last) as last_updated_at,
+        (SELECT id FROM last) as last_id,
+        ARRAY(
+            SELECT DISTINCT ifw.film_work_id::text
+            FROM {schema}.{table_film_work} ifw
+            JOIN changed c ON c.id = ifw.{table_id}
+        ) as film_work;
+"""
+
+FILM_WORK_ROWS = """
+    SELECT
+        fw.id,
+        fw.title,
+        fw.description,
+        fw.rating,
+        fw.type,
+        fw.created_at,
+        fw.updated_at,
+        COALESCE (
+           json_agg(
+               DISTINCT jsonb_build_object(
+                   'id', g.id,
+                   'name', g.name
+               )
+           ) FILTER (WHERE g.id is not null),
+           '[]'
+        ) as genres,
+        COALESCE(
+           json_agg(
+           DISTINCT jsonb_build_object(
+                   'id', p.id,
+                   'name', p.full_name
+               )
+           ) FILTER (WHERE p.id is not null AND pfw.role = 'director'),
+           '[]'
+        ) as directors,
+        COALESCE(
+           json_agg(
+           DISTINCT jsonb_build_object(
+                   'id', p.id,
+                   'name', p.full_name
+               )
+           ) FILTER (WHERE p.id is not null AND pfw.role = 'actor'),
+           '[]'
+        ) as actors,
+        COALESCE(
+           json_agg(
+           DISTINCT jsonb_build_object(
+                   'id', p.id,
+                   'name', p.full_name
+               )
+           ) FILTER (WHERE p.id is not null AND pfw.role = 'writer'),
+           '[]'
+        ) as writers
+    FROM {schema}.film_work fw
+    LEFT JOIN {schema}.person_film_work pfw ON pfw.film_work_id = fw.id
+    LEFT JOIN {schema}.person p ON p.id = pfw.person_id
+    LEFT JOIN {schema}.genre_film_work gfw ON gfw.film_work_id = fw.id
+    LEFT JOIN {schema}.genre g ON g.id = gfw.genre_id
+    WHERE fw.id = ANY(%s::uuid[])
+    GROUP BY fw.id
+"""
+
+ENRICH_FILM_WORK = FILM_WORK_ROWS + "    ORDER BY fw.updated_at;\n"
+
+ENRICH_GENRE = """
+    SELECT DISTINCT id, name
+    FROM {schema}.genre
+    WHERE genre.id = ANY(%s::uuid[]);
+"""
+
+PERSON_ROWS = """
+    SELECT id, full_name as name,
+    COALESCE(json_agg(DISTINCT jsonb_build_object('id', film_work_id, 'roles', roles))) as films
+    FROM (SELECT p.id, p.full_name, pfw.film_work_id, array_agg(DISTINCT pfw.role) as roles
+    FROM {schema}.person as p
+    LEFT JOIN {schema}.person_film_work as pfw on p.id = pfw.person_id
+    WHERE p.id = ANY(%s::uuid[])
+    GROUP BY p.id, pfw.film_work_id) as temp_persons
+    GROUP BY id, full_name
+"""
+
+ENRICH_PERSON = PERSON_ROWS + ";\n"
+
+# Passthrough queries return ready Elasticsearch documents: `_id` and `doc` as JSON text
+
+PASSTHROUGH_FILM_WORK = (
+    """
+    WITH film_works AS ("""
+    + FILM_WORK_ROWS
+    + """), names AS (
+        SELECT
+            fw.id,
+            ARRAY(SELECT i->>'name' FROM json_array_elements(fw.genres) i) as genres_names,
+            ARRAY(SELECT i->>'name' FROM json_array_elements(fw.directors) i) as directors_names,
+            ARRAY(SELECT i->>'name' FROM json_array_elements(fw.actors) i) as actors_names,
+            ARRAY(SELECT i->>'name' FROM json_array_elements(fw.writers) i) as writers_names
+        FROM film_works fw
+    )
+    SELECT
+        fw.id::text as _id,
+        json_build_object(
+            'id', fw.id,
+            'imdb_rating', fw.rating,
+            'title', fw.title,
+            'description', fw.description,
+            'type', fw.type,
+            'genres_names', n.genres_names,
+            'genres', fw.genres,
+            'directors_names', n.directors_names,
+            'actors_names', n.actors_names,
+            'writers_names', n.writers_names,
+            'directors', fw.directors,
+            'actors', fw.actors,
+            'writers', fw.writers,
+            'director', n.directors_names,
+            'genre', n.genres_names
+        )::text as doc
+    FROM film_works fw
+    JOIN names n ON n.id = fw.id
+    ORDER BY fw.updated_at;
+"""
+)
+
+PASSTHROUGH_GENRE = """
+    SELECT id::text as _id, json_build_object('id', id, 'name', name)::text as doc
+    FROM {schema}.genre
+    WHERE genre.id = ANY(%s::uuid[]);
+"""
+
+PASSTHROUGH_PERSON = (
+    """
+    SELECT p.id::text as _id, json_build_object('id', p.id, 'fullname', p.name, 'films', p.films)::text as doc
+    FROM ("""
+    + PERSON_ROWS
+    + """) as p;
+"""
+)
+
+# Deletion capture: a chunk of tombstones (see sql/tombstones.sql) turned into ids to delete and ids to reindex.
+# Rows that exist again (deleted and inserted with the same id) are not deleted.
+TOMBSTONES = """
+    WITH pending AS (
+        SELECT seq, table_name, id, related_id, created_at
+        FROM {schema}.etl_tombstone
+        ORDER BY seq
+        LIMIT %s
+    ), deleted AS (
+        SELECT DISTINCT table_name, id
+        FROM pending
+        WHERE table_name IN ('film_work', 'genre', 'person')
+    )
+    SELECT
+        (SELECT max(seq) FROM pending) as last_seq,
+        (SELECT max(created_at) FROM pending) as last_created_at,
+        (SELECT count(*) FROM pending) as total,
+        ARRAY(SELECT seq FROM pending) as seqs,
+        ARRAY(
+            SELECT d.id::text FROM deleted d
+            WHERE d.table_name = 'film_work' AND NOT EXISTS (SELECT 1 FROM {schema}.film_work fw WHERE fw.id = d.id)
+        ) as deleted_film_work,
+        ARRAY(
+            SELECT d.id::text FROM deleted d
+            WHERE d.table_name = 'genre' AND NOT EXISTS (SELECT 1 FROM {schema}.genre g WHERE g.id = d.id)
+        ) as deleted_genre,
+        ARRAY(
+            SELECT d.id::text FROM deleted d
+            WHERE d.table_name = 'person' AND NOT EXISTS (SELECT 1 FROM {schema}.person p WHERE p.id = d.id)
+        ) as deleted_person,
+        ARRAY(
+            SELECT p.id::text FROM pending p
+            WHERE p.table_name IN ('person_film_work', 'genre_film_work')
+            UNION
+            SELECT pfw.film_work_id::text FROM {schema}.person_film_work pfw
+            JOIN deleted d ON d.table_name = 'person' AND d.id = pfw.person_id
+            UNION
+            SELECT gfw.film_work_id::text FROM {schema}.genre_film_work gfw
+            JOIN deleted d ON d.table_name = 'genre' AND d.id = gfw.genre_id
+        ) as film_work,
+        ARRAY(
+            SELECT DISTINCT p.related_id::text FROM pending p
+            WHERE p.table_name = 'person_film_work'
+        ) as person;
+"""
+
+PURGE_TOMBSTONES = """
+    DELETE FROM {schema}.etl_tombstone
+    WHERE seq = ANY(%s);
+"""
+
+# Backfill: ids splitting the table into shards of equal size, read from the primary key index once
+SHARD_BOUNDS = """
+    SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY id)::text[] as bounds
+    FROM {schema}.{table};
+"""
+
+# Backfill: rows of one shard, the id range `(last id, upper bound]`, a range scan of the primary key index
+SHARD_IDS = """
+    SELECT t.id::text
+    FROM {schema}.{table} t
+    WHERE t.id > %s::uuid AND t.id <= %s::uuid
+    ORDER BY t.id
+    LIMIT %s;
+"""
+
+# generic_plans and custom_plans are in pg_prepared_statements since PostgreSQL 14
+PLAN_CACHE_STATS = """
+    SELECT name, generic_plans, custom_plans
+    FROM pg_prepared_statements
+    WHERE name = ANY(%s);
+"""
@@ -0,0 +1,45 @@
+from extractors import queries
+from extractors.base import BaseExtractor
+
+DELETABLE_TABLES = ("film_work", "genre", "person")
+
+
+class TombstoneExtractor(BaseExtractor):
+    """Extractor of deleted rows.
+
+    The table is read as a queue from its head and the processed tombstones are purged, so no watermark is kept:
+    `seq` is assigned before commit, a slower transaction may commit a tombstone below the last processed one.
+    `produce` returns ids of the documents which referenced deleted rows and must be reindexed, ids of the documents
+    to delete are kept in `deleted`, `seqs` of the read tombstones in `seqs`, the creation time of the newest one
+    in `last_created_at` for the freshness metrics.
+    """
+
+    TABLE_NAME = "etl_tombstone"
+    MAIN_TABLE = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.deleted: dict[str, tuple] = {}
+        self.seqs: list[int] = []
+        self.last_created_at: str | None = None
+
+    def _produce(self) -> dict[str, tuple]:
+        changes = self.fetch_all(self.compose(queries.TOMBSTONES), (self.chunk_size,))[0]
+        self.has_more = changes.pop("total") == self.chunk_size
+        last_seq = changes.pop("last_seq")
+        self.seqs = changes.pop("seqs")
+        last_created_at = changes.pop("last_created_at")
+        self.last_created_at = last_created_at and str(last_created_at)
+        self.deleted = {table: tuple(changes.pop(f"deleted_{table}")) for table in DELETABLE_TABLES}
+        if last_seq is None:
+            return {}
+        self.updated_at = last_seq
+        return {table: tuple(ids) for table, ids in changes.items()}
+
+    def purge(self):
+        """Drop the processed tombstones, only those which were read: a lower `seq` may have committed since"""
+        if not self.seqs:
+            return
+        with self._connection.cursor() as cursor:
+            cursor.execute(self.compose(queries.PURGE_TOMBSTONES), (self.seqs,))
+        self._connection.commit()
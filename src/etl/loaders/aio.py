@@ -0,0 +1,60 @@
+"""Asyncio loading through bulk requests of `AsyncElasticsearch`.
+
+Documents are built and encoded by the sync loader of the table (`_build_doc`), so both runtimes index the same
+documents and settle rejections the same way. The SQLite fingerprint store is queried in a worker thread.
+"""
+import asyncio
+from itertools import islice
+from typing import Callable, Iterable
+
+import elastic_transport
+from elasticsearch import AsyncElasticsearch
+from loaders.base import BaseLoader, BulkStats
+from utils.backoff import async_backoff
+
+
+class AsyncLoader:
+    def __init__(self, loader: BaseLoader, client: AsyncElasticsearch):
+        self.loader = loader
+        self.client = client
+
+    async def load(self, items: Iterable) -> int:
+        """Load items, documents rejected with a retryable status are resent after a non-blocking pause"""
+        return await self._load_entries(self.loader._build_actions(items), self.loader._encode)
+
+    async def load_raw(self, rows: Iterable[dict]) -> int:
+        """Load documents serialized by Postgres without building Python objects"""
+        return await self._load_entries(rows, self.loader._encode_raw)
+
+    async def _load_entries(self, actions: Iterable[dict], encode: Callable[[dict], dict]) -> int:
+        loader = self.loader
+        actions = iter(actions)
+        stats = BulkStats()
+        try:
+            while chunk := list(islice(actions, loader.chunk_size)):
+                chunk = [encode(action) for action in await self._skip_unchanged(chunk)]
+                attempts: dict[str, int] = {}
+                sleep_time = 0.1
+                # documents rejected with a retryable status are resent, like in `BaseLoader._load_chunk`
+                while chunk:
+                    chunk = loader._settle(chunk, await self._bulk(chunk), attempts, stats)
+                    if chunk:
+                        await asyncio.sleep(sleep_time)
+                        sleep_time = min(sleep_time * 2, 10)
+        finally:
+            loader._add_stats(stats)
+            await asyncio.to_thread(loader._save_fingerprints)
+        return stats.succeeded
+
+    async def _skip_unchanged(self, chunk: list[dict]) -> list[dict]:
+        loader = self.loader
+        if loader.fingerprints is None:
+            return chunk
+        hashes = loader._hashes(chunk)
+        indexed = await asyncio.to_thread(loader.fingerprints.get_many, loader.index_name, hashes)
+        return loader._changed(chunk, hashes, indexed)
+
+    @async_backoff((elastic_transport.ConnectionError, elastic_transport.SerializationError))
+    async def _bulk(self, chunk: list[dict]) -> dict[str, dict]:
+        response = await self.client.bulk(operations=[entry["data"] for entry in chunk])
+        return {str(info["_id"]): info for item in response["items"] for info in item.values() if "error" in info}
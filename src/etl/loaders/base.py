@@ -0,0 +1,389 @@
+import abc
+import dataclasses
+import time
+from itertools import chain, islice
+from typing import Any, Callable, Iterable, Iterator
+
+import elastic_transport
+from core.config import settings
+from core.logger import logger
+from elasticsearch import ApiError, Elasticsearch
+from elasticsearch.helpers import bulk, parallel_bulk, streaming_bulk
+from elasticsearch.serializer import JSONSerializer
+from loaders.controller import BulkController, get_controller
+from utils import metrics
+from utils.backoff import backoff
+from utils.connectors import shared_elastic_client
+from utils.dead_letters import dead_letter
+from utils.fingerprints import FingerprintStore, fingerprint, get_fingerprint_store
+
+RETRYABLE_STATUSES = (409, 429, 503)  # version conflict, rejected execution, unavailable shard
+
+serializer = JSONSerializer()
+
+
+@dataclasses.dataclass
+class BulkStats:
+    succeeded: int = 0
+    retried: int = 0
+    failed: int = 0
+
+
+class BaseLoader(abc.ABC):
+    """Base loader"""
+
+    TABLE_NAME: str  # table of the indexed rows, failed documents are dead-lettered under it
+
+    def __init__(
+        self,
+        index_name: str,
+        chunk_size: int,
+        client: Elasticsearch | None = None,
+        mode: str = settings.LOAD_MODE,
+        thread_count: int = settings.LOAD_THREAD_COUNT,
+        queue_size: int = settings.LOAD_QUEUE_SIZE,
+        max_retries: int = settings.LOAD_MAX_RETRIES,
+        fingerprints: FingerprintStore | None = None,
+    ):
+        self.index_name = index_name
+        self.chunk_size = chunk_size
+        self._client = client
+        self.mode = mode  # bulk, streaming, parallel or adaptive
+        self.thread_count = thread_count
+        self.queue_size = queue_size  # chunks waiting for a free thread in the parallel mode
+        self.max_retries = max_retries
+        self.stats = BulkStats()
+        self.fingerprints = fingerprints or get_fingerprint_store()
+        self.skipped = 0
+        self._pending_hashes: dict[str, str] = {}
+        self._loaded_hashes: dict[str, str] = {}
+
+    @property
+    def client(self) -> Elasticsearch:
+        return self._client or shared_elastic_client.get()
+
+    @abc.abstractmethod
+    def _build_doc(self, item: Any) -> dict:
+        """Build Elasticsearch document from the transformed item"""
+
+    def _build_action(self, item: Any) -> dict:
+        return {
+            "_index": self.index_name,
+            "_op_type": "update",
+            "_id": item.id,
+            "doc": self._build_doc(item),
+            "doc_as_upsert": True,
+        }
+
+    def _build_actions(self, items: Iterable) -> Iterator[dict]:
+        """Actions of the items, an item whose document can not be built is dead-lettered"""
+        for item in items:
+            try:
+                yield self._build_action(item)
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                self._reject(getattr(item, "id", None), e, getattr(item, "__dict__", item))
+
+    def _reject(self, _id: Any, error: Any, payload: Any = None):
+        dead_letter(self.TABLE_NAME, _id, "index", error, payload)
+
+    def load(self, items: Iterable) -> int:
+        """Load items chunk by chunk without materializing the whole input. Returns the number of loaded items"""
+        actions: Iterable[dict] = self._build_actions(items)
+        if self.fingerprints is not None:
+            actions = self._skip_unchanged(actions)
+        try:
+            if self.mode == "adaptive":
+                return self._load_adaptive(self._encode(action) for action in actions)
+            if self.mode != "bulk":
+                return self._load_documents(actions)
+            total = 0
+            while chunk := list(islice(actions, self.chunk_size)):
+                total += self._load_chunk(chunk, self._bulk_chunk)
+            return total
+        finally:
+            self._save_fingerprints()
+
+    def delete(self, ids: Iterable[str]) -> int:
+        """Delete documents by id. Documents which are already missing are counted as deleted"""
+        ids = list(ids)
+        actions = ({"_op_type": "delete", "_index": self.index_name, "_id": _id} for _id in ids)
+        deleted = 0
+        for ok, item in streaming_bulk(
+            self.client, actions, chunk_size=self.chunk_size, max_retries=self.max_retries, raise_on_error=False
+        ):
+            _, info = item.popitem()
+            if ok or info.get("status") == 404:
+                deleted += 1
+            else:
+                logger.error("Document %s was not deleted from %s: %s", info["_id"], self.index_name, info)
+        metrics.BULK_DOCUMENTS.labels(self.index_name, "deleted").inc(deleted)
+        if self.fingerprints is not None:
+            self.fingerprints.delete_many(self.index_name, ids)
+        return deleted
+
+    def _skip_unchanged(self, actions: Iterable[dict]) -> Iterator[dict]:
+        """Drop updates whose document is identical to the one indexed before"""
+        actions = iter(actions)
+        while chunk := list(islice(actions, self.chunk_size)):
+            hashes = self._hashes(chunk)
+            yield from self._changed(chunk, hashes, self.fingerprints.get_many(self.index_name, hashes))
+
+    @staticmethod
+    def _hashes(chunk: list[dict]) -> dict[str, str]:
+        return {str(action["_id"]): fingerprint(action["doc"]) for action in chunk}
+
+    def _changed(self, chunk: list[dict], hashes: dict[str, str], indexed: dict[str, str]) -> list[dict]:
+        """Actions of the chunk whose document differs from the indexed one"""
+        changed = []
+        for action in chunk:
+            _id = str(action["_id"])
+            if indexed.get(_id) == hashes[_id]:
+                self.skipped += 1
+                continue
+            self._pending_hashes[_id] = hashes[_id]
+            changed.append(action)
+        return changed
+
+    def _confirm(self, _id: Any):
+        if (_hash := self._pending_hashes.pop(str(_id), None)) is not None:
+            self._loaded_hashes[str(_id)] = _hash
+
+    def _save_fingerprints(self):
+        if self.fingerprints is None:
+            return
+        self.fingerprints.save_many(self.index_name, self._loaded_hashes)
+        if self.skipped:
+            metrics.BULK_DOCUMENTS.labels(self.index_name, "skipped").inc(self.skipped)
+            logger.info("%d unchanged documents of %s were skipped", self.skipped, self.index_name)
+        self._loaded_hashes = {}
+        self._pending_hashes = {}
+        self.skipped = 0
+
+    def _load_chunk(self, chunk: list[dict], send: Callable[[list[dict]], dict[str, dict]]) -> int:
+        """Send a chunk, resend the documents rejected with a retryable status, dead-letter the other rejections.
+
+        `send` returns the error items of the rejected documents by `_id`. Returns the number of loaded documents.
+        """
+        stats = BulkStats()
+        attempts: dict[str, int] = {}
+        sleep_time = 0.1
+        while chunk := self._settle(chunk, send(chunk), attempts, stats):
+            time.sleep(sleep_time)
+            sleep_time = min(sleep_time * 2, 10)
+        self._add_stats(stats)
+        return stats.succeeded
+
+    def _settle(self, chunk: list[dict], rejected: dict[str, dict], attempts: dict[str, int], stats: BulkStats):
+        """Confirm the loaded documents of a sent chunk and dead-letter the rejected ones. Returns the ones to resend"""
+        retries = []
+        for entry in chunk:
+            info = rejected.get(str(entry["_id"]))
+            if info is None:
+                stats.succeeded += 1
+                self._confirm(entry["_id"])
+            elif info.get("status") not in RETRYABLE_STATUSES:
+                stats.failed += 1
+                self._reject(entry["_id"], info.get("error", info), entry.get("doc", entry.get("data")))
+            elif self._can_retry(entry, attempts, stats):
+                retries.append(entry)
+        stats.retried += len(retries)
+        return retries
+
+    @backoff((elastic_transport.ConnectionError, elastic_transport.SerializationError))
+    def _bulk_chunk(self, chunk: list[dict]) -> dict[str, dict]:
+        _, errors = bulk(self.client, actions=chunk, raise_on_error=False)
+        return {str(info["_id"]): info for item in errors for info in item.values()}
+
+    def load_raw(self, rows: Iterable[dict]) -> int:
+        """Load documents serialized by Postgres (`_id` and `doc` JSON text) without building Python objects"""
+        if self.fingerprints is not None:
+            rows = self._skip_unchanged(rows)
+        rows = iter(rows)
+        total = 0
+        try:
+            if self.mode == "adaptive":
+                return self._load_adaptive(self._encode_raw(row) for row in rows)
+            while chunk := list(islice(rows, self.chunk_size)):
+                total += self._load_chunk(chunk, self._bulk_raw_chunk)
+        finally:
+            self._save_fingerprints()
+        return total
+
+    @backoff((elastic_transport.ConnectionError, elastic_transport.SerializationError))
+    def _bulk_raw_chunk(self, chunk: list[dict]) -> dict[str, dict]:
+        operations = []
+        for row in chunk:
+            operations.append('{"update":{"_index":"%s","_id":"%s"}}' % (self.index_name, row["_id"]))
+            operations.append('{"doc":' + row["doc"] + ',"doc_as_upsert":true}')
+        response = self.client.bulk(operations=operations)
+        return {str(info["_id"]): info for item in response["items"] for info in item.values() if "error" in info}
+
+    def _encode(self, action: dict) -> dict:
+        header = serializer.dumps({"update": {"_index": action["_index"], "_id": action["_id"]}})
+        body = serializer.dumps({"doc": action["doc"], "doc_as_upsert": True})
+        return {"_id": action["_id"], "data": header + b"\n" + body}
+
+    def _encode_raw(self, row: dict) -> dict:
+        header = '{"update":{"_index":"%s","_id":"%s"}}' % (self.index_name, row["_id"])
+        return {"_id": row["_id"], "data": (header + '\n{"doc":' + row["doc"] + ',"doc_as_upsert":true}').encode()}
+
+    def _load_adaptive(self, entries: Iterable[dict]) -> int:
+        """Send bulk requests sized by serialized bytes and retry documents rejected with a retryable status"""
+        controller = get_controller(self.index_name)
+        stats = BulkStats()
+        attempts: dict[str, int] = {}
+        entries = iter(entries)
+        retries: list[dict] = []
+        while True:
+            batch, size = [], 0
+            for entry in chain(retries, entries):
+                batch.append(entry)
+                size += len(entry["data"]) + 1
+                if size >= controller.batch_bytes:
+                    break
+            retries = retries[len(batch) :]
+            if not batch:
+                break
+            rejected, throttled = self._send_adaptive(batch, size, stats, controller)
+            if rejected:
+                # only 429 means the cluster is overloaded: the batch shrinks and the pause grows
+                sleep_time = controller.start_sleep_time
+                if throttled:
+                    sleep_time = controller.on_rejection()
+                rejected = [entry for entry in rejected if self._can_retry(entry, attempts, stats)]
+                stats.retried += len(rejected)
+                time.sleep(sleep_time)
+            retries = rejected + retries
+
+        logger.info(
+            "Bulk to %s: %d succeeded, %d retried, %d failed, batch size %d bytes",
+            self.index_name,
+            stats.succeeded,
+            stats.retried,
+            stats.failed,
+            controller.batch_bytes,
+        )
+        self._add_stats(stats)
+        return stats.succeeded
+
+    def _send_adaptive(
+        self, batch: list[dict], size: int, stats: BulkStats, controller: BulkController
+    ) -> tuple[list[dict], bool]:
+        """Send one bulk request. Returns the entries rejected with a retryable status and whether any was a 429"""
+        try:
+            response = self._bulk_operations([entry["data"] for entry in batch])
+        except ApiError as e:
+            if e.status_code in RETRYABLE_STATUSES:
+                logger.warning("Bulk request to %s was rejected: %s", self.index_name, e)
+                return batch, e.status_code == 429
+            if e.status_code != 413:
+                raise
+            controller.on_too_large()
+            if len(batch) == 1:
+                stats.failed += 1
+                self._reject(batch[0]["_id"], f"Document is too large for a bulk request to {self.index_name}")
+                return [], False
+            rejected, throttled = [], False
+            for half in (batch[: len(batch) // 2], batch[len(batch) // 2 :]):
+                half_size = sum(len(entry["data"]) + 1 for entry in half)
+                half_rejected, half_throttled = self._send_adaptive(half, half_size, stats, controller)
+                rejected += half_rejected
+                throttled = throttled or half_throttled
+            return rejected, throttled
+        controller.on_success(response["took"], size)
+        rejected, throttled = [], False
+        for entry, item in zip(batch, response["items"]):
+            _, info = item.popitem()
+            if "error" not in info:
+                stats.succeeded += 1
+                self._confirm(info["_id"])
+            elif info.get("status") in RETRYABLE_STATUSES:
+                rejected.append(entry)
+                throttled = throttled or info["status"] == 429
+            else:
+                stats.failed += 1
+                self._reject(info["_id"], info["error"], entry["data"])
+        return rejected, throttled
+
+    @backoff((elastic_transport.ConnectionError, elastic_transport.SerializationError))
+    def _bulk_operations(self, operations: list[bytes]):
+        return self.client.bulk(operations=operations)
+
+    def _bulk_stream(self, actions: Iterable[dict]) -> Iterator[tuple[bool, dict]]:
+        options = {"chunk_size": self.chunk_size, "raise_on_error": False, "raise_on_exception": False}
+        if self.mode == "parallel":
+            return parallel_bulk(
+                self.client, actions, thread_count=self.thread_count, queue_size=self.queue_size, **options
+            )
+        return streaming_bulk(self.client, actions, max_retries=0, **options)
+
+    @staticmethod
+    def _track(actions: Iterable[dict], inflight: dict[str, dict]) -> Iterator[dict]:
+        """Remember actions sent to Elasticsearch until their result is received"""
+        for action in actions:
+            inflight[str(action["_id"])] = action
+            yield action
+
+    def _load_documents(self, actions: Iterable[dict]) -> int:
+        """Load through streaming/parallel bulk and retry only the documents which failed"""
+        stats = BulkStats()
+        attempts: dict[str, int] = {}
+        pending: Iterator[dict] = iter(actions)
+        exhausted = False
+        sleep_time = 0.1
+        while True:
+            inflight: dict[str, dict] = {}
+            retries = []
+            try:
+                for ok, item in self._bulk_stream(self._track(pending, inflight)):
+                    _, info = item.popitem()
+                    action = inflight.pop(str(info["_id"]))
+                    if ok:
+                        stats.succeeded += 1
+                        self._confirm(info["_id"])
+                    elif info.get("status") in RETRYABLE_STATUSES:
+                        retries.append(action)
+                    else:
+                        stats.failed += 1
+                        self._reject(info["_id"], info.get("error", info), action.get("doc"))
+                exhausted = True
+            except elastic_transport.TransportError as e:
+                # the request was lost, documents without a result are sent again with the rest of the stream
+                logger.error("Bulk request to %s failed: %s", self.index_name, e)
+                retries.extend(inflight.values())
+            retries = [action for action in retries if self._can_retry(action, attempts, stats)]
+            if exhausted and not retries:
+                break
+            stats.retried += len(retries)
+            time.sleep(sleep_time)
+            sleep_time = min(sleep_time * 2, 10)
+            pending = iter(retries) if exhausted else chain(retries, pending)
+
+        logger.info(
+            "Bulk to %s: %d succeeded, %d retried, %d failed",
+            self.index_name,
+            stats.succeeded,
+            stats.retried,
+            stats.failed,
+        )
+        self._add_stats(stats)
+        return stats.succeeded
+
+    def _add_stats(self, stats: BulkStats):
+        for field in dataclasses.fields(stats):
+            value = getattr(stats, field.name)
+            setattr(self.stats, field.name, getattr(self.stats, field.name) + value)
+            metrics.BULK_DOCUMENTS.labels(self.index_name, field.name).inc(value)
+
+    def _can_retry(self, action: dict, attempts: dict[str, int], stats: BulkStats) -> bool:
+        _id = str(action["_id"])
+        attempts[_id] = attempts.get(_id, 0) + 1
+        if attempts[_id] <= self.max_retries:
+            return True
+        stats.failed += 1
+        self._reject(
+            _id,
+            f"Not loaded to {self.index_name} after {self.max_retries} retries",
+            action.get("doc", action.get("data")),
+        )
+        return False
@@ -0,0 +1,78 @@
+"""Adaptive sizing of bulk requests.
+
+A batch is limited by serialized bytes instead of a document count. The limit grows while Elasticsearch answers
+faster than the target `took` time, shrinks proportionally when it answers slower and is halved on 429 rejections.
+"""
+import random
+import threading
+
+from core.config import settings
+from core.logger import logger
+
+
+class BulkController:
+    """Batch size and rejection backoff shared by every loader of one index"""
+
+    def __init__(
+        self,
+        index_name: str,
+        batch_bytes: int = settings.LOAD_BATCH_BYTES,
+        min_bytes: int = settings.LOAD_MIN_BATCH_BYTES,
+        max_bytes: int = settings.LOAD_MAX_BATCH_BYTES,
+        target_took: int = settings.LOAD_TARGET_TOOK,
+        growth: float = 1.25,
+        start_sleep_time: float = 0.1,
+        border_sleep_time: float = 10,
+    ):
+        self.index_name = index_name
+        self.batch_bytes = batch_bytes
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.target_took = target_took  # ms
+        self.growth = growth
+        self.start_sleep_time = start_sleep_time
+        self.border_sleep_time = border_sleep_time
+        self._sleep_time = start_sleep_time
+        self._lock = threading.Lock()
+
+    def on_success(self, took: int, size: int):
+        """Adjust the limit after an accepted bulk request of `size` bytes which took `took` ms"""
+        with self._lock:
+            self._sleep_time = self.start_sleep_time
+            batch_bytes = self.batch_bytes
+            if took > self.target_took:
+                batch_bytes = int(batch_bytes * max(self.target_took / took, 0.5))
+            elif took < self.target_took * 0.8 and size >= batch_bytes * 0.9:
+                # grow only when the batch was full, a short tail says nothing about the capacity
+                batch_bytes = int(batch_bytes * self.growth)
+            self._resize(batch_bytes)
+
+    def on_rejection(self) -> float:
+        """Halve the limit after a 429 rejection. Returns the pause before the retry: exponential with full jitter"""
+        with self._lock:
+            self._resize(self.batch_bytes // 2)
+            sleep_time = random.uniform(0, self._sleep_time)
+            self._sleep_time = min(self._sleep_time * 2, self.border_sleep_time)
+        return sleep_time
+
+    def on_too_large(self):
+        with self._lock:
+            self._resize(self.batch_bytes // 2)
+
+    def _resize(self, batch_bytes: int):
+        batch_bytes = min(max(batch_bytes, self.min_bytes), self.max_bytes)
+        if batch_bytes != self.batch_bytes:
+            logger.debug("Bulk size of %s: %d -> %d bytes", self.index_name, self.batch_bytes, batch_bytes)
+            self.batch_bytes = batch_bytes
+
+
+_controllers: dict[str, BulkController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_controller(index_name: str) -> BulkController:
+    """Process-wide controller of the index, so the learned size survives between ETL cycles"""
+    with _controllers_lock:
+        if index_name not in _controllers:
+            _controllers[index_name] = BulkController(index_name)
+        return _controllers[index_name]
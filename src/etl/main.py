@@ -1,53 +1,315 @@
 """Startup file fot ETL pipeline"""
-import json
+import asyncio
+import contextlib
+import signal
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Type
 
+import redis
 from core.config import settings
 from core.logger import logger
+from extractors.base import BaseExtractor
 from extractors.film_work import FilmWorkExtractor
 from extractors.genre import GenreExtractor
 from extractors.person import PersonExtractor
-from managers import FilmWorkETLManager
-from utils.connectors import elastic_connect, postgres_connect
-from utils.state import JsonFileStorage, State
+from extractors.tombstone import TombstoneExtractor
+from managers import AsyncETLManager, CycleETLManager, DeletionETLManager, FilmWorkETLManager, PipelinedETLManager
+from utils import metrics
+from utils.connectors import (
+    CountingConnection,
+    PostgresPool,
+    async_elastic_connect,
+    asyncpg_pool_connect,
+    postgres_connect,
+    shared_elastic_client,
+)
+from utils.indices import bootstrap_index
+from utils.listener import ChangeListener
+from utils.runtime import PollScheduler, install_signal_handlers, shutdown
+from utils.state import BaseStorage, JsonFileStorage, PostgresStorage, RedisStorage, State
 
 EXTRACTORS_DATA = (
     (FilmWorkExtractor, settings.FILM_WORK_CHUNK_SIZE),
     (GenreExtractor, settings.GENRE_CHUNK_SIZE),
     (PersonExtractor, settings.PERSON_CHUNK_SIZE),
 )
+DELETIONS_DATA = (TombstoneExtractor, settings.TOMBSTONE_CHUNK_SIZE)
+if settings.DELETION_CAPTURE:
+    EXTRACTORS_DATA += (DELETIONS_DATA,)
 
 indexes = settings.ELASTIC_INDEXES.split(",")
 
 
-def main():
-    while True:
-        elk_conn = elastic_connect(settings.ELASTIC_DSN)
-        for index in indexes:
-            if not elk_conn.indices.exists(index=index):
-                with open(f"es_schema/{index}.json", "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                elk_conn.indices.create(index=index, body=data)
-                logger.warning('Index "%s" was created', index)
-        elk_conn.close()
-
-        state: State = State(JsonFileStorage(settings.STATE_PATH))
-        pg_conn = postgres_connect(settings.POSTGRES_DSN)
+def create_indexes():
+    elk_conn = shared_elastic_client.get()
+    for index in indexes:
+        bootstrap_index(elk_conn, index)
+
+
+def create_state() -> State:
+    storage: BaseStorage
+    if settings.STATE_STORAGE == "redis":
+        client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+        storage = RedisStorage(client, settings.STATE_REDIS_KEY)
+    elif settings.STATE_STORAGE == "postgres":
+        storage = PostgresStorage(postgres_connect(settings.POSTGRES_DSN), settings.STATE_TABLE)
+    else:
+        storage = JsonFileStorage(settings.STATE_PATH)
+    return State(storage)
+
+
+def create_pool() -> PostgresPool:
+    return PostgresPool(settings.POSTGRES_DSN, settings.PG_POOL_SIZE, settings.PG_HEALTHCHECK_INTERVAL)
+
+
+def create_scheduler() -> PollScheduler:
+    return PollScheduler(settings.POLL_MIN_INTERVAL, settings.SLEEP_TIME)
+
+
+def run_etl(pg_conn: CountingConnection, extractor_class: Type[BaseExtractor], chunk_size: int, state: State) -> bool:
+    """Returns True when the table may have more changed rows"""
+    manager_kwargs = {}
+    manager_class = FilmWorkETLManager
+    if extractor_class is TombstoneExtractor:
+        manager_class = DeletionETLManager
+    elif settings.PIPELINE_MODE:
+        manager_class = PipelinedETLManager
+        manager_kwargs["queue_size"] = settings.PIPELINE_QUEUE_SIZE
+    etl_manager = manager_class(
+        pg_conn,
+        extractor_class,
+        chunk_size,
+        settings.LOAD_CHUNK_SIZE,
+        state,
+        itersize=settings.EXTRACT_STREAMING and settings.EXTRACT_ITERSIZE or None,
+        plan_stats=settings.PG_PLAN_STATS,
+        passthrough=settings.EXTRACT_PASSTHROUGH,
+        enrich_batch_size=settings.ENRICH_BATCH_SIZE,
+        **manager_kwargs,
+    )
+    if settings.DRAIN_MODE:
+        etl_manager.drain()
+        return False
+    return etl_manager.run()
+
+
+def create_listener() -> ChangeListener | None:
+    if not settings.CHANGE_CAPTURE:
+        return None
+    return ChangeListener(settings.POSTGRES_DSN, settings.NOTIFY_CHANNEL, settings.NOTIFY_DEBOUNCE)
+
+
+def run_tables(pg_conn: CountingConnection, changed_tables: set[str], state: State) -> bool:
+    has_more = False
+    for extractor_class, extractor_chunk_size in EXTRACTORS_DATA:
+        if shutdown.is_set():
+            break
+        if changed_tables and extractor_class.TABLE_NAME not in changed_tables:
+            continue
+        has_more = run_etl(pg_conn, extractor_class, extractor_chunk_size, state) or has_more
+    return has_more
+
+
+def run_cycle(pg_conn: CountingConnection, changed_tables: set[str], state: State) -> bool:
+    """Process changes of all tables at once, so every object is indexed at most once per cycle"""
+    extractors_data = [data for data in EXTRACTORS_DATA if not changed_tables or data[0].TABLE_NAME in changed_tables]
+    has_more = False
+    if DELETIONS_DATA in extractors_data:
+        extractors_data.remove(DELETIONS_DATA)
+        has_more = run_etl(pg_conn, *DELETIONS_DATA, state)
+    if not extractors_data or shutdown.is_set():
+        return has_more
+    etl_manager = CycleETLManager(
+        pg_conn,
+        extractors_data,
+        settings.LOAD_CHUNK_SIZE,
+        state,
+        itersize=settings.EXTRACT_STREAMING and settings.EXTRACT_ITERSIZE or None,
+        plan_stats=settings.PG_PLAN_STATS,
+        passthrough=settings.EXTRACT_PASSTHROUGH,
+        enrich_batch_size=settings.ENRICH_BATCH_SIZE,
+    )
+    if settings.DRAIN_MODE:
+        etl_manager.drain()
+        return False
+    return etl_manager.run()
+
+
+def wait_for_changes(listener: ChangeListener | None, timeout: float) -> set[str]:
+    """Wait for NOTIFY from the changed tables if change capture is on. Polling after `timeout` is the safety net.
+
+    Returns early on shutdown.
+    """
+    if listener is None:
+        shutdown.wait(timeout)
+        return set()
+    deadline = time.monotonic() + timeout
+    while not shutdown.is_set() and (remaining := deadline - time.monotonic()) > 0:
+        # the listener is woken up by NOTIFY only, so shutdown is checked between short waits
+        if tables := listener.wait(min(remaining, 1)):
+            return tables
+    return set()
+
+
+def dispatch_changes(listener: ChangeListener, wakeups: dict[str, threading.Event]):
+    while not shutdown.is_set():
+        for table in wait_for_changes(listener, settings.SLEEP_TIME):
+            if table in wakeups:
+                wakeups[table].set()
+
+
+def run_worker(
+    pool: PostgresPool,
+    extractor_class: Type[BaseExtractor],
+    chunk_size: int,
+    state: State,
+    wakeup: threading.Event,
+):
+    """Poll one table on its own pooled Postgres connection, independently of the other tables"""
+    scheduler = create_scheduler()
+    while not shutdown.is_set():
+        has_more = False
         try:
-            for extractor_class, extractor_chunk_size in EXTRACTORS_DATA:
-                etl_manager = FilmWorkETLManager(
-                    pg_conn,
-                    extractor_class,
-                    extractor_chunk_size,
-                    settings.LOAD_CHUNK_SIZE,
-                    state,
+            # pick up watermarks changed outside the process, e.g. reset by hand or by another instance
+            state.refresh()
+            with pool.connection() as pg_conn:
+                round_trips = pg_conn.round_trips
+                has_more = run_etl(pg_conn, extractor_class, chunk_size, state)
+                logger.info(
+                    "%s ETL cycle finished. Postgres round trips: %d",
+                    extractor_class.TABLE_NAME,
+                    pg_conn.round_trips - round_trips,
                 )
-                etl_manager.run()
+            metrics.write_textfile()
         except Exception as e:
             logger.exception(e)
-            pg_conn.close()
+        wakeup.wait(scheduler.next_delay(has_more))
+        wakeup.clear()
+
+
+def run_concurrent(pool: PostgresPool, state: State):
+    """Run a worker thread per table, so a slow table does not delay the others"""
+    wakeups = {extractor_class.TABLE_NAME: threading.Event() for extractor_class, _ in EXTRACTORS_DATA}
+    listener = create_listener()
+    with ThreadPoolExecutor(max_workers=len(EXTRACTORS_DATA) + 1, thread_name_prefix="etl") as executor:
+        if listener:
+            executor.submit(dispatch_changes, listener, wakeups)
+        for extractor_class, extractor_chunk_size in EXTRACTORS_DATA:
+            wakeup = wakeups[extractor_class.TABLE_NAME]
+            executor.submit(run_worker, pool, extractor_class, extractor_chunk_size, state, wakeup)
+        shutdown.wait()
+        # wake the idle workers up, the busy ones stop after their current chunk
+        for wakeup in wakeups.values():
+            wakeup.set()
+    if listener:
+        listener.close()
+
+
+def run_polling(pool: PostgresPool, state: State):
+    """Poll all tables in turn on one pooled Postgres connection"""
+    listener = create_listener()
+    scheduler = create_scheduler()
+    changed_tables: set[str] = set()
+    try:
+        while not shutdown.is_set():
+            has_more = False
+            try:
+                state.refresh()
+                with pool.connection() as pg_conn:
+                    round_trips = pg_conn.round_trips
+                    if settings.COALESCE_CHANGES:
+                        has_more = run_cycle(pg_conn, changed_tables, state)
+                    else:
+                        has_more = run_tables(pg_conn, changed_tables, state)
+                    logger.info("ETL cycle finished. Postgres round trips: %d", pg_conn.round_trips - round_trips)
+                metrics.write_textfile()
+            except Exception as e:
+                logger.exception(e)
+            changed_tables = wait_for_changes(listener, scheduler.next_delay(has_more))
+    finally:
+        if listener:
+            listener.close()
+
+
+async def run_async():
+    """Run the asyncio ETL: every table, enrichment batch and bulk request of a cycle runs concurrently.
+
+    Deletions (DELETION_CAPTURE) run through the sync `DeletionETLManager` in a worker thread before every cycle,
+    on their own Postgres connection.
+    """
+    create_indexes()
+    state = create_state()
+    pool = await asyncpg_pool_connect(settings.POSTGRES_DSN, settings.ASYNC_POOL_SIZE)
+    client = await async_elastic_connect(
+        settings.ELASTIC_DSN,
+        connections_per_node=settings.ELASTIC_CONNECTIONS_PER_NODE,
+        http_compress=settings.ELASTIC_HTTP_COMPRESS,
+        retry_on_timeout=True,
+    )
+    etl_manager = AsyncETLManager(
+        pool,
+        client,
+        [data for data in EXTRACTORS_DATA if data is not DELETIONS_DATA],
+        settings.LOAD_CHUNK_SIZE,
+        state,
+        passthrough=settings.EXTRACT_PASSTHROUGH,
+        enrich_batch_size=settings.ENRICH_BATCH_SIZE,
+    )
+    deletions_conn = None
+    if DELETIONS_DATA in EXTRACTORS_DATA:
+        deletions_conn = postgres_connect(settings.POSTGRES_DSN)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, lambda: (shutdown.set(), stopping.set()))
+    scheduler = create_scheduler()
+    try:
+        while not shutdown.is_set():
+            has_more = False
+            try:
+                state.refresh()
+                if deletions_conn is not None:
+                    has_more = await asyncio.to_thread(run_etl, deletions_conn, *DELETIONS_DATA, state)
+                if settings.DRAIN_MODE:
+                    await etl_manager.drain()
+                else:
+                    has_more = await etl_manager.run() or has_more
+                metrics.write_textfile()
+            except Exception as e:
+                logger.exception(e)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stopping.wait(), scheduler.next_delay(has_more))
+    finally:
+        await pool.close()
+        await client.close()
+        if deletions_conn is not None:
+            deletions_conn.close()
+        shared_elastic_client.close()
+
+
+def main():
+    """Run the ETL as a long-lived process until SIGTERM"""
+    metrics.start_exporter()
+    if settings.ASYNC_MODE:
+        asyncio.run(run_async())
+        return
 
-        time.sleep(settings.SLEEP_TIME)
+    install_signal_handlers()
+    create_indexes()
+    state = create_state()
+    pool = create_pool()
+    try:
+        if settings.CONCURRENT_WORKERS:
+            run_concurrent(pool, state)
+        else:
+            run_polling(pool, state)
+    finally:
+        pool.close()
+        shared_elastic_client.close()
+        metrics.write_textfile()
+        logger.info("ETL stopped")
 
 
 if __name__ == "__main__":
@@ -1,15 +1,30 @@
 """ETL managers"""
-from typing import Type
+import asyncio
+import dataclasses
+import queue
+import threading
+import time
+from itertools import islice
+from typing import Any, Iterable, Iterator, Sequence, Type
 
+import asyncpg
 from core.logger import logger
+from elasticsearch import AsyncElasticsearch
+from extractors.aio import AsyncBaseExtractor
 from extractors.base import BaseExtractor
+from extractors.enrichment import EnrichmentExtractor
+from extractors.tombstone import TombstoneExtractor
+from loaders.aio import AsyncLoader
 from loaders.film_work import FilmWorkLoader
 from loaders.genre import GenreLoader
 from loaders.person import PersonLoader
-from psycopg2.extensions import connection as pg_connection
 from transformers.film_work import FilmWorkTransformer
 from transformers.genre import GenreTransformer
 from transformers.person import PersonTransformer
+from utils import metrics
+from utils.connectors import CountingConnection
+from utils.dead_letters import dead_letter
+from utils.runtime import shutdown
 from utils.state import State
 
 TABLES = ("film_work", "genre", "person")
@@ -27,44 +42,495 @@ HANDLERS = {
 }
 
 
+def transform(table: str, rows: Iterable) -> Iterable:
+    return metrics.track(_isolate(table, rows), table, "transform")
+
+
+def _isolate(table: str, rows: Iterable) -> Iterator:
+    """Transform rows one by one, so a malformed row is dead-lettered instead of failing the whole chunk"""
+    transformer = HANDLERS[f"{table}_transformer"]()
+    for row in rows:
+        try:
+            yield from transformer.transform((row,))
+        except (KeyError, TypeError, ValueError) as e:
+            dead_letter(table, row.get("id"), "transform", e, row)
+
+
+def load(
+    table: str,
+    items: Iterable,
+    load_chunk_size: int,
+    passthrough: bool = False,
+    index_name: str | None = None,
+) -> int:
+    loader = HANDLERS[f"{table}_loader"](index_name or HANDLERS[f"{table}_idx"], load_chunk_size)
+    with metrics.stage(table, "load"):
+        if passthrough:
+            total = loader.load_raw(items)
+        else:
+            total = loader.load(items)
+    metrics.ROWS.labels(table, "load").inc(total)
+    return total
+
+
+def delete(table: str, ids: Iterable[str], load_chunk_size: int) -> int:
+    loader = HANDLERS[f"{table}_loader"](HANDLERS[f"{table}_idx"], load_chunk_size)
+    return loader.delete(ids)
+
+
 class FilmWorkETLManager:
     """Менеджер, который запускает ETL для одной из таблиц"""
 
     def __init__(
         self,
-        pg_conn: pg_connection,
+        pg_conn: CountingConnection,
         extractor_class: Type[BaseExtractor],
         extract_chunk_size: int,
         load_chunk_size: int,
         state: State,
+        itersize: int | None = None,
+        plan_stats: bool = False,
+        passthrough: bool = False,
+        enrich_batch_size: int | None = None,
     ):
         self._pg_conn = pg_conn
         self.extractor_class = extractor_class
         self.extract_chunk_size = extract_chunk_size
         self.load_chunk_size = load_chunk_size
         self.state = state
+        self.itersize = itersize
+        self.plan_stats = plan_stats
+        self.passthrough = passthrough
+        self.enrich_batch_size = enrich_batch_size
+
+    @property
+    def state_key(self) -> str:
+        return f"{self.extractor_class.TABLE_NAME}_updated_at"
 
-    def run(self):
+    def _create_extractor(self) -> BaseExtractor:
+        return self.extractor_class(
+            self._pg_conn,
+            self.extract_chunk_size,
+            self.state.get(self.state_key),
+            itersize=self.itersize,
+            plan_stats=self.plan_stats,
+            passthrough=self.passthrough,
+            enrich_batch_size=self.enrich_batch_size,
+        )
+
+    def _transform(self, table: str, rows: Iterable) -> Iterable:
+        if self.passthrough:
+            return rows
+        return transform(table, rows)
+
+    def _load(self, table: str, items: Iterable) -> int:
+        return load(table, items, self.load_chunk_size, self.passthrough)
+
+    def run(self) -> bool:
+        """Process one chunk. Returns True when the table may have more changed rows"""
         logger.info("Start ETL for %s", self.extractor_class.TABLE_NAME)
-        state_key = f"{self.extractor_class.TABLE_NAME}_updated_at"
-        updated_at = self.state.get(state_key)
+        round_trips = self._pg_conn.round_trips
+
+        extractor = self._create_extractor()
+        with metrics.CHUNK_SECONDS.labels(self.extractor_class.TABLE_NAME).time():
+            data, last_updated_at = extractor.extract()
+
+            if data:
+                for table in TABLES:
+                    total = 0
+                    if data.get(table):
+                        total = self._load(table, self._transform(table, data[table]))
+                    logger.info(
+                        "ETL for %s successfully finished.\nTotal: %d",
+                        table,
+                        total,
+                    )
+                self.state.set(self.state_key, last_updated_at)
+            else:
+                logger.info("No changes in data for ETL")
+        metrics.set_watermark(self.extractor_class.TABLE_NAME, last_updated_at, not extractor.has_more)
+        logger.info(
+            "Postgres round trips for %s chunk: %d",
+            self.extractor_class.TABLE_NAME,
+            self._pg_conn.round_trips - round_trips,
+        )
+        return extractor.has_more
+
+    def drain(self) -> int:
+        """Process chunks back-to-back until the table is drained. Returns the number of processed chunks"""
+        chunks = 1
+        while self.run() and not shutdown.is_set():
+            chunks += 1
+        logger.info("%s drained in %d chunks", self.extractor_class.TABLE_NAME, chunks)
+        return chunks
+
+
+class DeletionETLManager(FilmWorkETLManager):
+    """Менеджер, который удаляет документы удалённых строк и переиндексирует документы, ссылавшиеся на них.
+
+    Обработанные tombstones удаляются из таблицы, поэтому состояние (watermark) не хранится.
+    """
+
+    def run(self) -> bool:
+        """Process one chunk of tombstones. Returns True when more tombstones may be pending"""
+        logger.info("Start ETL for deleted rows")
+        round_trips = self._pg_conn.round_trips
+        extractor: TombstoneExtractor = self._create_extractor()
+        with metrics.CHUNK_SECONDS.labels(extractor.TABLE_NAME).time():
+            data, _ = extractor.extract()
+            if extractor.seqs:
+                self._apply(extractor, data)
+            else:
+                logger.info("No deleted rows for ETL")
+        if extractor.last_created_at:
+            metrics.set_watermark(extractor.TABLE_NAME, [extractor.last_created_at], not extractor.has_more)
+        else:
+            metrics.FRESHNESS_LAG.labels(extractor.TABLE_NAME).set(0)
+        logger.info("Postgres round trips for deleted rows chunk: %d", self._pg_conn.round_trips - round_trips)
+        return extractor.has_more
+
+    def _apply(self, extractor: TombstoneExtractor, data: dict):
+        # documents referencing deleted rows are reindexed first, so a film never points to a deleted document
+        for table in TABLES:
+            if data.get(table):
+                total = self._load(table, self._transform(table, data[table]))
+                logger.info("ETL for %s successfully finished.\nTotal: %d", table, total)
+        for table, ids in extractor.deleted.items():
+            if ids:
+                total = delete(table, ids, self.load_chunk_size)
+                metrics.ROWS.labels(table, "delete").inc(total)
+                logger.info("Deleted %d documents of %s", total, table)
+        extractor.purge()
+
+
+STOP = object()  # marks the end of the chunk stream in the pipeline queues
+
+
+@dataclasses.dataclass
+class StageTimer:
+    """Busy and idle (waiting on a queue) time of a pipeline stage"""
+
+    name: str
+    busy: float = 0
+    idle: float = 0
+
+    @property
+    def utilization(self) -> float:
+        total = self.busy + self.idle
+        return total and self.busy / total
+
+
+class PipelinedETLManager(FilmWorkETLManager):
+    """Менеджер, в котором извлечение, преобразование и загрузка соседних пачек выполняются одновременно.
+
+    Стадии связаны ограниченными очередями: если загрузка не успевает, очереди заполняются
+    и извлечение приостанавливается.
+    """
+
+    def __init__(self, *args, queue_size: int = 2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queue_size = queue_size
+        self._failed = threading.Event()
+        self._errors: list[Exception] = []
+        self._has_more = False
+
+    def run(self) -> bool:
+        """Process chunks until the table is drained or shutdown is requested.
+
+        Returns True only when the run was stopped before the table was drained.
+        """
+        logger.info("Start pipelined ETL for %s", self.extractor_class.TABLE_NAME)
+        self._failed.clear()
+        self._errors.clear()
+        extracted: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        transformed: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        timers = [StageTimer("extract"), StageTimer("transform"), StageTimer("load")]
+        stages = [
+            (self._extract_stage, None, extracted),
+            (self._transform_stage, extracted, transformed),
+            (self._load_stage, transformed, None),
+        ]
+        threads = [
+            threading.Thread(target=self._run_stage, args=(stage, timer, inbox, outbox), name=f"etl-{timer.name}")
+            for (stage, inbox, outbox), timer in zip(stages, timers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for timer in timers:
+            logger.info(
+                "%s %s stage: busy %.3f s, idle %.3f s, utilization %.0f%%",
+                self.extractor_class.TABLE_NAME,
+                timer.name,
+                timer.busy,
+                timer.idle,
+                timer.utilization * 100,
+            )
+        logger.info("Pipeline bottleneck: %s stage", max(timers, key=lambda timer: timer.busy).name)
+        if self._errors:
+            raise self._errors[0]
+        return self._has_more
+
+    def drain(self) -> int:
+        self.run()
+        return 1
+
+    def _run_stage(self, stage, timer: StageTimer, inbox: queue.Queue | None, outbox: queue.Queue | None):
+        try:
+            stage(timer, inbox, outbox)
+        except Exception as e:
+            self._errors.append(e)
+            self._failed.set()
+
+    def _put(self, outbox: queue.Queue, item: Any, timer: StageTimer):
+        started = time.monotonic()
+        while not self._failed.is_set():
+            try:
+                outbox.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        timer.idle += time.monotonic() - started
+
+    def _get(self, inbox: queue.Queue, timer: StageTimer) -> Any:
+        started = time.monotonic()
+        item = STOP
+        while not self._failed.is_set():
+            try:
+                item = inbox.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        timer.idle += time.monotonic() - started
+        return item
 
-        extractor = self.extractor_class(self._pg_conn, self.extract_chunk_size, updated_at)
-        data, last_updated_at = extractor.extract()
+    def _extract_stage(self, timer: StageTimer, inbox: None, outbox: queue.Queue):
+        extractor = self._create_extractor()
+        has_more = True
+        # on shutdown the chunks already in the queues are still transformed and loaded
+        while has_more and not self._failed.is_set() and not shutdown.is_set():
+            started = time.monotonic()
+            data, last_updated_at = extractor.extract()
+            has_more = extractor.has_more
+            parts = self._split(data, extractor.enrich_batch_size)
+            # a chunk whose changes enrich to no rows still sends an empty part, so its watermark is saved
+            part = next(parts, {})
+            timer.busy += time.monotonic() - started
+            while part is not None and not self._failed.is_set():
+                started = time.monotonic()
+                # enrichment runs here, on the extractor connection, not lazily in the transform thread
+                following = next(parts, None)
+                timer.busy += time.monotonic() - started
+                # the watermark travels with the last part, so it is saved only when the whole chunk is loaded
+                self._put(outbox, (part, following is None and last_updated_at or None), timer)
+                part = following
+        self._has_more = has_more
+        self._put(outbox, STOP, timer)
 
-        if data:
+    @staticmethod
+    def _split(data: dict, batch_size: int | None) -> Iterator[dict]:
+        """Materialize the lazily enriched rows in parts of at most `batch_size` rows"""
+        for table, rows in data.items():
+            rows = iter(rows)
+            while part := list(islice(rows, batch_size)):
+                yield {table: part}
+
+    def _transform_stage(self, timer: StageTimer, inbox: queue.Queue, outbox: queue.Queue):
+        while (item := self._get(inbox, timer)) is not STOP:
+            started = time.monotonic()
+            data, last_updated_at = item
+            data = {table: list(self._transform(table, rows)) for table, rows in data.items()}
+            timer.busy += time.monotonic() - started
+            self._put(outbox, (data, last_updated_at), timer)
+        self._put(outbox, STOP, timer)
+
+    def _load_stage(self, timer: StageTimer, inbox: queue.Queue, outbox: None):
+        totals = dict.fromkeys(TABLES, 0)
+        while (item := self._get(inbox, timer)) is not STOP:
+            started = time.monotonic()
+            data, last_updated_at = item
             for table in TABLES:
                 if data.get(table):
-                    transformer = HANDLERS[f"{table}_transformer"]()
-                    data[table] = transformer.transform(data[table])
-                    loader = HANDLERS[f"{table}_loader"](HANDLERS[f"{table}_idx"], self.load_chunk_size)
-                    loader.load(data[table])
-                    if table == "film_work":
-                        self.state.set(state_key, last_updated_at)
-                logger.info(
-                    "ETL for %s successfully finished.\nTotal: %d",
-                    table,
-                    len(data.get(table, [])),
-                )
-        else:
+                    totals[table] += self._load(table, data[table])
+            if last_updated_at is not None:
+                self.state.set(self.state_key, last_updated_at)
+                metrics.set_watermark(self.extractor_class.TABLE_NAME, last_updated_at, caught_up=False)
+            timer.busy += time.monotonic() - started
+        if not self._failed.is_set():
+            watermark = BaseExtractor._watermark(self.state.get(self.state_key))
+            metrics.set_watermark(self.extractor_class.TABLE_NAME, watermark, caught_up=True)
+        for table, total in totals.items():
+            logger.info("ETL for %s successfully finished.\nTotal: %d", table, total)
+
+
+class CycleETLManager:
+    """Менеджер, который собирает изменения всех таблиц за цикл и индексирует каждый объект не более одного раза.
+
+    Фильм может измениться сам и одновременно попасть в выборку через изменённые жанр или персону,
+    поэтому id, полученные от всех экстракторов, объединяются до обогащения и загрузки.
+    """
+
+    def __init__(
+        self,
+        pg_conn: CountingConnection,
+        extractors_data: Sequence[tuple[Type[BaseExtractor], int]],
+        load_chunk_size: int,
+        state: State,
+        itersize: int | None = None,
+        plan_stats: bool = False,
+        passthrough: bool = False,
+        enrich_batch_size: int | None = None,
+    ):
+        self._pg_conn = pg_conn
+        self.extractors_data = extractors_data
+        self.load_chunk_size = load_chunk_size
+        self.state = state
+        self.itersize = itersize
+        self.plan_stats = plan_stats
+        self.passthrough = passthrough
+        self.enrich_batch_size = enrich_batch_size
+
+    def run(self) -> bool:
+        """Process one chunk of every table. Returns True when any table may have more changed rows"""
+        logger.info("Start ETL cycle for %s", ", ".join(cls.TABLE_NAME for cls, _ in self.extractors_data))
+        round_trips = self._pg_conn.round_trips
+        changes: dict[str, set] = {table: set() for table in TABLES}
+        watermarks = {}
+        caught_up: dict[str, bool] = {}
+        contributed = 0
+        has_more = False
+        extractors = []
+        for extractor_class, chunk_size in self.extractors_data:
+            state_key = f"{extractor_class.TABLE_NAME}_updated_at"
+            extractor = self._create_extractor(extractor_class, chunk_size, self.state.get(state_key))
+            extractors.append(extractor)
+            for table, ids in extractor.produce().items():
+                contributed += len(ids)
+                changes[table].update(ids)
+            if extractor.updated_at != self.state.get(state_key):
+                watermarks[state_key] = extractor.updated_at
+            caught_up[extractor_class.TABLE_NAME] = not extractor.has_more
+            has_more = has_more or extractor.has_more
+
+        unique = sum(len(ids) for ids in changes.values())
+        if not unique:
             logger.info("No changes in data for ETL")
+            self._log_plan_stats(extractors)
+            return False
+        logger.info(
+            "Changed ids: %d contributed, %d unique, dedup ratio %.2f",
+            contributed,
+            unique,
+            1 - unique / contributed,
+        )
+
+        # ids are merged across tables, so enrichment belongs to none of the change extractors
+        enrichment = self._create_extractor(EnrichmentExtractor, 0, None)
+        for table in TABLES:
+            total = 0
+            if changes[table]:
+                rows = enrichment.enrich(table, tuple(changes[table]))
+                if not self.passthrough:
+                    rows = transform(table, rows)
+                total = load(table, rows, self.load_chunk_size, self.passthrough)
+            logger.info("ETL for %s successfully finished.\nTotal: %d", table, total)
+        self._log_plan_stats([*extractors, enrichment])
+
+        for state_key, watermark in watermarks.items():
+            self.state.set(state_key, watermark)
+        for table, is_caught_up in caught_up.items():
+            metrics.set_watermark(table, BaseExtractor._watermark(self.state.get(f"{table}_updated_at")), is_caught_up)
+        logger.info("Postgres round trips for ETL cycle: %d", self._pg_conn.round_trips - round_trips)
+        return has_more
+
+    def _create_extractor(self, extractor_class: Type[BaseExtractor], chunk_size: int, updated_at) -> BaseExtractor:
+        return extractor_class(
+            self._pg_conn,
+            chunk_size,
+            updated_at,
+            itersize=self.itersize,
+            plan_stats=self.plan_stats,
+            passthrough=self.passthrough,
+            enrich_batch_size=self.enrich_batch_size,
+        )
+
+    @staticmethod
+    def _log_plan_stats(extractors: Iterable[BaseExtractor]):
+        for extractor in extractors:
+            extractor.log_plan_stats()
+
+    def drain(self) -> int:
+        """Run cycles back-to-back until every table is drained. Returns the number of cycles"""
+        cycles = 1
+        while self.run() and not shutdown.is_set():
+            cycles += 1
+        logger.info("Tables drained in %d cycles", cycles)
+        return cycles
+
+
+class AsyncETLManager:
+    """Менеджер асинхронного ETL.
+
+    Таблицы, запросы обогащения и bulk-запросы выполняются одновременно в одном процессе.
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        client: AsyncElasticsearch,
+        extractors_data: Sequence[tuple[Type[BaseExtractor], int]],
+        load_chunk_size: int,
+        state: State,
+        passthrough: bool = False,
+        enrich_batch_size: int | None = None,
+    ):
+        self._pool = pool
+        self._client = client
+        self.extractors_data = extractors_data
+        self.load_chunk_size = load_chunk_size
+        self.state = state
+        self.passthrough = passthrough
+        self.enrich_batch_size = enrich_batch_size
+
+    async def _load(self, table: str, rows: list) -> int:
+        loader = AsyncLoader(HANDLERS[f"{table}_loader"](HANDLERS[f"{table}_idx"], self.load_chunk_size), self._client)
+        if self.passthrough:
+            return await loader.load_raw(rows)
+        return await loader.load(transform(table, rows))
+
+    async def run_table(self, extractor_class: Type[BaseExtractor], chunk_size: int) -> bool:
+        """Process one chunk of the table. Returns True when the table may have more changed rows"""
+        state_key = f"{extractor_class.TABLE_NAME}_updated_at"
+        extractor = AsyncBaseExtractor.for_extractor(extractor_class)(
+            self._pool,
+            chunk_size,
+            self.state.get(state_key),
+            passthrough=self.passthrough,
+            enrich_batch_size=self.enrich_batch_size,
+        )
+        data, last_updated_at = await extractor.extract()
+        if not data:
+            logger.info("No changes in %s for ETL", extractor_class.TABLE_NAME)
+        else:
+            totals = await asyncio.gather(*(self._load(table, rows) for table, rows in data.items()))
+            for table, total in zip(data, totals):
+                logger.info("ETL for %s successfully finished.\nTotal: %d", table, total)
+            self.state.set(state_key, last_updated_at)
+        metrics.set_watermark(extractor_class.TABLE_NAME, last_updated_at, not extractor.has_more)
+        return extractor.has_more
+
+    async def run(self) -> bool:
+        """Process one chunk of every table concurrently. Returns True when any table may have more changed rows"""
+        results = await asyncio.gather(
+            *(self.run_table(extractor_class, chunk_size) for extractor_class, chunk_size in self.extractors_data)
+        )
+        return any(results)
+
+    async def drain(self) -> int:
+        cycles = 1
+        while await self.run() and not shutdown.is_set():
+            cycles += 1
+        logger.info("Tables drained in %d cycles", cycles)
+        return cycles
@@ -0,0 +1,124 @@
+"""Zero-downtime full reindex.
+
+Builds a new version of an index (`movies_v<N+1>`) with bulk-friendly settings, loads every row into it,
+restores the serving settings, force merges it and atomically moves the alias read by the API.
+
+Usage: python reindex.py movies [genres persons] [--keep-old]
+"""
+import argparse
+from typing import Type
+
+from core.config import settings
+from core.logger import logger
+from extractors.base import NIL_UUID, BaseExtractor
+from extractors.film_work import FilmWorkExtractor
+from extractors.genre import GenreExtractor
+from extractors.person import PersonExtractor
+from managers import load, transform
+from utils.connectors import CountingConnection, postgres_connect, shared_elastic_client
+from utils.fingerprints import get_fingerprint_store
+from utils.indices import create_for_bulk, finalize, next_version, swap_alias
+
+EXTRACTORS = {
+    "movies": FilmWorkExtractor,
+    "genres": GenreExtractor,
+    "persons": PersonExtractor,
+}
+CHUNK_SIZES = {
+    "film_work": settings.FILM_WORK_CHUNK_SIZE,
+    "genre": settings.GENRE_CHUNK_SIZE,
+    "person": settings.PERSON_CHUNK_SIZE,
+}
+
+
+def load_changes(
+    pg_conn: CountingConnection,
+    extractor_class: Type[BaseExtractor],
+    table: str,
+    index: str,
+    updated_at: list | None,
+) -> int:
+    """Load rows of `table` produced by the extractor from the watermark on into `index`"""
+    extractor = extractor_class(
+        pg_conn,
+        CHUNK_SIZES[extractor_class.TABLE_NAME],
+        updated_at,
+        itersize=settings.EXTRACT_STREAMING and settings.EXTRACT_ITERSIZE or None,
+        passthrough=settings.EXTRACT_PASSTHROUGH,
+        copy=settings.EXTRACT_COPY,
+        enrich_batch_size=settings.ENRICH_BATCH_SIZE,
+    )
+    total = 0
+    has_more = True
+    while has_more:
+        ids = extractor.produce().get(table)
+        has_more = extractor.has_more
+        if not ids:
+            continue
+        rows = extractor.enrich(table, ids)
+        if not settings.EXTRACT_PASSTHROUGH:
+            rows = transform(table, rows)
+        total += load(table, rows, settings.LOAD_CHUNK_SIZE, settings.EXTRACT_PASSTHROUGH, index_name=index)
+    return total
+
+
+def catch_up(pg_conn: CountingConnection, table: str, index: str, started_at: str) -> int:
+    """Reload documents of `table` affected by changes of any table since the rebuild has started.
+
+    Every extractor runs, not only the one of `table`: e.g. a person renamed during the rebuild of movies
+    is produced by `PersonExtractor` together with the films the person is linked to.
+    """
+    return sum(
+        load_changes(pg_conn, extractor_class, table, index, [started_at, NIL_UUID])
+        for extractor_class in EXTRACTORS.values()
+    )
+
+
+def reindex(pg_conn: CountingConnection, alias: str, keep_old: bool):
+    client = shared_elastic_client.get()
+    extractor_class = EXTRACTORS[alias]
+    table = extractor_class.TABLE_NAME
+    index = next_version(client, alias)
+
+    with pg_conn.cursor() as cursor:
+        cursor.execute("SELECT now()::text as now;")
+        started_at = cursor.fetchone()["now"]
+
+    restore = create_for_bulk(client, alias, index)
+    total = load_changes(pg_conn, extractor_class, table, index, None)
+    logger.info('%d documents were loaded into "%s"', total, index)
+    total = catch_up(pg_conn, table, index, started_at)
+    logger.info('%d documents changed during the rebuild were reloaded into "%s"', total, index)
+    finalize(client, index, restore, settings.FORCEMERGE_TIMEOUT)
+
+    old_indices = swap_alias(client, alias, index)
+    # hashes of the alias were recorded by the daemon for the old index, with them the catch up below
+    # would skip exactly the documents it has to repair
+    if fingerprints := get_fingerprint_store():
+        fingerprints.clear(index)
+        fingerprints.clear(alias)
+    # the daemon kept writing to the old index until the swap, pick up what it wrote after the catch up
+    catch_up(pg_conn, table, alias, started_at)
+    if not keep_old:
+        for old_index in old_indices:
+            client.indices.delete(index=old_index)
+            logger.warning('Old index "%s" was deleted', old_index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("indexes", nargs="+", choices=sorted(EXTRACTORS))
+    parser.add_argument("--keep-old", action="store_true", help="do not delete the previous index versions")
+    args = parser.parse_args()
+
+    pg_conn = postgres_connect(settings.POSTGRES_DSN)
+    try:
+        for alias in args.indexes:
+            reindex(pg_conn, alias, args.keep_old)
+    finally:
+        pg_conn.close()
+        shared_elastic_client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+-- Indexes for the keyset pagination of the ETL: chunks of changed rows are selected with
+-- WHERE (updated_at, id) > (%s, %s) ORDER BY updated_at, id LIMIT %s (see CHANGES_MAIN and SHARD_IDS),
+-- an index on (updated_at, id) turns it into an index range scan that stops after LIMIT rows.
+--
+-- CONCURRENTLY does not block writes to the tables; it cannot run inside a transaction block,
+-- so apply the file with psql without --single-transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS film_work_updated_at_id_idx ON content.film_work (updated_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genre_updated_at_id_idx ON content.genre (updated_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS person_updated_at_id_idx ON content.person (updated_at, id);
@@ -0,0 +1,49 @@
+-- Change capture for the ETL: every insert/update of content.film_work, content.genre and content.person
+-- sends a NOTIFY on the `etl_changes` channel (see NOTIFY_CHANNEL), so the ETL runs right after the commit
+-- instead of waiting for the next SLEEP_TIME poll.
+--
+-- The channel is read from the `etl.notify_channel` setting, `etl_changes` when it is not set. With a custom
+-- NOTIFY_CHANNEL set it for the database as well: ALTER DATABASE movies_database SET etl.notify_channel = '...';
+--
+-- Triggers are statement-level with transition tables: a bulk update sends one notification per statement.
+-- Changed ids are attached while the payload stays small, otherwise only the table name is sent
+-- (NOTIFY payloads are limited to 8000 bytes).
+
+CREATE OR REPLACE FUNCTION content.notify_etl_change() RETURNS trigger AS $$
+DECLARE
+    changed_ids json;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+        RETURN NULL;
+    END IF;
+    SELECT CASE WHEN count(*) <= 100 THEN json_agg(id) END INTO changed_ids FROM changed_rows;
+    PERFORM pg_notify(
+        coalesce(nullif(current_setting('etl.notify_channel', true), ''), 'etl_changes'),
+        json_build_object('table', TG_TABLE_NAME, 'ids', changed_ids)::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    tbl text;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['film_work', 'genre', 'person'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS etl_notify_insert ON content.%I', tbl);
+        EXECUTE format(
+            'CREATE TRIGGER etl_notify_insert AFTER INSERT ON content.%I '
+            'REFERENCING NEW TABLE AS changed_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION content.notify_etl_change()',
+            tbl
+        );
+        EXECUTE format('DROP TRIGGER IF EXISTS etl_notify_update ON content.%I', tbl);
+        EXECUTE format(
+            'CREATE TRIGGER etl_notify_update AFTER UPDATE ON content.%I '
+            'REFERENCING NEW TABLE AS changed_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION content.notify_etl_change()',
+            tbl
+        );
+    END LOOP;
+END;
+$$;
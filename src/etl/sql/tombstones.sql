@@ -0,0 +1,56 @@
+-- Deletion capture for the ETL: deleted rows of content.film_work, content.genre and content.person and deleted
+-- links of content.person_film_work and content.genre_film_work are written to content.etl_tombstone.
+-- The ETL (DELETION_CAPTURE=True) deletes the documents of deleted rows and reindexes the documents which
+-- referenced them, then purges the processed tombstones.
+--
+-- The wake-up NOTIFY goes to the channel of sql/notify_triggers.sql: `etl.notify_channel` or `etl_changes`.
+--
+-- Triggers are statement-level with transition tables: a bulk delete costs one INSERT ... SELECT per statement.
+
+CREATE TABLE IF NOT EXISTS content.etl_tombstone (
+    seq bigserial PRIMARY KEY,
+    -- film_work, genre or person: `id` is the deleted row
+    -- person_film_work or genre_film_work: `id` is the film of the deleted link, `related_id` is the person or genre
+    table_name text NOT NULL,
+    id uuid NOT NULL,
+    related_id uuid,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION content.etl_tombstone() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'person_film_work' THEN
+        INSERT INTO content.etl_tombstone (table_name, id, related_id)
+        SELECT TG_TABLE_NAME, film_work_id, person_id FROM deleted_rows;
+    ELSIF TG_TABLE_NAME = 'genre_film_work' THEN
+        INSERT INTO content.etl_tombstone (table_name, id, related_id)
+        SELECT TG_TABLE_NAME, film_work_id, genre_id FROM deleted_rows;
+    ELSE
+        INSERT INTO content.etl_tombstone (table_name, id)
+        SELECT TG_TABLE_NAME, id FROM deleted_rows;
+    END IF;
+    IF FOUND THEN
+        PERFORM pg_notify(
+            coalesce(nullif(current_setting('etl.notify_channel', true), ''), 'etl_changes'),
+            json_build_object('table', 'etl_tombstone', 'ids', NULL)::text
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    tbl text;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['film_work', 'genre', 'person', 'person_film_work', 'genre_film_work'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS etl_tombstone_delete ON content.%I', tbl);
+        EXECUTE format(
+            'CREATE TRIGGER etl_tombstone_delete AFTER DELETE ON content.%I '
+            'REFERENCING OLD TABLE AS deleted_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION content.etl_tombstone()',
+            tbl
+        );
+    END LOOP;
+END;
+$$;
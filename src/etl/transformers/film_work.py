@@ -1,17 +1,17 @@
-from typing import Iterable
+from typing import Iterable, Iterator
 
 import models
+from core.config import settings
 
 
 class FilmWorkTransformer:
     """Обрабатывает сырые данные из PostgreSQL и преобразовывает их в формат, пригодный для записи Elasticsearch."""
 
     @staticmethod
-    def transform(data: Iterable):
-        results = []
+    def transform(data: Iterable, validate: bool = settings.TRANSFORM_VALIDATE) -> Iterator[models.FilmWork]:
+        """Rows of our own SQL are trusted, so models are built without validation unless `validate` is set"""
+        build = validate and models.FilmWork or models.FilmWork.model_construct
         for item in data:
             for field in ("genres", "directors", "actors", "writers"):
                 item[f"{field}_names"] = [g["name"] for g in item[field]]
-            results.append(models.FilmWork(**item))
-
-        return results
+            yield build(**item)
@@ -1,4 +1,4 @@
-from typing import Iterable
+from typing import Iterable, Iterator
 
 import models
 
@@ -7,8 +7,6 @@ class GenreTransformer:
     """Обрабатывает сырые данные из PostgreSQL и преобразовывает их в формат, пригодный для записи Elasticsearch."""
 
     @staticmethod
-    def transform(data: Iterable):
-        results = []
+    def transform(data: Iterable) -> Iterator[models.Genre]:
         for item in data:
-            results.append(models.Genre(**item))
-        return results
+            yield models.Genre(**item)
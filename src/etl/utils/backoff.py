@@ -1,3 +1,4 @@
+import asyncio
 import time
 from functools import wraps
 from typing import Type
@@ -42,3 +43,39 @@ def backoff(
         return inner
 
     return func_wrapper
+
+
+def async_backoff(
+    exceptions: Type[Exception] | tuple[Type[Exception], ...] = Exception,
+    start_sleep_time: float = 0.1,
+    factor: float = 2,
+    border_sleep_time: float = 10,
+):
+    """Декоратор `backoff` для корутин: ожидание между попытками не блокирует event loop."""
+
+    def func_wrapper(func):
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            sleep_time = start_sleep_time
+            try_number = 1
+            while True:
+                try:
+                    return await func(*args, **kwargs)
+                except exceptions as e:
+                    logger.error(
+                        "Coroutine %s was failed. Try number: %d. Sleep time: %d. Exception:\n%s",
+                        func.__name__,
+                        try_number,
+                        sleep_time,
+                        str(e),
+                    )
+                    await asyncio.sleep(sleep_time)
+                    if sleep_time < border_sleep_time:
+                        sleep_time = sleep_time * factor**try_number
+                        if sleep_time > border_sleep_time:
+                            sleep_time = border_sleep_time
+                    try_number += 1
+
+        return inner
+
+    return func_wrapper
@@ -1,22 +1,189 @@
+import contextlib
+import json
+import queue
+import threading
+import time
+from typing import Iterator
+
+import asyncpg
 import psycopg2
-from elasticsearch import Elasticsearch
+from core.config import settings
+from core.logger import logger
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extensions import connection as pg_connection
+from psycopg2.extensions import parse_dsn
 from psycopg2.extras import RealDictCursor
-from utils.backoff import backoff
+from utils.backoff import async_backoff, backoff
+
+
+class CountingConnection(pg_connection):
+    """Соединение с Postgres, которое считает запросы к серверу"""
+
+    round_trips = 0
+
+
+class CountingCursor(RealDictCursor):
+    def execute(self, query, vars=None):
+        self.connection.round_trips += 1
+        return super().execute(query, vars)
 
 
 @backoff()
-def postgres_connect(dsn) -> pg_connection:
+def postgres_connect(dsn) -> CountingConnection:
     """Контекстный менеджер для соединения с Postgres"""
 
-    return psycopg2.connect(dsn=dsn, cursor_factory=RealDictCursor)
+    return psycopg2.connect(dsn=dsn, connection_factory=CountingConnection, cursor_factory=CountingCursor)
 
 
 @backoff()
-def elastic_connect(dsn) -> Elasticsearch:
+def elastic_connect(dsn, **options) -> Elasticsearch:
     """Контекстный менеджер для соединения с ElasticSearch"""
 
-    connection = Elasticsearch(dsn)
+    connection = Elasticsearch(dsn, **options)
     if not connection.ping():
         raise ConnectionError("Can not connect to Elasticsearch")
     return connection
+
+
+async def _init_asyncpg_connection(connection: asyncpg.Connection):
+    # json columns are decoded like psycopg2 does, so the transformers get the same rows
+    for type_name in ("json", "jsonb"):
+        await connection.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+@async_backoff()
+async def asyncpg_pool_connect(dsn: str, max_size: int) -> asyncpg.Pool:
+    """Пул соединений asyncpg. DSN в формате libpq, как и для psycopg2"""
+    params = parse_dsn(dsn)
+    return await asyncpg.create_pool(
+        host=params.get("host"),
+        port=params.get("port"),
+        user=params.get("user"),
+        password=params.get("password"),
+        database=params.get("dbname"),
+        min_size=1,
+        max_size=max_size,
+        init=_init_asyncpg_connection,
+    )
+
+
+@async_backoff()
+async def async_elastic_connect(dsn, **options) -> AsyncElasticsearch:
+    connection = AsyncElasticsearch(dsn, **options)
+    if not await connection.ping():
+        await connection.close()
+        raise ConnectionError("Can not connect to Elasticsearch")
+    return connection
+
+
+class PostgresPool:
+    """Пул долгоживущих соединений с Postgres.
+
+    Соединение, простоявшее дольше `healthcheck_interval` секунд, проверяется перед выдачей.
+    Соединение, с которым работа завершилась ошибкой, закрывается, а не возвращается в пул.
+    """
+
+    def __init__(self, dsn: str, size: int, healthcheck_interval: float):
+        self.dsn = dsn
+        self.healthcheck_interval = healthcheck_interval
+        self._idle: queue.LifoQueue[tuple[CountingConnection, float]] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[CountingConnection]:
+        with self._slots:
+            connection = self._checkout()
+            try:
+                yield connection
+            except Exception:
+                connection.close()
+                raise
+            self._release(connection)
+
+    def _checkout(self) -> CountingConnection:
+        while True:
+            try:
+                connection, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return postgres_connect(self.dsn)
+            if connection.closed:
+                continue
+            if time.monotonic() - released_at > self.healthcheck_interval and not self._healthy(connection):
+                logger.error("Postgres health check failed, reconnecting")
+                connection.close()
+                continue
+            return connection
+
+    def _release(self, connection: CountingConnection):
+        if connection.closed:
+            return
+        # a read transaction left open would hold back vacuum while the connection is idle
+        if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                connection.close()
+                return
+        self._idle.put((connection, time.monotonic()))
+
+    @staticmethod
+    def _healthy(connection: CountingConnection) -> bool:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            connection.close()
+
+
+class SharedElasticClient:
+    """Долгоживущий клиент ElasticSearch с пулом keep-alive соединений, общий для всех загрузчиков процесса.
+
+    Состояние кластера проверяется не чаще, чем раз в `healthcheck_interval` секунд.
+    """
+
+    def __init__(self, dsn: str, healthcheck_interval: float, **options):
+        self.dsn = dsn
+        self.healthcheck_interval = healthcheck_interval
+        self.options = options
+        self._client: Elasticsearch | None = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Elasticsearch:
+        with self._lock:
+            if self._client is None:
+                self._client = elastic_connect(self.dsn, **self.options)
+                self._checked_at = time.monotonic()
+            elif time.monotonic() - self._checked_at > self.healthcheck_interval:
+                if not self._client.ping():
+                    logger.error("Elasticsearch health check failed, reconnecting")
+                    self._client.close()
+                    self._client = elastic_connect(self.dsn, **self.options)
+                self._checked_at = time.monotonic()
+            return self._client
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+shared_elastic_client = SharedElasticClient(
+    settings.ELASTIC_DSN,
+    settings.ELASTIC_HEALTHCHECK_INTERVAL,
+    connections_per_node=settings.ELASTIC_CONNECTIONS_PER_NODE,
+    http_compress=settings.ELASTIC_HTTP_COMPRESS,
+    retry_on_timeout=True,
+)
@@ -0,0 +1,127 @@
+"""Streaming of `COPY (SELECT ...) TO STDOUT` results.
+
+`copy_expert` writes the COPY output from a thread into a pipe, the rows are parsed from the other end of the pipe
+as they arrive, so neither the whole result nor a cursor of Python rows is held in memory.
+The text format of COPY is used: tab separated columns, `\\N` for NULL and backslash escapes, no quoting to undo.
+"""
+import datetime
+import decimal
+import json
+import os
+import re
+import threading
+from typing import Any, Callable, Iterator
+
+from psycopg2.extensions import connection as pg_connection
+from psycopg2.extensions import encodings
+
+COPY = "COPY ({query}) TO STDOUT"
+DESCRIBE = "SELECT * FROM ({query}) as copy_rows LIMIT 0"
+NULL = "\\N"
+ESCAPE = re.compile(r"\\(.)")
+ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+# ISO DateStyle output: `2021-06-16 20:14:09.22185+00`, the fraction and the offset are optional
+TIMESTAMP = re.compile(r"(\d{4}-\d\d-\d\d) (\d\d:\d\d:\d\d)(?:\.(\d{1,6}))?(?:([+-])(\d\d)(?::(\d\d))?(?::(\d\d))?)?$")
+
+
+def parse_timestamp(value: str) -> datetime.datetime | str:
+    """Parse a timestamp of the COPY output. `datetime.fromisoformat` of Python 3.10 rejects the `+00` offset
+    and fractions shorter than 3 or 6 digits. Values out of the datetime range (`infinity`, BC) stay text
+    """
+    match = TIMESTAMP.match(value)
+    if match is None:
+        return value
+    date, time, fraction, sign, hours, minutes, seconds = match.groups()
+    result = datetime.datetime.fromisoformat(f"{date}T{time}")
+    if fraction:
+        result = result.replace(microsecond=int(fraction.ljust(6, "0")))
+    if sign:
+        offset = datetime.timedelta(hours=int(hours), minutes=int(minutes or 0), seconds=int(seconds or 0))
+        result = result.replace(tzinfo=datetime.timezone(-offset if sign == "-" else offset))
+    return result
+
+
+# Values are converted by the type OID of the column to the types psycopg2 returns, other types stay text
+CONVERTERS: dict[int, Callable[[str], Any]] = {
+    16: lambda value: value == "t",  # bool
+    20: int,  # int8
+    21: int,  # int2
+    23: int,  # int4
+    114: json.loads,  # json
+    700: float,  # float4
+    701: float,  # float8
+    1700: decimal.Decimal,  # numeric
+    1114: parse_timestamp,  # timestamp
+    1184: parse_timestamp,  # timestamptz
+    3802: json.loads,  # jsonb
+}
+
+_columns: dict[str, list[tuple[str, Callable | None]]] = {}
+
+
+def unescape(value: str) -> str:
+    return ESCAPE.sub(lambda match: ESCAPES.get(match.group(1), match.group(1)), value)
+
+
+def describe(connection: pg_connection, query: str, params: tuple = ()) -> list[tuple[str, Callable | None]]:
+    """Names and converters of the result columns, the query is described once per process"""
+    if query not in _columns:
+        with connection.cursor() as cursor:
+            cursor.execute(DESCRIBE.format(query=query), params)
+            _columns[query] = [(column.name, CONVERTERS.get(column.type_code)) for column in cursor.description]
+    return _columns[query]
+
+
+class _PipeTarget:
+    """File-like target of `copy_expert`. Once the reader has stopped, the rest of the output is discarded"""
+
+    def __init__(self, pipe, discard: threading.Event):
+        self.pipe = pipe
+        self.discard = discard
+
+    def write(self, data: bytes):
+        if not self.discard.is_set():
+            self.pipe.write(data)
+
+
+def copy_rows(connection: pg_connection, query: str, params: tuple = (), buffer_size: int = 65536) -> Iterator[dict]:
+    """Rows of the query as dicts, parsed incrementally from the COPY output"""
+    query = query.strip().rstrip(";")
+    columns = describe(connection, query, params)
+    encoding = encodings.get(connection.encoding, "utf-8")
+    with connection.cursor() as cursor:
+        statement = COPY.format(query=cursor.mogrify(query, params).decode(encoding))
+    read_fd, write_fd = os.pipe()
+    discard = threading.Event()
+    failure: list[Exception] = []
+
+    def copy():
+        with os.fdopen(write_fd, "wb", buffering=buffer_size) as pipe:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.copy_expert(statement, _PipeTarget(pipe, discard), size=buffer_size)
+            except Exception as e:
+                failure.append(e)
+
+    thread = threading.Thread(target=copy, name="etl-copy", daemon=True)
+    with os.fdopen(read_fd, "r", encoding=encoding, newline="\n", buffering=buffer_size) as reader:
+        thread.start()
+        try:
+            for line in reader:
+                row = {}
+                for (name, convert), value in zip(columns, line[:-1].split("\t")):
+                    if value == NULL:
+                        row[name] = None
+                        continue
+                    if "\\" in value:
+                        value = unescape(value)
+                    row[name] = convert(value) if convert else value
+                yield row
+        finally:
+            # the consumer may stop early: let the writer finish the COPY, so the connection stays usable
+            discard.set()
+            while reader.read(buffer_size):
+                pass
+            thread.join()
+    if failure:
+        raise failure[0]
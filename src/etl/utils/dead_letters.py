@@ -0,0 +1,101 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Iterable
+
+from core.config import settings
+from core.logger import logger
+from utils import metrics
+
+
+class DeadLetterStore:
+    """Строки, которые не удалось преобразовать или проиндексировать, с текстом ошибки, в локальном файле SQLite.
+
+    Остальная пачка обрабатывается дальше, так что одна битая строка не останавливает ETL.
+    Записи переигрываются командой `python dead_letters.py replay`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL;")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters ("
+            "table_name TEXT NOT NULL, id TEXT NOT NULL, stage TEXT NOT NULL, error TEXT NOT NULL, payload TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 1, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (table_name, id));"
+        )
+
+    def add(self, table: str, _id: Any, stage: str, error: str, payload: str | None = None) -> None:
+        """Save a failed row, a row which failed again gets the new error and one more attempt"""
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO dead_letters (table_name, id, stage, error, payload, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (table_name, id) DO UPDATE SET stage = excluded.stage, error = excluded.error, "
+                "payload = excluded.payload, attempts = attempts + 1, updated_at = excluded.updated_at;",
+                (table, str(_id), stage, error, payload, now, now),
+            )
+
+    def ids(self, table: str) -> list[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id FROM dead_letters WHERE table_name = ? ORDER BY created_at;", (table,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def entries(self, table: str | None = None, limit: int = 100) -> list[dict]:
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT table_name, id, stage, error, attempts, created_at, updated_at FROM dead_letters "
+                "WHERE ? IS NULL OR table_name = ? ORDER BY created_at LIMIT ?;",
+                (table, table, limit),
+            )
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def resolve(self, table: str, ids: Iterable[Any], before: float) -> int:
+        """Remove rows which have not failed again since `before`. Returns the number of removed rows"""
+        with self._lock:
+            cursor = self._connection.executemany(
+                "DELETE FROM dead_letters WHERE table_name = ? AND id = ? AND updated_at < ?;",
+                [(table, str(_id), before) for _id in ids],
+            )
+        return cursor.rowcount
+
+
+_store: DeadLetterStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_dead_letter_store() -> DeadLetterStore | None:
+    """Process-wide dead-letter store, None when DEAD_LETTER_PATH is not set"""
+    global _store
+    if not settings.DEAD_LETTER_PATH:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = DeadLetterStore(settings.DEAD_LETTER_PATH)
+    return _store
+
+
+def dead_letter(table: str, _id: Any, stage: str, error: Any, payload: Any = None) -> None:
+    """Isolate a row which failed `stage` (transform or index): log it and keep it in the dead-letter store"""
+    logger.error("%s %s failed at %s and was dead-lettered: %s", table, _id, stage, error)
+    metrics.ROWS.labels(table, "dead_letter").inc()
+    if (store := get_dead_letter_store()) is None:
+        return
+    store.add(table, _id, stage, _text(error), payload is not None and _text(payload) or None)
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, Exception):
+        return f"{type(value).__name__}: {value}"
+    return json.dumps(value, ensure_ascii=False, default=str)
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from typing import Any, Iterable
+
+from core.config import settings
+
+# SQLite limits the number of host parameters of a statement (999 before 3.32)
+QUERY_BATCH_SIZE = 500
+
+
+def fingerprint(doc: dict) -> str:
+    """Stable hash of an Elasticsearch document"""
+    data = json.dumps(doc, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class FingerprintStore:
+    """Хеши проиндексированных документов по (index, _id) в локальном файле SQLite.
+
+    Позволяет не отправлять в Elasticsearch обновления, которые не меняют документ.
+    Если индекс пересоздаётся, хеши этого индекса нужно сбросить методом `clear`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL;")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints "
+            "(idx TEXT NOT NULL, id TEXT NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (idx, id));"
+        )
+
+    def get_many(self, index: str, ids: Iterable[Any]) -> dict[str, str]:
+        ids = [str(_id) for _id in ids]
+        hashes = {}
+        with self._lock:
+            for start in range(0, len(ids), QUERY_BATCH_SIZE):
+                batch = ids[start : start + QUERY_BATCH_SIZE]
+                placeholders = ", ".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT id, hash FROM fingerprints WHERE idx = ? AND id IN ({placeholders});",
+                    (index, *batch),
+                ).fetchall()
+                hashes.update(rows)
+        return hashes
+
+    def save_many(self, index: str, hashes: dict[str, str]) -> None:
+        if not hashes:
+            return
+        with self._lock:
+            self._connection.executemany(
+                "INSERT INTO fingerprints (idx, id, hash) VALUES (?, ?, ?) "
+                "ON CONFLICT (idx, id) DO UPDATE SET hash = excluded.hash;",
+                [(index, _id, _hash) for _id, _hash in hashes.items()],
+            )
+
+    def delete_many(self, index: str, ids: Iterable[Any]) -> None:
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM fingerprints WHERE idx = ? AND id = ?;",
+                [(index, str(_id)) for _id in ids],
+            )
+
+    def clear(self, index: str) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM fingerprints WHERE idx = ?;", (index,))
+
+
+_store: FingerprintStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_fingerprint_store() -> FingerprintStore | None:
+    """Process-wide fingerprint store, None when FINGERPRINT_PATH is not set"""
+    global _store
+    if not settings.FINGERPRINT_PATH:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = FingerprintStore(settings.FINGERPRINT_PATH)
+    return _store
@@ -0,0 +1,94 @@
+"""Versioned Elasticsearch indices behind read/write aliases.
+
+The API and the loaders address an index by its alias (`movies`), the data lives in `movies_v<N>`.
+"""
+import copy
+import json
+import re
+
+from core.logger import logger
+from elasticsearch import Elasticsearch
+from utils.fingerprints import get_fingerprint_store
+
+SCHEMA_PATH = "es_schema/{index}.json"
+VERSION = re.compile(r"_v(\d+)$")
+
+
+def load_schema(alias: str) -> dict:
+    with open(SCHEMA_PATH.format(index=alias), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def bootstrap_index(client: Elasticsearch, alias: str) -> None:
+    """Create the first version of the index with the alias, unless the alias or a legacy index already exists"""
+    if client.indices.exists(index=alias):
+        return
+    body = load_schema(alias)
+    body["aliases"] = {alias: {}}
+    client.indices.create(index=f"{alias}_v1", body=body)
+    # hashes left from a deleted index would skip loading of the documents into the new one
+    if fingerprints := get_fingerprint_store():
+        fingerprints.clear(alias)
+        fingerprints.clear(f"{alias}_v1")
+    logger.warning('Index "%s_v1" was created with alias "%s"', alias, alias)
+
+
+def aliased_indices(client: Elasticsearch, alias: str) -> list[str]:
+    """Concrete indices behind the alias. A legacy index named like the alias is returned as is"""
+    if client.indices.exists_alias(name=alias):
+        return list(client.indices.get_alias(name=alias))
+    if client.indices.exists(index=alias):
+        return [alias]
+    return []
+
+
+def next_version(client: Elasticsearch, alias: str) -> str:
+    versions = [0]
+    for index in client.indices.get(index=f"{alias}_v*", ignore_unavailable=True, allow_no_indices=True):
+        if match := VERSION.search(index):
+            versions.append(int(match.group(1)))
+    return f"{alias}_v{max(versions) + 1}"
+
+
+def create_for_bulk(client: Elasticsearch, alias: str, index: str) -> dict:
+    """Create a new index version tuned for bulk loading. Returns the settings to restore afterwards"""
+    body = load_schema(alias)
+    restore = {
+        "refresh_interval": body["settings"].get("refresh_interval", "1s"),
+        "number_of_replicas": body["settings"].get("number_of_replicas", 1),
+    }
+    if current := aliased_indices(client, alias):
+        current_settings = client.indices.get_settings(index=current[0])[current[0]]["settings"]["index"]
+        restore["number_of_replicas"] = int(current_settings.get("number_of_replicas", 1))
+    body = copy.deepcopy(body)
+    body["settings"].update({"refresh_interval": "-1", "number_of_replicas": 0})
+    client.indices.create(index=index, body=body)
+    logger.info('Index "%s" was created for bulk loading', index)
+    return restore
+
+
+def finalize(client: Elasticsearch, index: str, restore: dict, forcemerge_timeout: float = 3600) -> None:
+    """Restore serving settings of a bulk loaded index, refresh and force merge it"""
+    client.indices.put_settings(index=index, settings=restore)
+    client.indices.refresh(index=index)
+    # a merge of a large index outlives the default request timeout, a timed out merge must not be sent again
+    client.options(request_timeout=forcemerge_timeout, retry_on_timeout=False).indices.forcemerge(
+        index=index, max_num_segments=1, wait_for_completion=True
+    )
+    client.cluster.health(index=index, wait_for_status="yellow", timeout="5m")
+    logger.info('Index "%s" was finalized with %s', index, restore)
+
+
+def swap_alias(client: Elasticsearch, alias: str, index: str) -> list[str]:
+    """Atomically point the alias to the index. Returns indices which were behind the alias before"""
+    old = [old_index for old_index in aliased_indices(client, alias) if old_index != index]
+    actions = [{"add": {"index": index, "alias": alias}}]
+    for old_index in old:
+        if old_index == alias:
+            # a legacy index named like the alias is removed in the same request, so there is no gap
+            actions.append({"remove_index": {"index": old_index}})
+        else:
+            actions.append({"remove": {"index": old_index, "alias": alias}})
+    client.indices.update_aliases(actions=actions)
+    logger.warning('Alias "%s" now points to "%s" instead of %s', alias, index, old)
+    return [old_index for old_index in old if old_index != alias]
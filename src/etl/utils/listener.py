@@ -0,0 +1,59 @@
+import json
+import select
+import time
+
+import psycopg2
+from core.logger import logger
+from psycopg2 import sql
+from utils.connectors import CountingConnection, postgres_connect
+
+
+class ChangeListener:
+    """Ждёт уведомлений NOTIFY об изменениях в таблицах (см. sql/notify_triggers.sql)"""
+
+    def __init__(self, dsn: str, channel: str, debounce: float):
+        self.dsn = dsn
+        self.channel = channel
+        self.debounce = debounce
+        self._connection: CountingConnection | None = None
+
+    def _listen(self) -> CountingConnection:
+        if self._connection is None or self._connection.closed:
+            self._connection = postgres_connect(self.dsn)
+            self._connection.autocommit = True
+            with self._connection.cursor() as cursor:
+                cursor.execute(sql.SQL("LISTEN {};").format(sql.Identifier(self.channel)))
+            logger.info('Listening for changes on "%s"', self.channel)
+        return self._connection
+
+    def wait(self, timeout: float) -> set[str]:
+        """Wait for changes at most `timeout` seconds.
+
+        After the first notification the batch is collected for another `debounce` seconds.
+        Returns names of the changed tables, an empty set means the timeout has expired.
+        """
+        tables = set()
+        deadline = time.monotonic() + timeout
+        try:
+            connection = self._listen()
+            while (remaining := deadline - time.monotonic()) > 0:
+                if select.select([connection], [], [], remaining) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    if not tables:
+                        deadline = min(deadline, time.monotonic() + self.debounce)
+                    tables.add(json.loads(notify.payload)["table"])
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            logger.error("Change listener connection was lost: %s", e)
+            self.close()
+            time.sleep(max(deadline - time.monotonic(), 0))
+        if tables:
+            logger.info("Changes captured for: %s", ", ".join(sorted(tables)))
+        return tables
+
+    def close(self):
+        if self._connection is not None and not self._connection.closed:
+            self._connection.close()
+        self._connection = None
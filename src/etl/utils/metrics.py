@@ -0,0 +1,111 @@
+"""Prometheus metrics of the ETL.
+
+Exported on `METRICS_PORT` and/or written to `METRICS_TEXTFILE` (for the node exporter textfile collector).
+Stage durations are exclusive: rows are pulled lazily through enrich -> transform -> load, so the time
+spent in a nested stage is subtracted from the stage which pulls from it.
+"""
+import contextlib
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, Iterator
+
+from core.config import settings
+from core.logger import logger
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, start_http_server, write_to_textfile
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "etl_stage_duration_seconds",
+    "Time spent in an ETL stage per chunk",
+    ["table", "stage"],
+    buckets=BUCKETS,
+)
+CHUNK_SECONDS = Histogram(
+    "etl_chunk_duration_seconds",
+    "Time to process a chunk of changes end to end",
+    ["table"],
+    buckets=BUCKETS,
+)
+ROWS = Counter("etl_rows_total", "Rows passed through an ETL stage", ["table", "stage"])
+BULK_DOCUMENTS = Counter(
+    "etl_bulk_documents_total",
+    "Documents sent to Elasticsearch by result: succeeded, retried, failed or skipped as unchanged",
+    ["index", "result"],
+)
+FRESHNESS_LAG = Gauge(
+    "etl_freshness_lag_seconds",
+    "Age of the watermark while the table has unprocessed changes, 0 when it is caught up",
+    ["table"],
+)
+WATERMARK = Gauge("etl_watermark_timestamp_seconds", "updated_at of the last processed row", ["table"])
+
+_local = threading.local()
+
+
+def _stack() -> list[list[float]]:
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+@contextlib.contextmanager
+def stage(table: str, name: str) -> Iterator[None]:
+    """Measure the exclusive time of a stage"""
+    stack = _stack()
+    frame = [0.0]  # time spent in nested stages
+    stack.append(frame)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stack.pop()
+        if stack:
+            stack[-1][0] += elapsed
+        STAGE_SECONDS.labels(table, name).observe(elapsed - frame[0])
+
+
+def track(rows: Iterable, table: str, name: str, spent: float = 0) -> Iterator:
+    """Count rows of a lazy stage and measure the exclusive time spent producing them"""
+    stack = _stack()
+    iterator = iter(rows)
+    count = 0
+    while True:
+        frame = [0.0]
+        stack.append(frame)
+        started = time.perf_counter()
+        try:
+            row = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            if stack:
+                stack[-1][0] += elapsed
+            spent += elapsed - frame[0]
+        count += 1
+        yield row
+    STAGE_SECONDS.labels(table, name).observe(spent)
+    ROWS.labels(table, name).inc(count)
+
+
+def set_watermark(table: str, watermark: list | None, caught_up: bool):
+    if not watermark:
+        return
+    updated_at = datetime.fromisoformat(watermark[0]).timestamp()
+    WATERMARK.labels(table).set(updated_at)
+    FRESHNESS_LAG.labels(table).set(0 if caught_up else max(time.time() - updated_at, 0))
+
+
+def start_exporter():
+    if settings.METRICS_PORT:
+        start_http_server(settings.METRICS_PORT)
+        logger.info("Metrics are exported on port %d", settings.METRICS_PORT)
+
+
+def write_textfile():
+    if settings.METRICS_TEXTFILE:
+        write_to_textfile(settings.METRICS_TEXTFILE, REGISTRY)
@@ -0,0 +1,39 @@
+"""Long-lived ETL process: graceful shutdown and adaptive polling"""
+import signal
+import threading
+
+from core.logger import logger
+
+# Set by SIGTERM or SIGINT. Managers finish the current chunk (its bulk requests are flushed and the watermark saved)
+# and do not start the next one.
+shutdown = threading.Event()
+
+
+def _request_shutdown(signum: int, frame):
+    logger.info("%s received, stopping after the current chunk", signal.Signals(signum).name)
+    shutdown.set()
+
+
+def install_signal_handlers():
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, _request_shutdown)
+
+
+class PollScheduler:
+    """Delay before the next poll.
+
+    While extractors return full chunks the next poll starts immediately. When the tables are caught up the delay
+    starts at `min_interval` and doubles with every idle poll up to `max_interval`.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float):
+        self.min_interval = min(min_interval, max_interval)
+        self.max_interval = max_interval
+        self._delay = 0.0
+
+    def next_delay(self, has_more: bool) -> float:
+        if has_more:
+            self._delay = 0.0
+        else:
+            self._delay = min(max(self._delay * 2, self.min_interval), self.max_interval)
+        return self._delay
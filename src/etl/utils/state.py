@@ -1,7 +1,14 @@
 import abc
 import json
+import os
+import tempfile
+import threading
 from typing import Any, Dict
 
+import redis
+from psycopg2 import sql
+from utils.connectors import CountingConnection
+
 
 class BaseStorage(abc.ABC):
     """Абстрактное хранилище состояния.
@@ -20,6 +27,14 @@ class BaseStorage(abc.ABC):
     def retrieve_state(self) -> Dict[str, Any]:
         """Получить состояние из хранилища."""
 
+    def save_key(self, key: str, value: Any, state: Dict[str, Any]) -> None:
+        """Сохранить значение одного ключа.
+
+        По умолчанию сохраняется всё состояние целиком, хранилища с доступом
+        по ключу записывают только изменившееся значение.
+        """
+        self.save_state(state)
+
 
 class JsonFileStorage(BaseStorage):
     """Реализация хранилища, использующего локальный файл.
@@ -31,9 +46,22 @@ class JsonFileStorage(BaseStorage):
         self.file_path = file_path
 
     def save_state(self, state: Dict[str, Any]) -> None:
-        """Сохранить состояние в хранилище."""
-        with open(self.file_path, "w", encoding="utf-8") as storage_file:
+        """Сохранить состояние в хранилище.
+
+        Состояние пишется во временный файл, который затем атомарно подменяет основной,
+        поэтому падение посреди записи не портит сохранённые ранее данные.
+        """
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, delete=False) as storage_file:
             storage_file.write(json.dumps(state))
+            storage_file.flush()
+            os.fsync(storage_file.fileno())
+        os.replace(storage_file.name, self.file_path)
+        directory_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
 
     def retrieve_state(self) -> Dict[str, Any]:
         """Получить состояние из хранилища."""
@@ -47,19 +75,118 @@ class JsonFileStorage(BaseStorage):
             return {}
 
 
+class RedisStorage(BaseStorage):
+    """Реализация хранилища в хеше Redis.
+
+    Каждый ключ состояния хранится в отдельном поле хеша,
+    поэтому несколько процессов ETL могут разделять одно состояние.
+    """
+
+    def __init__(self, client: redis.Redis, key: str) -> None:
+        self.client = client
+        self.key = key
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        """Сохранить состояние в хранилище."""
+        if state:
+            self.client.hset(self.key, mapping={field: json.dumps(value) for field, value in state.items()})
+
+    def save_key(self, key: str, value: Any, state: Dict[str, Any]) -> None:
+        self.client.hset(self.key, key, json.dumps(value))
+
+    def retrieve_state(self) -> Dict[str, Any]:
+        """Получить состояние из хранилища."""
+        return {
+            _decode(field): json.loads(value) for field, value in self.client.hgetall(self.key).items()
+        }
+
+
+class PostgresStorage(BaseStorage):
+    """Реализация хранилища в таблице Postgres.
+
+    Использует отдельное соединение в режиме autocommit, чтобы запись
+    состояния не зависела от транзакции, в которой извлекаются данные.
+    """
+
+    def __init__(self, connection: CountingConnection, table: str) -> None:
+        self.connection = connection
+        self.connection.autocommit = True
+        self.table = sql.Identifier(*table.split("."))
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                sql.SQL(
+                    """
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        key text PRIMARY KEY,
+                        value jsonb,
+                        updated_at timestamptz NOT NULL DEFAULT now()
+                    );
+                    """
+                ).format(table=self.table)
+            )
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        """Сохранить состояние в хранилище."""
+        for key, value in state.items():
+            self.save_key(key, value, state)
+
+    def save_key(self, key: str, value: Any, state: Dict[str, Any]) -> None:
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                sql.SQL(
+                    """
+                    INSERT INTO {table} (key, value) VALUES (%s, %s)
+                    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = now();
+                    """
+                ).format(table=self.table),
+                (key, json.dumps(value)),
+            )
+
+    def retrieve_state(self) -> Dict[str, Any]:
+        """Получить состояние из хранилища."""
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql.SQL("SELECT key, value FROM {table};").format(table=self.table))
+            return {row["key"]: row["value"] for row in cursor.fetchall()}
+
+
+def _decode(value: bytes | str) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
 class State:
-    """Класс для работы с состояниями."""
+    """Класс для работы с состояниями.
+
+    Состояние читается из хранилища один раз и хранится в памяти,
+    изменения сразу записываются в хранилище (write-through).
+    """
 
     def __init__(self, storage: BaseStorage) -> None:
         self.storage = storage
+        self._lock = threading.Lock()
+        self._data: Dict[str, Any] | None = None
+
+    def _state(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = self.storage.retrieve_state()
+        return self._data
 
     def set(self, key: str, value: Any) -> None:
-        """Установить состояние для определённого ключа."""
-        data = self.storage.retrieve_state()
-        data[key] = value
-        self.storage.save_state(data)
+        """Установить состояние для определённого ключа.
+
+        Запись выполняется под блокировкой, чтобы параллельные воркеры
+        не затирали ключи друг друга.
+        """
+        with self._lock:
+            data = self._state()
+            data[key] = value
+            self.storage.save_key(key, value, data)
 
     def get(self, key: str) -> Any:
         """Получить состояние по определённому ключу."""
-        data = self.storage.retrieve_state()
-        return data.get(key)
+        with self._lock:
+            return self._state().get(key)
+
+    def refresh(self) -> None:
+        """Сбросить кеш, чтобы перечитать состояние, изменённое другими процессами."""
+        with self._lock:
+            self._data = None
@@ -0,0 +1,51 @@
+"""Server-side prepared statements for psycopg2 connections"""
+import hashlib
+import itertools
+import re
+import weakref
+
+from psycopg2.extensions import connection as pg_connection
+
+PLACEHOLDER = re.compile("%s")
+# A placeholder with its type cast: EXECUTE coerces parameters with assignment casts only,
+# e.g. the text[] of a Python list does not become uuid[], so the cast is repeated in EXECUTE
+TYPED_PLACEHOLDER = re.compile(r"%s(::\w+(?:\[\])?)?")
+
+_prepared: "weakref.WeakKeyDictionary[pg_connection, set[str]]" = weakref.WeakKeyDictionary()
+
+
+def statement_name(query: str) -> str:
+    return "etl_{0}".format(hashlib.md5(query.encode("utf-8")).hexdigest()[:16])
+
+
+def numbered(query: str) -> str:
+    """Replace `%s` placeholders with the `$1, $2, ...` placeholders of the server-side statements"""
+    counter = itertools.count(1)
+    return PLACEHOLDER.sub(lambda _: "${0}".format(next(counter)), query)
+
+
+def prepare(connection: pg_connection, query: str) -> tuple[str, str]:
+    """PREPARE the query once per connection.
+
+    Returns the statement name and an `EXECUTE` statement which takes the same `%s` parameters as the query.
+    """
+    name = statement_name(query)
+    casts = [match.group(1) or "" for match in TYPED_PLACEHOLDER.finditer(query)]
+    prepared = _prepared.setdefault(connection, set())
+    if name not in prepared:
+        with connection.cursor() as cursor:
+            cursor.execute(f"PREPARE {name} AS {numbered(query)}")
+        prepared.add(name)
+    if not casts:
+        return name, f"EXECUTE {name};"
+    return name, "EXECUTE {0} ({1});".format(name, ", ".join(f"%s{cast}" for cast in casts))
+
+
+def reset(connection: pg_connection) -> None:
+    """Roll back a failed transaction and drop every statement prepared on the connection"""
+    _prepared.pop(connection, None)
+    if connection.closed:
+        return
+    connection.rollback()
+    with connection.cursor() as cursor:
+        cursor.execute("DEALLOCATE ALL;")
@@ -0,0 +1,95 @@
+"""Unit tests of the ETL (src/etl). Run from the repository root: python -m pytest tests/etl
+
+Tests marked with the `pg_conn` fixture need a Postgres: set ETL_TEST_POSTGRES_DSN, e.g.
+`dbname=postgres user=postgres host=localhost`. They work in their own `etl_test` schema.
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "etl"))
+
+for name, value in {
+    "POSTGRES_DSN": os.environ.get("ETL_TEST_POSTGRES_DSN", "dbname=postgres"),
+    "ELASTIC_DSN": "http://localhost:9200",
+    "ELASTIC_INDEXES": "movies,genres,persons",
+    "FILM_WORK_CHUNK_SIZE": "100",
+    "GENRE_CHUNK_SIZE": "100",
+    "PERSON_CHUNK_SIZE": "100",
+    "LOAD_CHUNK_SIZE": "100",
+    "STATE_PATH": "state.json",
+    "SLEEP_TIME": "1",
+    "DEAD_LETTER_PATH": "",
+    "FINGERPRINT_PATH": "",
+}.items():
+    os.environ.setdefault(name, value)
+
+SCHEMA = "etl_test"
+
+DDL = """
+    DROP SCHEMA IF EXISTS {schema} CASCADE;
+    CREATE SCHEMA {schema};
+    CREATE TABLE {schema}.film_work (
+        id uuid PRIMARY KEY, title text NOT NULL, description text, rating float, type text,
+        created_at timestamptz NOT NULL DEFAULT now(), updated_at timestamptz NOT NULL DEFAULT now()
+    );
+    CREATE TABLE {schema}.genre (
+        id uuid PRIMARY KEY, name text NOT NULL,
+        created_at timestamptz NOT NULL DEFAULT now(), updated_at timestamptz NOT NULL DEFAULT now()
+    );
+    CREATE TABLE {schema}.person (
+        id uuid PRIMARY KEY, full_name text NOT NULL,
+        created_at timestamptz NOT NULL DEFAULT now(), updated_at timestamptz NOT NULL DEFAULT now()
+    );
+    CREATE TABLE {schema}.genre_film_work (
+        id uuid PRIMARY KEY, genre_id uuid NOT NULL, film_work_id uuid NOT NULL,
+        created_at timestamptz NOT NULL DEFAULT now()
+    );
+    CREATE TABLE {schema}.person_film_work (
+        id uuid PRIMARY KEY, person_id uuid NOT NULL, film_work_id uuid NOT NULL, role text NOT NULL,
+        created_at timestamptz NOT NULL DEFAULT now()
+    );
+"""
+
+
+@pytest.fixture
+def pg_conn():
+    """Connection to the test Postgres with an empty `etl_test` content schema"""
+    dsn = os.environ.get("ETL_TEST_POSTGRES_DSN")
+    if not dsn:
+        pytest.skip("ETL_TEST_POSTGRES_DSN is not set")
+    from utils.connectors import postgres_connect
+
+    connection = postgres_connect(dsn)
+    with connection.cursor() as cursor:
+        cursor.execute(DDL.format(schema=SCHEMA))
+    connection.commit()
+    yield connection
+    connection.rollback()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+    connection.commit()
+    connection.close()
+
+
+@pytest.fixture
+def content(pg_conn):
+    """Two films, a genre and a person linked to the first film. Returns their ids"""
+    ids = {name: str(uuid.uuid4()) for name in ("film", "other_film", "genre", "person")}
+    with pg_conn.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {SCHEMA}.film_work (id, title, description, rating, type, updated_at) VALUES "
+            "(%(film)s, 'Star', 'About stars', 8.5, 'movie', '2021-06-16 20:14:09.22185+00'), "
+            "(%(other_film)s, 'Moon', NULL, NULL, 'movie', '2021-06-17 10:00:00+00');"
+            f"INSERT INTO {SCHEMA}.genre (id, name) VALUES (%(genre)s, 'Sci-Fi');"
+            f"INSERT INTO {SCHEMA}.person (id, full_name) VALUES (%(person)s, 'Ann Lee');"
+            f"INSERT INTO {SCHEMA}.genre_film_work (id, genre_id, film_work_id) "
+            "VALUES (gen_random_uuid(), %(genre)s, %(film)s);"
+            f"INSERT INTO {SCHEMA}.person_film_work (id, person_id, film_work_id, role) "
+            "VALUES (gen_random_uuid(), %(person)s, %(film)s, 'actor');",
+            ids,
+        )
+    pg_conn.commit()
+    return ids
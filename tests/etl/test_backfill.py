@@ -0,0 +1,81 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import backfill
+import pytest
+from test_reindex import in_test_schema
+
+
+@pytest.fixture
+def loaded(pg_conn, tmp_path, monkeypatch):
+    loaded: list[str] = []
+
+    def load(table, rows, *args, **kwargs):
+        rows = list(rows)
+        loaded.extend(str(row.id) for row in rows)
+        return len(rows)
+
+    monkeypatch.setattr(backfill, "load", load)
+    monkeypatch.setattr(backfill, "EXTRACTORS", {"film_work": in_test_schema(backfill.FilmWorkExtractor)})
+    monkeypatch.setattr(backfill.settings, "BACKFILL_STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(backfill.settings, "BACKFILL_CHUNK_SIZE", 1)
+    return loaded
+
+
+def test_shards_cover_the_table_once(pg_conn, content, loaded):
+    bounds = backfill.shard_bounds(pg_conn, "film_work", 3)
+    assert len(bounds) == 4
+    assert backfill.shard_bounds(pg_conn, "film_work", 3) == bounds
+    total = sum(backfill.backfill_shard("film_work", shard, 3, bounds[shard], bounds[shard + 1]) for shard in range(3))
+    assert total == 2
+    assert sorted(loaded) == sorted([content["film"], content["other_film"]])
+
+
+def test_shard_resumes_from_checkpoint(pg_conn, content, loaded):
+    bounds = backfill.shard_bounds(pg_conn, "film_work", 1)
+    first = min(content["film"], content["other_film"])
+    backfill.create_checkpoint("film_work", 0, 1).set("last_id", first)
+    assert backfill.backfill_shard("film_work", 0, 1, *bounds) == 1
+    assert loaded == [max(content["film"], content["other_film"])]
+    assert backfill.backfill_shard("film_work", 0, 1, *bounds) == 0
+
+
+class FakeConnection:
+    def close(self):
+        pass
+
+
+class FakeExecutor:
+    """Runs the shards at once, the first pool breaks as if a worker was killed"""
+
+    pools = 0
+
+    def __init__(self, max_workers, mp_context):
+        FakeExecutor.pools += 1
+        self.broken = FakeExecutor.pools == 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        if self.broken:
+            future.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+        else:
+            future.set_result(fn(*args))
+        return future
+
+
+def test_backfill_restarts_broken_pool(monkeypatch):
+    done = []
+    FakeExecutor.pools = 0
+    monkeypatch.setattr(backfill, "ProcessPoolExecutor", FakeExecutor)
+    monkeypatch.setattr(backfill, "postgres_connect", lambda dsn: FakeConnection())
+    monkeypatch.setattr(backfill, "shard_bounds", lambda pg_conn, table, shards: ["a", "b", "c"])
+    monkeypatch.setattr(backfill, "backfill_shard", lambda *args: done.append(args) or 1)
+    assert backfill.backfill(["film_work"], 2, 2, retries=1)
+    assert FakeExecutor.pools == 2
+    assert sorted(done) == [("film_work", 0, 2, "a", "b"), ("film_work", 1, 2, "b", "c")]
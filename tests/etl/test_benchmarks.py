@@ -0,0 +1,27 @@
+import pytest
+from benchmarks import etl, replay
+from benchmarks.content import SyntheticContent
+from extractors.film_work import FilmWorkExtractor
+
+
+def test_benchmark_indexes_the_whole_synthetic_dataset_into_the_sink():
+    report = etl.run(120, 50, "bulk", None)
+    loaded = report["load"]["rows"]
+    assert loaded == report["extract"]["rows"] == report["transform"]["rows"] == report["serialize"]["rows"]
+    assert loaded > 120  # films with their genres and persons
+    assert report["sink"]["documents"] == loaded
+
+
+def test_replayed_recording_gives_the_same_result(tmp_path):
+    path = str(tmp_path / "films.pickle")
+    etl.record(path, 120, 50, live=False)
+    replayed, generated = etl.run(120, 50, "bulk", path), etl.run(120, 50, "bulk", None)
+    assert replayed["load"]["rows"] == generated["load"]["rows"]
+    assert replayed["sink"] == generated["sink"]
+
+
+def test_replay_rejects_a_recording_of_other_queries():
+    entries = replay.synthetic_entries(SyntheticContent(10), 5, schema="other")
+    extractor = replay.replaying(FilmWorkExtractor, entries)(None, 5, None)
+    with pytest.raises(LookupError, match="Recording does not match the query"):
+        extractor.extract()
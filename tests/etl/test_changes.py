@@ -0,0 +1,30 @@
+from conftest import SCHEMA
+from extractors.film_work import FilmWorkExtractor
+from extractors.genre import GenreExtractor
+from extractors.person import PersonExtractor
+
+
+def test_film_work_changes_carry_linked_genres_and_persons(pg_conn, content):
+    changes = FilmWorkExtractor(pg_conn, 10, None, schema=SCHEMA).produce()
+    assert sorted(changes["film_work"]) == sorted((content["film"], content["other_film"]))
+    assert changes["genre"] == (content["genre"],)
+    assert changes["person"] == (content["person"],)
+
+
+def test_related_changes_carry_linked_films(pg_conn, content):
+    assert GenreExtractor(pg_conn, 10, None, schema=SCHEMA).produce() == {
+        "genre": (content["genre"],),
+        "film_work": (content["film"],),
+    }
+    assert PersonExtractor(pg_conn, 10, None, schema=SCHEMA).produce() == {
+        "person": (content["person"],),
+        "film_work": (content["film"],),
+    }
+
+
+def test_changes_of_a_chunk_cost_one_round_trip(pg_conn, content):
+    FilmWorkExtractor(pg_conn, 1, None, schema=SCHEMA).produce()  # prepares the statement
+    extractor = FilmWorkExtractor(pg_conn, 1, None, schema=SCHEMA)
+    round_trips = pg_conn.round_trips
+    extractor.produce()
+    assert pg_conn.round_trips - round_trips == 1
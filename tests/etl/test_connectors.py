@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+from loaders.genre import GenreLoader
+from loaders.person import PersonLoader
+from utils import connectors
+
+
+class FakeElasticsearch:
+    def __init__(self, healthy: bool = True):
+        self.healthy = healthy
+        self.pings = 0
+        self.closed = False
+
+    def ping(self):
+        self.pings += 1
+        return self.healthy
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    """Clients created by `elastic_connect`, in order"""
+    clients: list[FakeElasticsearch] = []
+
+    def elastic_connect(dsn, **options):
+        clients.append(FakeElasticsearch())
+        return clients[-1]
+
+    monkeypatch.setattr(connectors, "elastic_connect", elastic_connect)
+    return clients
+
+
+def test_loaders_share_one_client(clients, monkeypatch):
+    shared = connectors.SharedElasticClient("http://elastic:9200", healthcheck_interval=60)
+    monkeypatch.setattr("loaders.base.shared_elastic_client", shared)
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(shared.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert GenreLoader("genres", 10).client is PersonLoader("persons", 10).client is clients[0]
+    assert len(clients) == 1 and all(client is clients[0] for client in got)
+    # the cluster is not pinged for every chunk
+    assert clients[0].pings == 0
+
+
+def test_failed_health_check_recreates_the_client(clients, monkeypatch):
+    shared = connectors.SharedElasticClient("http://elastic:9200", healthcheck_interval=0)
+    first = shared.get()
+    assert shared.get() is first and first.pings == 1
+
+    first.healthy = False
+    second = shared.get()
+    assert second is not first and first.closed
+
+    shared.close()
+    assert second.closed
+    assert shared.get() is clients[-1] and len(clients) == 3
@@ -0,0 +1,48 @@
+from loaders.controller import BulkController
+
+
+def controller(**kwargs) -> BulkController:
+    options = dict(batch_bytes=1000, min_bytes=100, max_bytes=4000, target_took=100)
+    return BulkController("movies", **{**options, **kwargs})
+
+
+def test_grows_after_fast_full_batch():
+    bulk = controller()
+    bulk.on_success(took=10, size=1000)
+    assert bulk.batch_bytes == 1250
+
+
+def test_keeps_size_after_fast_short_batch():
+    bulk = controller()
+    bulk.on_success(took=10, size=100)
+    assert bulk.batch_bytes == 1000
+
+
+def test_shrinks_proportionally_after_slow_batch():
+    bulk = controller()
+    bulk.on_success(took=125, size=1000)
+    assert bulk.batch_bytes == 800
+    bulk.on_success(took=1000, size=800)
+    assert bulk.batch_bytes == 400  # at most halved
+
+
+def test_size_stays_within_bounds():
+    bulk = controller()
+    for _ in range(10):
+        bulk.on_success(took=1, size=bulk.batch_bytes)
+    assert bulk.batch_bytes == 4000
+    for _ in range(10):
+        bulk.on_too_large()
+    assert bulk.batch_bytes == 100
+
+
+def test_rejection_halves_size_and_backs_off():
+    bulk = controller(start_sleep_time=0.1, border_sleep_time=0.4)
+    sleeps = [bulk.on_rejection() for _ in range(4)]
+    assert bulk.batch_bytes == 100
+    # full jitter: anywhere between no pause and the current backoff
+    assert 0 <= sleeps[0] <= 0.1
+    assert all(0 <= sleep <= 0.4 for sleep in sleeps)
+    assert bulk._sleep_time == 0.4
+    bulk.on_success(took=10, size=100)
+    assert bulk._sleep_time == 0.1
@@ -0,0 +1,93 @@
+import datetime
+import decimal
+
+from conftest import SCHEMA
+from utils import copy_stream
+
+
+def test_parse_timestamp():
+    assert copy_stream.parse_timestamp("2021-06-16 20:14:09.22185+00") == datetime.datetime(
+        2021, 6, 16, 20, 14, 9, 221850, tzinfo=datetime.timezone.utc
+    )
+    assert copy_stream.parse_timestamp("2021-06-16 20:14:09-03:30").utcoffset() == -datetime.timedelta(
+        hours=3, minutes=30
+    )
+    assert copy_stream.parse_timestamp("2021-06-16 20:14:09") == datetime.datetime(2021, 6, 16, 20, 14, 9)
+    assert copy_stream.parse_timestamp("infinity") == "infinity"
+
+
+class FakeCopyCursor:
+    def __init__(self, output: bytes):
+        self.output = output
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def mogrify(self, query, params):
+        return query.encode()
+
+    def copy_expert(self, statement, target, size):
+        for start in range(0, len(self.output), 7):
+            target.write(self.output[start : start + 7])
+
+
+class FakeCopyConnection:
+    encoding = "UTF8"
+
+    def __init__(self, output: bytes):
+        self.output = output
+
+    def cursor(self):
+        return FakeCopyCursor(self.output)
+
+
+def test_copy_rows_parses_text_format(monkeypatch):
+    query = "SELECT id, title, rating, score, updated_at, data FROM film_work"
+    converters = copy_stream.CONVERTERS
+    columns = [("id", None), ("title", None), ("rating", converters[701]), ("score", converters[1700])]
+    columns += [("updated_at", converters[1184]), ("data", converters[3802])]
+    monkeypatch.setitem(copy_stream._columns, query, columns)
+    output = (
+        "1\tЗвёзды\\tи\\nлуна\t8.5\t8.50\t2021-06-16 20:14:09.22185+00\t{\"n\": 1}\n"
+        "2\t\\N\t\\N\t\\N\t\\N\t\\N\n"
+    ).encode()
+    rows = list(copy_stream.copy_rows(FakeCopyConnection(output), query))
+    assert rows == [
+        {
+            "id": "1",
+            "title": "Звёзды\tи\nлуна",
+            "rating": 8.5,
+            "score": decimal.Decimal("8.50"),
+            "updated_at": datetime.datetime(2021, 6, 16, 20, 14, 9, 221850, tzinfo=datetime.timezone.utc),
+            "data": {"n": 1},
+        },
+        {"id": "2", "title": None, "rating": None, "score": None, "updated_at": None, "data": None},
+    ]
+
+
+def test_copy_rows(pg_conn, content):
+    query = (
+        f"SELECT id, title, description, rating, rating::numeric as score, updated_at, "
+        f"E'tab\\there' as escaped, json_build_object('n', 1) as data FROM {SCHEMA}.film_work "
+        "WHERE id = ANY(%s::uuid[]) ORDER BY title"
+    )
+    rows = list(copy_stream.copy_rows(pg_conn, query, ([content["film"], content["other_film"]],)))
+    assert [row["id"] for row in rows] == [content["other_film"], content["film"]]
+    moon, star = rows
+    assert moon["description"] is None and moon["score"] is None
+    assert star["rating"] == 8.5
+    assert star["score"] == decimal.Decimal("8.5")
+    assert star["updated_at"] == datetime.datetime(2021, 6, 16, 20, 14, 9, 221850, tzinfo=datetime.timezone.utc)
+    assert star["escaped"] == "tab\there"
+    assert star["data"] == {"n": 1}
+
+
+def test_copy_rows_stopped_early_keeps_connection_usable(pg_conn, content):
+    query = f"SELECT id FROM {SCHEMA}.film_work, generate_series(1, 10000)"
+    assert len(next(copy_stream.copy_rows(pg_conn, query, buffer_size=1024))) == 1
+    with pg_conn.cursor() as cursor:
+        cursor.execute("SELECT 1 as one;")
+        assert cursor.fetchone()["one"] == 1
@@ -0,0 +1,57 @@
+from collections import Counter
+
+import managers
+import pytest
+from conftest import SCHEMA
+from extractors.enrichment import EnrichmentExtractor
+from extractors.film_work import FilmWorkExtractor
+from extractors.genre import GenreExtractor
+from extractors.person import PersonExtractor
+from utils.state import JsonFileStorage, State
+
+
+def in_test_schema(extractor_class):
+    class Extractor(extractor_class):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, schema=SCHEMA, **kwargs)
+
+    return Extractor
+
+
+@pytest.fixture
+def loaded(monkeypatch):
+    """Ids of the loaded documents per table"""
+    documents: dict[str, Counter] = {}
+
+    def load(table, rows, *args):
+        documents.setdefault(table, Counter()).update(row["id"] for row in rows)
+        return len(documents[table])
+
+    monkeypatch.setattr(managers, "load", load)
+    monkeypatch.setattr(managers, "transform", lambda table, rows: rows)
+    monkeypatch.setattr(managers, "EnrichmentExtractor", in_test_schema(EnrichmentExtractor))
+    return documents
+
+
+def test_cycle_indexes_each_document_once_and_advances_every_watermark(pg_conn, content, loaded, tmp_path):
+    state = State(JsonFileStorage(str(tmp_path / "state.json")))
+    extractors_data = [(in_test_schema(cls), 100) for cls in (FilmWorkExtractor, GenreExtractor, PersonExtractor)]
+    manager = managers.CycleETLManager(pg_conn, extractors_data, 100, state)
+
+    assert manager.run() is False
+    # the first film changed itself and through its genre and person, it is still indexed once
+    assert loaded["film_work"] == Counter({content["film"]: 1, content["other_film"]: 1})
+    assert loaded["genre"] == Counter({content["genre"]: 1})
+    assert loaded["person"] == Counter({content["person"]: 1})
+    assert state.get("film_work_updated_at")[1] == content["other_film"]
+    assert state.get("genre_updated_at")[1] == content["genre"]
+    assert state.get("person_updated_at")[1] == content["person"]
+
+    loaded.clear()
+    person_watermark = state.get("person_updated_at")
+    with pg_conn.cursor() as cursor:
+        cursor.execute(f"UPDATE {SCHEMA}.genre SET updated_at = now() WHERE id = %s", (content["genre"],))
+    pg_conn.commit()
+    assert manager.run() is False
+    assert loaded == {"film_work": Counter({content["film"]: 1}), "genre": Counter({content["genre"]: 1})}
+    assert state.get("person_updated_at") == person_watermark
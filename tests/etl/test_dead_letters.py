@@ -0,0 +1,43 @@
+import time
+
+import pytest
+from utils import dead_letters
+from utils.dead_letters import DeadLetterStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return DeadLetterStore(str(tmp_path / "dead_letters.db"))
+
+
+def test_add_counts_attempts_and_keeps_last_error(store):
+    store.add("film_work", 1, "transform", "ValidationError: title")
+    store.add("film_work", 1, "index", "mapper_parsing_exception", payload='{"id": 1}')
+    store.add("genre", 2, "index", "mapper_parsing_exception")
+    (entry,) = store.entries("film_work")
+    assert entry["id"] == "1"
+    assert (entry["stage"], entry["error"], entry["attempts"]) == ("index", "mapper_parsing_exception", 2)
+    assert store.ids("genre") == ["2"]
+    assert len(store.entries()) == 2
+
+
+def test_resolve_keeps_rows_failed_again(store):
+    store.add("film_work", 1, "index", "error")
+    store.add("film_work", 2, "index", "error")
+    started = time.time()
+    store.add("film_work", 2, "index", "error again")
+    assert store.resolve("film_work", ["1", "2"], started) == 1
+    assert store.ids("film_work") == ["2"]
+
+
+def test_dead_letter_serializes_error_and_payload(store, monkeypatch):
+    monkeypatch.setattr(dead_letters, "get_dead_letter_store", lambda: store)
+    dead_letters.dead_letter("film_work", 1, "transform", ValueError("no title"), {"id": 1})
+    dead_letters.dead_letter("film_work", 2, "index", {"type": "mapper_parsing_exception"})
+    errors = {entry["id"]: entry["error"] for entry in store.entries("film_work")}
+    assert errors == {"1": "ValueError: no title", "2": '{"type": "mapper_parsing_exception"}'}
+
+
+def test_dead_letter_without_store(monkeypatch):
+    monkeypatch.setattr(dead_letters.settings, "DEAD_LETTER_PATH", "")
+    dead_letters.dead_letter("film_work", 1, "transform", "error")
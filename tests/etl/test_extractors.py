@@ -0,0 +1,39 @@
+import psycopg2
+import pytest
+from conftest import SCHEMA
+from extractors import queries
+from extractors.film_work import FilmWorkExtractor
+from utils import backoff
+
+
+def test_declare_cursor_retries_after_failed_declare(pg_conn, monkeypatch):
+    extractor = FilmWorkExtractor(pg_conn, 10, None, schema=SCHEMA, itersize=2)
+
+    def create_table(seconds):
+        # the table appears while the extractor waits before the retry
+        with psycopg2.connect(pg_conn.dsn) as other, other.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {SCHEMA}.late AS SELECT 1 as one;")
+
+    monkeypatch.setattr(backoff.time, "sleep", create_table)
+    assert list(extractor.fetch_iter(f"SELECT one FROM {SCHEMA}.late", ())) == [{"one": 1}]
+
+
+def test_fetch_iter_resets_connection_on_error_while_iterating(pg_conn):
+    extractor = FilmWorkExtractor(pg_conn, 10, None, schema=SCHEMA, itersize=2)
+    rows = extractor.fetch_iter("SELECT 1 / (5 - x) as value FROM generate_series(1, 10) x", ())
+    with pytest.raises(psycopg2.errors.DivisionByZero):
+        list(rows)
+    assert extractor.fetch_all("SELECT 1 as one") == [{"one": 1}]
+
+
+def test_plan_stats_explains_a_sample_of_executions(pg_conn):
+    extractor = FilmWorkExtractor(pg_conn, 10, None, schema=SCHEMA, plan_stats=True, plan_stats_sample=3)
+    query = f"SELECT count(*) as films FROM {SCHEMA}.film_work WHERE rating > %s"
+    for _ in range(6):
+        assert extractor.fetch_all(query, (5,)) == [{"films": 0}]
+
+    with pg_conn.cursor() as cursor:
+        cursor.execute(queries.PLAN_CACHE_STATS, (list(extractor.planning_time),))
+        (stats,) = cursor.fetchall()
+    # six executions and two sampled EXPLAIN EXECUTE
+    assert stats["generic_plans"] + stats["custom_plans"] == 8
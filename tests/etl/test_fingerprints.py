@@ -0,0 +1,62 @@
+import sqlite3
+
+import pytest
+from utils import indices
+from utils.fingerprints import FingerprintStore, fingerprint
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FingerprintStore(str(tmp_path / "fingerprints.db"))
+
+
+def test_fingerprint_is_stable():
+    assert fingerprint({"id": 1, "name": "a"}) == fingerprint({"name": "a", "id": 1})
+    assert fingerprint({"id": 1, "name": "a"}) != fingerprint({"id": 1, "name": "b"})
+
+
+def test_save_get_delete(store):
+    store.save_many("movies", {"1": "a", "2": "b"})
+    store.save_many("movies", {"2": "c"})
+    store.save_many("genres", {"1": "x"})
+    assert store.get_many("movies", [1, 2, 3]) == {"1": "a", "2": "c"}
+    store.delete_many("movies", [1])
+    assert store.get_many("movies", ["1", "2"]) == {"2": "c"}
+    store.clear("movies")
+    assert store.get_many("movies", ["2"]) == {}
+    assert store.get_many("genres", ["1"]) == {"1": "x"}
+    assert store.get_many("genres", []) == {}
+
+
+def test_get_many_over_sqlite_variable_limit(store):
+    if not hasattr(store._connection, "setlimit"):
+        pytest.skip("Connection.setlimit needs Python 3.11")
+    # the limit of SQLite before 3.32
+    store._connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    hashes = {str(_id): f"h{_id}" for _id in range(2500)}
+    store.save_many("movies", hashes)
+    assert store.get_many("movies", hashes) == hashes
+
+
+class FakeIndicesClient:
+    def __init__(self):
+        self.created = []
+
+    def exists(self, index):
+        return index in self.created
+
+    def create(self, index, body):
+        self.created.append(index)
+
+
+class FakeClient:
+    def __init__(self):
+        self.indices = FakeIndicesClient()
+
+
+def test_bootstrap_index_clears_fingerprints(store, monkeypatch):
+    monkeypatch.setattr(indices, "get_fingerprint_store", lambda: store)
+    monkeypatch.setattr(indices, "load_schema", lambda alias: {})
+    store.save_many("movies", {"1": "a"})
+    indices.bootstrap_index(FakeClient(), "movies")
+    assert store.get_many("movies", ["1"]) == {}
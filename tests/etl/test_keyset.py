@@ -0,0 +1,39 @@
+import uuid
+
+from conftest import SCHEMA
+from extractors.film_work import FilmWorkExtractor
+
+TIE = "2021-06-16 20:14:09.22185+00"
+
+
+def insert_films(pg_conn, count: int) -> list[str]:
+    """Films which all share one updated_at. Returns their ids in keyset order"""
+    ids = sorted(str(uuid.uuid4()) for _ in range(count))
+    with pg_conn.cursor() as cursor:
+        for film_id in ids:
+            cursor.execute(
+                f"INSERT INTO {SCHEMA}.film_work (id, title, updated_at) VALUES (%s, 'Tie', %s);", (film_id, TIE)
+            )
+    pg_conn.commit()
+    return ids
+
+
+def test_keyset_pages_through_rows_with_equal_updated_at(pg_conn):
+    ids = insert_films(pg_conn, 5)
+    watermark, pages = None, []
+    while True:
+        extractor = FilmWorkExtractor(pg_conn, 2, watermark, schema=SCHEMA)
+        page = extractor.produce().get("film_work", ())
+        pages.append(page)
+        watermark = extractor.updated_at
+        if not extractor.has_more:
+            break
+
+    assert pages == [tuple(ids[:2]), tuple(ids[2:4]), tuple(ids[4:])]
+    assert watermark[1] == ids[-1]
+
+
+def test_legacy_watermark_resumes_from_the_first_row_of_its_tie(pg_conn):
+    ids = insert_films(pg_conn, 3)
+    extractor = FilmWorkExtractor(pg_conn, 10, TIE, schema=SCHEMA)
+    assert extractor.produce()["film_work"] == tuple(ids)
@@ -0,0 +1,55 @@
+import json
+import threading
+import time
+
+import main
+from utils.listener import ChangeListener
+
+CHANNEL = "etl_test_changes"
+
+
+def notify(pg_conn, table: str):
+    with pg_conn.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s);", (CHANNEL, json.dumps({"table": table})))
+    pg_conn.commit()
+
+
+def test_listener_collects_a_burst_of_changes_for_the_debounce_time(pg_conn):
+    listener = ChangeListener(pg_conn.dsn, CHANNEL, debounce=0.5)
+    try:
+        assert listener.wait(0.01) == set()  # LISTEN before the changes
+        notify(pg_conn, "genre")
+        threading.Timer(0.1, notify, (pg_conn, "person")).start()
+        started = time.monotonic()
+        assert listener.wait(10) == {"genre", "person"}
+        assert time.monotonic() - started < 2
+
+        time.sleep(0.2)
+        notify(pg_conn, "film_work")
+        assert listener.wait(10) == {"film_work"}
+    finally:
+        listener.close()
+
+
+def test_lost_listener_falls_back_to_polling_and_reconnects(pg_conn):
+    listener = ChangeListener(pg_conn.dsn, CHANNEL, debounce=0.1)
+    try:
+        listener.wait(0.01)
+        with pg_conn.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s);", (listener._connection.get_backend_pid(),))
+        pg_conn.commit()
+        notify(pg_conn, "genre")
+        # an empty set makes the runtime poll every table
+        assert listener.wait(0.2) == set()
+
+        listener.wait(0.01)
+        notify(pg_conn, "genre")
+        assert listener.wait(10) == {"genre"}
+    finally:
+        listener.close()
+
+
+def test_wait_for_changes_without_listener_polls_after_timeout():
+    started = time.monotonic()
+    assert main.wait_for_changes(None, 0.05) == set()
+    assert time.monotonic() - started >= 0.05
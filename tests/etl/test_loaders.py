@@ -0,0 +1,151 @@
+import asyncio
+import json
+
+import elastic_transport
+import pytest
+from benchmarks import sink
+from elasticsearch import Elasticsearch
+from loaders.aio import AsyncLoader
+from loaders.genre import GenreLoader
+from models import Genre
+from utils import dead_letters
+from utils.fingerprints import FingerprintStore
+
+GOOD, BUSY, BAD = "00000000-0000-0000-0000-000000000001", "00000000-0000-0000-0000-000000000002", "bad"
+UNAVAILABLE = "00000000-0000-0000-0000-000000000003"
+
+
+class FlakyNode(sink.FakeBulkNode):
+    """Answers 429 to the first attempt of BUSY, 503 to the first attempt of UNAVAILABLE
+    and 400 (mapping error) to every attempt of BAD
+    """
+
+    attempts: dict[str, int] = {}
+
+    @staticmethod
+    def _bulk(body: bytes) -> list[dict]:
+        items = sink.FakeBulkNode._bulk(body)
+        for item in items:
+            (info,) = item.values()
+            FlakyNode.attempts[info["_id"]] = FlakyNode.attempts.get(info["_id"], 0) + 1
+            if info["_id"] == BUSY and FlakyNode.attempts[BUSY] == 1:
+                info.update(status=429, error={"type": "es_rejected_execution_exception"})
+            elif info["_id"] == UNAVAILABLE and FlakyNode.attempts[UNAVAILABLE] == 1:
+                info.update(status=503, error={"type": "unavailable_shards_exception"})
+            elif info["_id"] == BAD:
+                info.update(status=400, error={"type": "strict_dynamic_mapping_exception"})
+        return items
+
+
+@pytest.fixture
+def client():
+    FlakyNode.attempts = {}
+    return Elasticsearch("http://sink:9200", node_class=FlakyNode)
+
+
+@pytest.fixture
+def dead_letter_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(dead_letters.settings, "DEAD_LETTER_PATH", str(tmp_path / "dead_letters.db"))
+    monkeypatch.setattr(dead_letters, "_store", None)
+    return dead_letters.get_dead_letter_store()
+
+
+@pytest.mark.parametrize("mode", ["bulk", "streaming", "parallel", "adaptive"])
+def test_load_retries_busy_and_dead_letters_rejected(client, dead_letter_store, mode):
+    loader = GenreLoader("genres", 10, client, mode)
+    genres = [Genre.model_construct(id=_id, name=_id) for _id in (GOOD, BUSY, UNAVAILABLE, BAD)]
+    assert loader.load(genres) == 3
+    assert FlakyNode.attempts[BUSY] == FlakyNode.attempts[UNAVAILABLE] == 2
+    assert [entry["id"] for entry in dead_letter_store.entries()] == [BAD]
+    assert "strict_dynamic_mapping_exception" in dead_letter_store.entries()[0]["error"]
+
+
+class OverloadedNode(sink.FakeBulkNode):
+    """Drops the connection of the first bulk request and answers 429 to every attempt of BUSY"""
+
+    requests = 0
+
+    def perform_request(self, method, target, body=None, headers=None, request_timeout=None):
+        OverloadedNode.requests += 1
+        if OverloadedNode.requests == 1:
+            raise elastic_transport.ConnectionError("Connection reset by peer")
+        return super().perform_request(method, target, body, headers, request_timeout)
+
+    @staticmethod
+    def _bulk(body: bytes) -> list[dict]:
+        items = FlakyNode._bulk(body)
+        for item in items:
+            (info,) = item.values()
+            if info["_id"] == BUSY:
+                info.update(status=429, error={"type": "es_rejected_execution_exception"})
+        return items
+
+
+@pytest.mark.parametrize("mode", ["streaming", "parallel"])
+def test_streaming_resends_lost_requests_and_gives_up_on_busy(dead_letter_store, monkeypatch, mode):
+    FlakyNode.attempts, OverloadedNode.requests = {}, 0
+    monkeypatch.setattr("loaders.base.time.sleep", lambda seconds: None)
+    client = Elasticsearch("http://sink:9200", node_class=OverloadedNode, max_retries=0)
+    loader = GenreLoader("genres", 2, client, mode, thread_count=1, max_retries=2)
+    ids = [f"00000000-0000-0000-0000-00000000001{number}" for number in range(5)]
+    genres = [Genre.model_construct(id=_id, name=_id) for _id in (*ids, BUSY)]
+
+    assert loader.load(genres) == len(ids)
+    # the documents of the lost request are sent again. Parallel bulk may have sent the following chunks before
+    # the error surfaced, they are sent again too: an update with the same document is idempotent
+    resent = mode == "parallel" and 2 or 1
+    assert all(1 <= FlakyNode.attempts[_id] <= resent for _id in ids)
+    assert FlakyNode.attempts[BUSY] == 3
+    assert [entry["id"] for entry in dead_letter_store.entries()] == [BUSY]
+    assert "after 2 retries" in dead_letter_store.entries()[0]["error"]
+
+
+def test_load_raw_retries_busy_and_dead_letters_rejected(client, dead_letter_store):
+    loader = GenreLoader("genres", 10, client, "bulk")
+    rows = [{"_id": _id, "doc": json.dumps({"id": _id, "name": _id})} for _id in (GOOD, BUSY, BAD)]
+    assert loader.load_raw(rows) == 2
+    assert FlakyNode.attempts[BUSY] == 2
+    assert [entry["id"] for entry in dead_letter_store.entries()] == [BAD]
+
+
+class FakeAsyncClient:
+    """Async bulk endpoint over the same flaky node"""
+
+    def __init__(self, connection_errors: int = 0):
+        self.connection_errors = connection_errors
+        self.requests = 0
+
+    async def bulk(self, operations):
+        self.requests += 1
+        if self.connection_errors:
+            self.connection_errors -= 1
+            raise elastic_transport.ConnectionError("Connection refused")
+        items = FlakyNode._bulk(b"\n".join(operations))
+        return {"errors": any("error" in info for item in items for info in item.values()), "items": items}
+
+
+def test_async_load_raw_retries_busy_and_dead_letters_rejected(client, dead_letter_store):
+    loader = AsyncLoader(GenreLoader("genres", 10, client, "bulk"), FakeAsyncClient())
+    rows = [{"_id": _id, "doc": json.dumps({"id": _id, "name": _id})} for _id in (GOOD, BUSY, BAD)]
+    assert asyncio.run(loader.load_raw(rows)) == 2
+    assert FlakyNode.attempts[BUSY] == 2
+    assert [entry["id"] for entry in dead_letter_store.entries()] == [BAD]
+
+
+def test_async_load_retries_busy_and_dead_letters_rejected(client, dead_letter_store):
+    loader = AsyncLoader(GenreLoader("genres", 10, client, "bulk"), FakeAsyncClient(connection_errors=1))
+    genres = [Genre.model_construct(id=_id, name=_id) for _id in (GOOD, BUSY, UNAVAILABLE, BAD)]
+    assert asyncio.run(loader.load(genres)) == 3
+    assert loader.client.requests == 3  # refused, first attempt, retry of BUSY and UNAVAILABLE
+    assert FlakyNode.attempts[BUSY] == FlakyNode.attempts[UNAVAILABLE] == 2
+    assert [entry["id"] for entry in dead_letter_store.entries()] == [BAD]
+
+
+def test_async_load_skips_unchanged_documents(client, tmp_path):
+    fingerprints = FingerprintStore(str(tmp_path / "fingerprints.db"))
+    loader = AsyncLoader(GenreLoader("genres", 10, client, "bulk", fingerprints=fingerprints), FakeAsyncClient())
+    genres = [Genre.model_construct(id=_id, name=_id) for _id in (GOOD, BUSY)]
+    assert asyncio.run(loader.load(genres)) == 2
+    requests = loader.client.requests
+    assert asyncio.run(loader.load(genres)) == 0
+    assert loader.client.requests == requests
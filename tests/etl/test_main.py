@@ -0,0 +1,107 @@
+import asyncio
+import contextlib
+import threading
+
+import main
+import pytest
+from utils.runtime import PollScheduler, shutdown
+from utils.state import JsonFileStorage, State
+
+
+class FakeConnection:
+    round_trips = 0
+
+
+class FakePool:
+    @contextlib.contextmanager
+    def connection(self):
+        yield FakeConnection()
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """Tables run by each worker thread. The genre worker fails on every run"""
+    runs: dict[str, list[str]] = {}
+    lock = threading.Lock()
+
+    def run_etl(pg_conn, extractor_class, chunk_size, state):
+        table = extractor_class.TABLE_NAME
+        with lock:
+            runs.setdefault(threading.current_thread().name, []).append(table)
+            if all(len(tables) >= 3 for tables in runs.values()) and len(runs) == len(main.EXTRACTORS_DATA):
+                shutdown.set()
+        if table == "genre":
+            raise RuntimeError("genre is broken")
+        return False
+
+    monkeypatch.setattr(main, "run_etl", run_etl)
+    monkeypatch.setattr(main, "create_scheduler", lambda: PollScheduler(0.01, 0.01))
+    yield runs
+    shutdown.clear()
+
+
+def test_run_concurrent_runs_each_table_in_its_own_worker(runs, tmp_path):
+    main.run_concurrent(FakePool(), State(JsonFileStorage(str(tmp_path / "state.json"))))
+    assert len(runs) == len(main.EXTRACTORS_DATA)
+    assert all(len(set(tables)) == 1 for tables in runs.values())
+    assert sorted(tables[0] for tables in runs.values()) == sorted(
+        extractor_class.TABLE_NAME for extractor_class, _ in main.EXTRACTORS_DATA
+    )
+    # the failing genre worker does not stop the others, nor itself
+    assert all(len(tables) >= 3 for tables in runs.values())
+
+
+class FakeAsyncResource:
+    closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def test_run_async_processes_deletions_and_closes_clients(monkeypatch, tmp_path):
+    calls = []
+    pool, client, deletions_conn = FakeAsyncResource(), FakeAsyncResource(), FakeConnection()
+    deletions_conn.close = lambda: calls.append("deletions connection closed")
+
+    class FakeManager:
+        def __init__(self, pool, client, extractors_data, *args, **kwargs):
+            calls.append(sorted(extractor_class.TABLE_NAME for extractor_class, _ in extractors_data))
+
+        async def run(self):
+            calls.append("async cycle")
+            shutdown.set()
+            return False
+
+    def run_etl(pg_conn, extractor_class, chunk_size, state):
+        connection = pg_conn is deletions_conn and "own" or "shared"
+        calls.append(f"{extractor_class.TABLE_NAME} on {connection} connection")
+        return False
+
+    async def async_elastic_connect(*args, **kwargs):
+        return client
+
+    async def asyncpg_pool_connect(*args, **kwargs):
+        return pool
+
+    monkeypatch.setattr(main, "EXTRACTORS_DATA", main.EXTRACTORS_DATA + (main.DELETIONS_DATA,))
+    monkeypatch.setattr(main, "create_indexes", lambda: None)
+    monkeypatch.setattr(main, "create_state", lambda: State(JsonFileStorage(str(tmp_path / "state.json"))))
+    monkeypatch.setattr(main, "asyncpg_pool_connect", asyncpg_pool_connect)
+    monkeypatch.setattr(main, "async_elastic_connect", async_elastic_connect)
+    monkeypatch.setattr(main, "postgres_connect", lambda dsn: deletions_conn)
+    monkeypatch.setattr(main, "AsyncETLManager", FakeManager)
+    monkeypatch.setattr(main, "run_etl", run_etl)
+    monkeypatch.setattr(main.shared_elastic_client, "close", lambda: calls.append("sync client closed"))
+    try:
+        asyncio.run(main.run_async())
+    finally:
+        shutdown.clear()
+
+    assert calls == [
+        ["film_work", "genre", "person"],
+        "etl_tombstone on own connection",
+        "async cycle",
+        "deletions connection closed",
+        "sync client closed",
+    ]
+    assert pool.closed and client.closed
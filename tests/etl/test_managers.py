@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+import managers
+import pytest
+from extractors.film_work import FilmWorkExtractor
+from extractors.tombstone import TombstoneExtractor
+from prometheus_client import REGISTRY
+from utils.state import JsonFileStorage, State
+
+WATERMARK = ["2021-06-16 20:14:09.221850+00:00", "00000000-0000-0000-0000-000000000001"]
+
+
+class EnrichedAwayExtractor(FilmWorkExtractor):
+    """A chunk of changed ids whose rows are gone by the time they are enriched"""
+
+    def extract(self):
+        self.has_more = False
+        self.updated_at = WATERMARK
+        return {"film_work": iter([])}, self.updated_at
+
+
+def test_pipelined_saves_watermark_of_chunk_without_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(managers, "load", lambda *args, **kwargs: 0)
+    state = State(JsonFileStorage(str(tmp_path / "state.json")))
+    manager = managers.PipelinedETLManager(None, EnrichedAwayExtractor, 10, 10, state)
+    assert manager.run() is False
+    assert state.get("film_work_updated_at") == WATERMARK
+
+
+class ThreeChunksExtractor(FilmWorkExtractor):
+    """Three chunks of one film each, a chunk's film is updated on the day of the chunk number"""
+
+    chunks = 0
+
+    def extract(self):
+        self.chunks += 1
+        self.has_more = self.chunks < 3
+        self.updated_at = [f"2021-06-0{self.chunks} 00:00:00+00:00", f"film-{self.chunks}"]
+        return {"film_work": iter([{"id": f"film-{self.chunks}"}])}, self.updated_at
+
+
+def test_pipelined_loads_every_chunk_and_saves_watermarks_in_order(tmp_path, monkeypatch):
+    loaded, saved = [], []
+
+    def load(table, items, *args):
+        loaded.extend(item["id"] for item in items)
+        return len(items)
+
+    monkeypatch.setattr(managers, "transform", lambda table, rows: rows)
+    monkeypatch.setattr(managers, "load", load)
+    state = State(JsonFileStorage(str(tmp_path / "state.json")))
+    monkeypatch.setattr(state, "set", lambda key, value: saved.append(value))
+    manager = managers.PipelinedETLManager(None, ThreeChunksExtractor, 10, 10, state, queue_size=1)
+
+    assert manager.run() is False
+    assert loaded == ["film-1", "film-2", "film-3"]
+    assert [watermark[1] for watermark in saved] == loaded
+
+
+def test_pipelined_stops_on_load_error_without_saving_its_watermark(tmp_path, monkeypatch):
+    saved = []
+
+    def load(table, items, *args):
+        if any(item["id"] == "film-2" for item in items):
+            raise RuntimeError("Elasticsearch is down")
+        return len(items)
+
+    monkeypatch.setattr(managers, "transform", lambda table, rows: rows)
+    monkeypatch.setattr(managers, "load", load)
+    state = State(JsonFileStorage(str(tmp_path / "state.json")))
+    monkeypatch.setattr(state, "set", lambda key, value: saved.append(value))
+    manager = managers.PipelinedETLManager(None, ThreeChunksExtractor, 10, 10, state, queue_size=1)
+
+    with pytest.raises(RuntimeError, match="Elasticsearch is down"):
+        manager.run()
+    assert [watermark[1] for watermark in saved] == ["film-1"]
+
+
+class PendingTombstones(TombstoneExtractor):
+    """One chunk with a deleted genre and a film which referenced it"""
+
+    def extract(self):
+        self.has_more = False
+        self.seqs = [1, 2]
+        self.last_created_at = "2021-06-16 20:14:09.221850+00:00"
+        self.deleted = {"film_work": (), "genre": ("genre-1",), "person": ()}
+        self.purged = False
+        return {"film_work": iter([{"id": "film-1"}])}, 2
+
+    def purge(self):
+        self.purged = True
+
+
+def test_deletion_manager_reports_deleted_documents(tmp_path, monkeypatch):
+    reindexed = []
+
+    def load(table, items, *args):
+        reindexed.extend(items)
+        return len(reindexed)
+
+    monkeypatch.setattr(managers, "load", load)
+    monkeypatch.setattr(managers, "transform", lambda table, rows: rows)
+    monkeypatch.setattr(managers, "delete", lambda table, ids, chunk_size: len(ids))
+    extractor = PendingTombstones(None, 10, None)
+    monkeypatch.setattr(managers.DeletionETLManager, "_create_extractor", lambda self: extractor)
+    deleted = REGISTRY.get_sample_value("etl_rows_total", {"table": "genre", "stage": "delete"}) or 0
+    state = State(JsonFileStorage(str(tmp_path / "state.json")))
+
+    manager = managers.DeletionETLManager(SimpleNamespace(round_trips=0), TombstoneExtractor, 10, 10, state)
+    assert manager.run() is False
+    assert reindexed == [{"id": "film-1"}]
+    assert extractor.purged
+    assert REGISTRY.get_sample_value("etl_rows_total", {"table": "genre", "stage": "delete"}) == deleted + 1
+    assert REGISTRY.get_sample_value("etl_freshness_lag_seconds", {"table": "etl_tombstone"}) == 0
+    assert not (tmp_path / "state.json").exists()
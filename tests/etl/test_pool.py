@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from utils.connectors import PostgresPool
+
+
+@pytest.fixture
+def pool(pg_conn):
+    pool = PostgresPool(pg_conn.dsn, size=1, healthcheck_interval=60)
+    yield pool
+    pool.close()
+
+
+def test_exhausted_pool_waits_for_a_released_connection(pool):
+    released, got = threading.Event(), []
+
+    def borrow():
+        with pool.connection() as connection:
+            got.append(connection)
+            # the worker only gets the connection once the main thread released it
+            got.append(released.is_set())
+
+    with pool.connection() as connection:
+        worker = threading.Thread(target=borrow)
+        worker.start()
+        worker.join(0.2)
+        assert worker.is_alive()
+        released.set()
+    worker.join(5)
+    assert got == [connection, True]
+
+
+def test_released_connection_is_rolled_back_and_reused(pool):
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+        assert connection.get_transaction_status() != TRANSACTION_STATUS_IDLE
+    assert connection.get_transaction_status() == TRANSACTION_STATUS_IDLE
+
+    with pool.connection() as reused:
+        assert reused is connection
+
+
+def test_connection_of_a_failed_job_is_closed(pool):
+    with pytest.raises(RuntimeError):
+        with pool.connection() as connection:
+            raise RuntimeError("job failed")
+    assert connection.closed
+
+    with pool.connection() as fresh:
+        assert fresh is not connection and not fresh.closed
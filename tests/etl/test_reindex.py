@@ -0,0 +1,36 @@
+import reindex
+from conftest import SCHEMA
+
+
+def in_test_schema(extractor_class):
+    class TestSchemaExtractor(extractor_class):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, schema=SCHEMA, **kwargs)
+
+    return TestSchemaExtractor
+
+
+def test_catch_up_reloads_films_of_renamed_person(pg_conn, content, monkeypatch):
+    loaded: dict[str, set] = {}
+
+    def load(table, rows, *args, index_name=None, **kwargs):
+        rows = list(rows)
+        loaded.setdefault(index_name, set()).update(str(row.id) for row in rows)
+        return len(rows)
+
+    monkeypatch.setattr(reindex, "load", load)
+    monkeypatch.setattr(
+        reindex, "EXTRACTORS", {alias: in_test_schema(cls) for alias, cls in reindex.EXTRACTORS.items()}
+    )
+    with pg_conn.cursor() as cursor:
+        cursor.execute("SELECT now()::text as now;")
+        started_at = cursor.fetchone()["now"]
+        cursor.execute(
+            f"UPDATE {SCHEMA}.person SET full_name = 'Ann Lee-Smith', updated_at = now() + interval '1 second' "
+            "WHERE id = %s;",
+            (content["person"],),
+        )
+    pg_conn.commit()
+
+    assert reindex.catch_up(pg_conn, "film_work", "movies_v2", started_at) == 1
+    assert loaded == {"movies_v2": {content["film"]}}
@@ -0,0 +1,18 @@
+from utils.runtime import PollScheduler
+
+
+def test_poll_scheduler_backs_off_while_idle():
+    scheduler = PollScheduler(1, 5)
+    assert [scheduler.next_delay(False) for _ in range(5)] == [1, 2, 4, 5, 5]
+
+
+def test_poll_scheduler_polls_at_once_while_behind():
+    scheduler = PollScheduler(1, 5)
+    scheduler.next_delay(False)
+    scheduler.next_delay(False)
+    assert scheduler.next_delay(True) == 0
+    assert scheduler.next_delay(False) == 1
+
+
+def test_poll_scheduler_min_interval_is_capped():
+    assert PollScheduler(10, 5).next_delay(False) == 5
@@ -0,0 +1,13 @@
+from utils.state import JsonFileStorage, State
+
+
+def test_refresh_rereads_state_changed_by_another_process(tmp_path):
+    path = str(tmp_path / "state.json")
+    state, other = State(JsonFileStorage(path)), State(JsonFileStorage(path))
+    state.set("film_work_updated_at", ["2021-06-16 20:14:09+00:00", "1"])
+    assert other.get("film_work_updated_at") == ["2021-06-16 20:14:09+00:00", "1"]
+
+    state.set("film_work_updated_at", None)
+    assert other.get("film_work_updated_at") is not None
+    other.refresh()
+    assert other.get("film_work_updated_at") is None
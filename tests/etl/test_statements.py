@@ -0,0 +1,58 @@
+from conftest import SCHEMA
+from extractors import queries
+from extractors.film_work import FilmWorkExtractor
+from utils import statements
+
+
+class FakeCursor:
+    def __init__(self, executed: list):
+        self.executed = executed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        self.executed.append(query)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.executed: list[str] = []
+
+    def cursor(self):
+        return FakeCursor(self.executed)
+
+
+def test_numbered():
+    assert statements.numbered("SELECT %s::uuid[], %s LIMIT %s") == "SELECT $1::uuid[], $2 LIMIT $3"
+
+
+def test_prepare_repeats_casts_in_execute():
+    connection = FakeConnection()
+    name, execute = statements.prepare(connection, "SELECT * FROM t WHERE id = ANY(%s::uuid[]) LIMIT %s")
+    assert connection.executed == [f"PREPARE {name} AS SELECT * FROM t WHERE id = ANY($1::uuid[]) LIMIT $2"]
+    assert execute == f"EXECUTE {name} (%s::uuid[], %s);"
+
+
+def test_prepare_once_per_connection():
+    connection = FakeConnection()
+    first = statements.prepare(connection, "SELECT 1")
+    second = statements.prepare(connection, "SELECT 1")
+    assert first == second
+    assert first[1].endswith("EXECUTE {0};".format(first[0]))
+    assert len(connection.executed) == 1
+
+
+def test_fetch_all_with_id_list(pg_conn, content):
+    extractor = FilmWorkExtractor(pg_conn, 10, None, schema=SCHEMA)
+    query = extractor.compose(queries.ENRICH_FILM_WORK)
+    rows = extractor.fetch_all(query, ([content["film"], content["other_film"]],))
+    assert {row["id"] for row in rows} == {content["film"], content["other_film"]}
+    film = next(row for row in rows if row["id"] == content["film"])
+    assert film["genres"] == [{"id": content["genre"], "name": "Sci-Fi"}]
+    assert film["actors"] == [{"id": content["person"], "name": "Ann Lee"}]
+    # the statement is prepared once and executed again
+    assert len(extractor.fetch_all(query, ([content["film"]],))) == 1
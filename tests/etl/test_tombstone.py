@@ -0,0 +1,27 @@
+from conftest import SCHEMA
+from extractors.tombstone import TombstoneExtractor
+
+
+def test_purge_keeps_tombstones_committed_below_the_watermark(pg_conn, content):
+    with pg_conn.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE {SCHEMA}.etl_tombstone (seq bigint PRIMARY KEY, table_name text, id uuid, related_id uuid,"
+            " created_at timestamptz NOT NULL DEFAULT now());"
+            f"INSERT INTO {SCHEMA}.etl_tombstone VALUES (5, 'genre_film_work', %(film)s, %(genre)s);",
+            content,
+        )
+    pg_conn.commit()
+    extractor = TombstoneExtractor(pg_conn, 10, None, schema=SCHEMA)
+    extractor.produce()
+    assert extractor.updated_at == 5
+    assert extractor.last_created_at is not None
+
+    # a slower transaction commits its tombstone with a lower seq meanwhile
+    with pg_conn.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SCHEMA}.etl_tombstone VALUES (3, 'person', %(person)s, NULL);", content)
+    pg_conn.commit()
+    extractor.purge()
+
+    changes = extractor.produce()
+    assert extractor.seqs == [3]
+    assert changes["film_work"] == (content["film"],)